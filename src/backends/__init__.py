@@ -2,10 +2,12 @@
 
 from .content_fetcher import AbstractContentFetcher, ContentFetcherFactory
 from .search import AbstractSearchClient, SearchClientFactory
+from .transport import HTTPTransport
 
 __all__ = [
     "ContentFetcherFactory",
     "AbstractContentFetcher",
     "SearchClientFactory",
     "AbstractSearchClient",
+    "HTTPTransport",
 ]
@@ -0,0 +1,184 @@
+"""Admission control of backend calls: bounded concurrency, a priority-ordered wait queue and load shedding."""
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+# Served in this order; a request of an earlier class is always admitted before a waiting later one
+PRIORITIES = ("interactive", "batch")
+
+# Reasons a request is shed
+QUEUE_FULL = "queue full"
+DEADLINE = "deadline cannot be met"
+TIMEOUT = "waited too long"
+
+# Called with (priority, seconds waited, rejection reason or None when admitted)
+AdmissionObserver = Callable[[str, float, Optional[str]], None]
+
+
+class AdmissionRejected(Exception):
+    """A backend call was shed because the backend is saturated."""
+
+    def __init__(self, backend: str, priority: str, reason: str, retry_after: int):
+        super().__init__(f"The {backend} backend is overloaded ({reason}); retry after {retry_after} seconds")
+        self.backend = backend
+        self.priority = priority
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Limits concurrent calls to one backend and queues the rest by priority.
+
+    At most ``max_concurrency`` calls run at once. Further calls wait in a queue of
+    at most ``max_queue`` entries, ordered by priority class and then arrival. A call
+    is shed with :class:`AdmissionRejected` right away when the queue is full, or when
+    the expected wait (from the average call duration) exceeds the maximum wait of its
+    class; it is also shed when it has waited that long. A full queue makes room for
+    a higher-priority call by shedding the most recent call of the lowest class.
+    Meant to be used from one event loop.
+    """
+
+    def __init__(
+        self,
+        backend: str,
+        max_concurrency: int = 16,
+        max_queue: int = 64,
+        max_wait: Optional[Dict[str, float]] = None,
+        observer: Optional[AdmissionObserver] = None,
+    ):
+        """Initialize the controller.
+
+        Args:
+            backend: Backend name used in rejection messages
+            max_concurrency: Calls running at once
+            max_queue: Calls waiting at once, across all priority classes
+            max_wait: Longest wait in seconds per priority class
+            observer: Called with the outcome of every admission, e.g. to export wait times
+        """
+        if max_concurrency <= 0:
+            raise ValueError("max_concurrency must be a positive integer")
+        self.backend = backend
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = {"interactive": 5.0, "batch": 60.0, **(max_wait or {})}
+        self._observer = observer
+        self._in_use = 0
+        # (priority rank, arrival, future); entries whose future is done are stale
+        self._queue: List[Tuple[int, int, asyncio.Future]] = []
+        self._queued = {priority: 0 for priority in PRIORITIES}
+        self._arrivals = itertools.count()
+        # Moving average of how long a call holds its slot
+        self._service_time = 0.0
+
+    @asynccontextmanager
+    async def admit(self, priority: str) -> AsyncIterator[None]:
+        """Hold a slot for one backend call, waiting for it if needed.
+
+        Raises:
+            AdmissionRejected: When the call is shed
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority {priority}; valid options are [{'|'.join(PRIORITIES)}]")
+        await self._acquire(priority)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - start)
+
+    def in_use(self) -> int:
+        return self._in_use
+
+    def queued(self) -> Dict[str, int]:
+        """Number of waiting calls per priority class."""
+        return dict(self._queued)
+
+    async def _acquire(self, priority: str) -> None:
+        rank = PRIORITIES.index(priority)
+        ahead = sum(self._queued[name] for name in PRIORITIES[: rank + 1])
+        if self._in_use < self.max_concurrency and ahead == 0:
+            self._in_use += 1
+            self._observe(priority, 0.0, None)
+            return
+
+        max_wait = self.max_wait[priority]
+        if self._expected_wait(ahead + 1) > max_wait:
+            self._reject(priority, DEADLINE, 0.0)
+        if sum(self._queued.values()) >= self.max_queue and not self._shed_lower(rank):
+            self._reject(priority, QUEUE_FULL, 0.0)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (rank, next(self._arrivals), future))
+        self._queued[priority] += 1
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(future, max_wait)
+        except asyncio.TimeoutError:
+            if not future.done() or future.cancelled():
+                self._queued[priority] -= 1
+                self._reject(priority, TIMEOUT, time.monotonic() - start)
+            # The timeout fired in the same loop tick as the call was handed a slot or shed
+            if future.exception() is not None:
+                self._observe(priority, time.monotonic() - start, QUEUE_FULL)
+                raise future.exception() from None
+        except AdmissionRejected:
+            # Shed from the queue by a higher-priority call, which already updated the counts
+            self._observe(priority, time.monotonic() - start, QUEUE_FULL)
+            raise
+        except asyncio.CancelledError:
+            if not future.done() or future.cancelled():
+                # Still waiting in the queue when the caller went away
+                self._queued[priority] -= 1
+            elif future.exception() is None:
+                # The slot was handed over just as the caller went away; it held it for no time at all
+                self._hand_over()
+            # Otherwise it was shed just before, which already updated the counts
+            raise
+        self._observe(priority, time.monotonic() - start, None)
+
+    def _release(self, held: float) -> None:
+        self._service_time = held if self._service_time == 0.0 else 0.8 * self._service_time + 0.2 * held
+        self._hand_over()
+
+    def _hand_over(self) -> None:
+        """Give the slot to the next waiting call, or free it if none is waiting."""
+        while self._queue:
+            rank, _, future = heapq.heappop(self._queue)
+            if future.done():
+                continue
+            # Hand the slot over directly, so a new arrival cannot take it first
+            self._queued[PRIORITIES[rank]] -= 1
+            future.set_result(None)
+            return
+        self._in_use -= 1
+
+    def _shed_lower(self, rank: int) -> bool:
+        """Shed the most recent waiting call of the lowest class below ``rank`` to make room in the queue."""
+        candidates = [entry for entry in self._queue if entry[0] > rank and not entry[2].done()]
+        if not candidates:
+            return False
+        victim_rank, _, future = max(candidates, key=lambda entry: (entry[0], entry[1]))
+        self._queued[PRIORITIES[victim_rank]] -= 1
+        future.set_exception(self._rejection(PRIORITIES[victim_rank], QUEUE_FULL))
+        return True
+
+    def _expected_wait(self, position: int) -> float:
+        """Seconds until the call at ``position`` in the queue gets a slot, estimated from recent calls."""
+        return math.ceil(position / self.max_concurrency) * self._service_time
+
+    def _reject(self, priority: str, reason: str, waited: float) -> None:
+        self._observe(priority, waited, reason)
+        raise self._rejection(priority, reason)
+
+    def _rejection(self, priority: str, reason: str) -> AdmissionRejected:
+        retry_after = max(1, math.ceil(self._expected_wait(sum(self._queued.values()) + 1)))
+        return AdmissionRejected(self.backend, priority, reason, retry_after)
+
+    def _observe(self, priority: str, waited: float, rejected: Optional[str]) -> None:
+        if self._observer is not None:
+            self._observer(priority, waited, rejected)
@@ -0,0 +1,206 @@
+"""Circuit breaking of backend calls that keep failing or getting slow."""
+
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+import requests
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATES = (CLOSED, OPEN, HALF_OPEN)
+
+# Called with (backend, new state) on every state change
+BreakerObserver = Callable[[str, str], None]
+
+
+def is_backend_failure(exc: BaseException) -> bool:
+    """Whether an error says the backend is unhealthy, rather than that the request was bad."""
+    if isinstance(exc, requests.exceptions.HTTPError):
+        response = getattr(exc, "response", None)
+        return response is None or response.status_code >= 500
+    return isinstance(
+        exc, (BackendUnavailable, requests.exceptions.RequestException, asyncio.TimeoutError, TimeoutError)
+    )
+
+
+def raise_if_unavailable(exc: BaseException) -> None:
+    """Raise :class:`BackendUnavailable` from ``exc`` when it says the backend is unhealthy."""
+    if is_backend_failure(exc):
+        raise BackendUnavailable(f"The backend could not answer: {exc}") from exc
+
+
+class BackendUnavailable(Exception):
+    """A backend could not be reached or failed to answer, as opposed to finding nothing."""
+
+
+class CircuitOpen(Exception):
+    """A backend call was refused because the backend's circuit breaker is open."""
+
+    def __init__(self, backend: str, retry_after: int):
+        super().__init__(f"The {backend} backend is unavailable; retry after {retry_after} seconds")
+        self.backend = backend
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Stops sending calls to a backend that fails or slows down, and probes it before resuming.
+
+    Outcomes of the calls of the last ``window`` seconds are kept. Once at least
+    ``min_calls`` were made, the breaker opens when the share of failed calls reaches
+    ``failure_rate`` or the share of calls slower than ``slow_call_duration`` reaches
+    ``slow_call_rate``. An open breaker refuses calls for ``open_duration`` seconds,
+    then half-opens: up to ``half_open_calls`` probe calls are let through, and the
+    breaker closes once they all succeed or opens again as soon as one fails or is slow.
+    Safe to use from several threads.
+    """
+
+    def __init__(
+        self,
+        backend: str,
+        window: float = 30.0,
+        min_calls: int = 10,
+        failure_rate: float = 0.5,
+        slow_call_duration: float = 5.0,
+        slow_call_rate: float = 0.8,
+        open_duration: float = 30.0,
+        half_open_calls: int = 3,
+        observer: Optional[BreakerObserver] = None,
+    ):
+        """Initialize the breaker.
+
+        Args:
+            backend: Backend name used in messages
+            window: Seconds of call outcomes the rates are computed over
+            min_calls: Calls in the window needed before the breaker may open
+            failure_rate: Share of failed calls that opens the breaker
+            slow_call_duration: Seconds after which a call counts as slow
+            slow_call_rate: Share of slow calls that opens the breaker
+            open_duration: Seconds calls are refused before probing the backend
+            half_open_calls: Probe calls that must succeed to close the breaker
+            observer: Called on every state change, e.g. to export the state
+        """
+        self.backend = backend
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate = slow_call_rate
+        self.open_duration = open_duration
+        self.half_open_calls = half_open_calls
+        self._observer = observer
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self.opened = 0
+        # (time, failed, slow) of each call of the window
+        self._outcomes: Deque[Tuple[float, bool, bool]] = deque()
+        self._failures = 0
+        self._slow_calls = 0
+        self._probes = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._expire_open(time.monotonic())
+            return self._state
+
+    def allow(self) -> bool:
+        """Whether a call may go to the backend now.
+
+        Every allowed call must be followed by :meth:`record`, or :meth:`release` when
+        it never reached the backend.
+        """
+        with self._lock:
+            self._expire_open(time.monotonic())
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probes + self._probe_successes < self.half_open_calls:
+                self._probes += 1
+                return True
+            return False
+
+    def record(self, duration: float, failed: bool) -> None:
+        """Record the outcome of an allowed call."""
+        slow = duration >= self.slow_call_duration
+        now = time.monotonic()
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+                if failed or slow:
+                    self._transition(OPEN, now)
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_calls:
+                        self._transition(CLOSED, now)
+                return
+            if self._state == OPEN:
+                # A call allowed before the breaker opened
+                return
+
+            self._outcomes.append((now, failed, slow))
+            self._failures += failed
+            self._slow_calls += slow
+            self._prune(now)
+            calls = len(self._outcomes)
+            if calls < self.min_calls:
+                return
+            if self._failures / calls >= self.failure_rate or self._slow_calls / calls >= self.slow_call_rate:
+                self._transition(OPEN, now)
+
+    def release(self) -> None:
+        """Give back an allowed call that did not reach the backend (e.g. it was shed before)."""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+
+    def retry_after(self) -> int:
+        """Seconds until an open breaker lets probe calls through."""
+        with self._lock:
+            if self._state != OPEN:
+                return 1
+            return max(1, math.ceil(self._opened_at + self.open_duration - time.monotonic()))
+
+    def rejection(self) -> CircuitOpen:
+        return CircuitOpen(self.backend, self.retry_after())
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            self._expire_open(now)
+            self._prune(now)
+            return {
+                "state": self._state,
+                "opened": self.opened,
+                "calls": len(self._outcomes),
+                "failures": self._failures,
+                "slow_calls": self._slow_calls,
+            }
+
+    def _prune(self, now: float) -> None:
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            _, failed, slow = self._outcomes.popleft()
+            self._failures -= failed
+            self._slow_calls -= slow
+
+    def _expire_open(self, now: float) -> None:
+        if self._state == OPEN and now - self._opened_at >= self.open_duration:
+            self._transition(HALF_OPEN, now)
+
+    def _transition(self, state: str, now: float) -> None:
+        self._state = state
+        self._probes = 0
+        self._probe_successes = 0
+        if state == OPEN:
+            self._opened_at = now
+            self.opened += 1
+        self._outcomes.clear()
+        self._failures = 0
+        self._slow_calls = 0
+        if self._observer is not None:
+            self._observer(self.backend, state)
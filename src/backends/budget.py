@@ -0,0 +1,212 @@
+"""Output budget shared by the ``format_results`` implementations of all backends."""
+
+from typing import List, Optional, Sequence, Tuple
+
+from backends.models import FormattedResult, truncate_line
+
+# Rough size of one LLM token, used to turn a token budget into a byte budget
+BYTES_PER_TOKEN = 4
+# Approximate JSON overhead of one serialized match and one serialized result
+MATCH_OVERHEAD = 32
+RESULT_OVERHEAD = 64
+
+
+class FormattedResults(List[FormattedResult]):
+    """Formatted results together with what the output budget left out.
+
+    Behaves like the plain list returned before, so existing callers are unaffected.
+    """
+
+    def __init__(
+        self,
+        results: Sequence[FormattedResult] = (),
+        omitted_files: int = 0,
+        omitted_matches: int = 0,
+        incomplete: bool = False,
+        fallback: bool = False,
+    ):
+        super().__init__(results)
+        self.omitted_files = omitted_files
+        self.omitted_matches = omitted_matches
+        # The backend stopped searching (e.g. at a deadline) before it had seen everything
+        self.incomplete = incomplete
+        # Answered by a fallback backend while the primary one was unavailable
+        self.fallback = fallback
+
+    def omission_notice(self) -> Optional[str]:
+        """Return a message describing the omitted results, or None if nothing was left out."""
+        notices = []
+        if self.omitted_files or self.omitted_matches:
+            notices.append(
+                f"Output limit reached: {self.omitted_matches} more matches in {self.omitted_files} more files were "
+                "omitted. Narrow the query (e.g. with file:, lang: or repo: filters) to see them."
+            )
+        if self.incomplete:
+            notices.append("The search stopped before it finished (timed out or cut off), so more results may exist.")
+        return " ".join(notices) or None
+
+
+class OutputBudget:
+    """Byte (and optionally token) allowance consumed while formatting results.
+
+    Matches are charged as they are produced so formatting can stop as soon as the
+    budget is spent instead of building the whole output and truncating it.
+    """
+
+    def __init__(self, max_bytes: int, max_tokens: Optional[int] = None, context_lines: int = 5):
+        """Initialize the budget.
+
+        Args:
+            max_bytes: Maximum UTF-8 size of the formatted output
+            max_tokens: Maximum estimated number of tokens of the formatted output (optional)
+            context_lines: Context lines shown around a match while the budget is ample
+        """
+        if max_tokens is not None:
+            max_bytes = min(max_bytes, max_tokens * BYTES_PER_TOKEN)
+        self.max_bytes = max(max_bytes, 0)
+        self.remaining = self.max_bytes
+        self.max_context_lines = context_lines
+        self.omitted_files = 0
+        self.omitted_matches = 0
+        self.incomplete = False
+
+    @property
+    def exhausted(self) -> bool:
+        return self.remaining <= 0
+
+    def context_lines(self) -> int:
+        """Number of context lines to show around the next match.
+
+        Full context is kept while more than half of the budget is left; below that
+        it shrinks linearly so the remaining space goes to more matches.
+        """
+        if self.max_bytes == 0 or self.remaining <= 0:
+            return 0
+        half = self.max_bytes / 2
+        if self.remaining >= half:
+            return self.max_context_lines
+        return int(self.max_context_lines * self.remaining / half)
+
+    def charge_result(self, *fields: str) -> bool:
+        """Charge the fixed part (file name, repository, URL) of a result.
+
+        Returns:
+            False if the budget is exhausted and the result should be left out
+        """
+        if self.exhausted:
+            return False
+        self.remaining -= RESULT_OVERHEAD + sum(len(field.encode("utf-8")) for field in fields if field)
+        return True
+
+    def take_lines(self, lines: Sequence[str]) -> Optional[List[str]]:
+        """Charge the lines of one match, keeping as many leading lines as fit.
+
+        Returns:
+            The lines that fit, or None if not even the first one does
+        """
+        if self.exhausted:
+            return None
+
+        kept: List[str] = []
+        available = self.remaining - MATCH_OVERHEAD
+        for line in lines:
+            size = len(line.encode("utf-8")) + 1
+            if size > available:
+                break
+            kept.append(line)
+            available -= size
+
+        if not kept:
+            self.remaining = 0
+            return None
+        self.remaining = available
+        return kept
+
+    def take_span(self, text: str, start: int, end: int, line_limit: int) -> Optional[Tuple[int, bool]]:
+        """Charge the lines ``text[start:end]`` of one match like :meth:`take_lines`, without building them.
+
+        Each line is charged at its size once shortened to ``line_limit`` characters.
+
+        Returns:
+            The end offset of the leading lines that fit and whether one of them is longer than
+            ``line_limit``, or None if not even the first one fits
+        """
+        if self.exhausted:
+            return None
+
+        available = self.remaining - MATCH_OVERHEAD
+        span = text[start:end]
+        ascii_only = span.isascii()
+        if ascii_only and end - start + 1 <= available and max(map(len, span.split("\n"))) <= line_limit:
+            # Common case, charged without a loop over the lines: every line fits as it is
+            self.remaining = available - (end - start + 1)
+            return end, False
+
+        kept_end: Optional[int] = None
+        truncated = False
+        line_start = start
+        while line_start <= end:
+            line_end = text.find("\n", line_start, end)
+            if line_end == -1:
+                line_end = end
+            too_long = line_end - line_start > line_limit
+            if ascii_only:
+                size = min(line_end - line_start, line_limit) + 1
+            else:
+                line = text[line_start:line_end]
+                size = len((truncate_line(line, line_limit) if too_long else line).encode("utf-8")) + 1
+            if size > available:
+                break
+            kept_end = line_end
+            truncated = truncated or too_long
+            available -= size
+            line_start = line_end + 1
+
+        if kept_end is None:
+            self.remaining = 0
+            return None
+        self.remaining = available
+        return kept_end, truncated
+
+    def omit(self, files: int = 0, matches: int = 0) -> None:
+        self.omitted_files += files
+        self.omitted_matches += matches
+
+    def results(self, formatted: Sequence[FormattedResult]) -> FormattedResults:
+        return FormattedResults(
+            formatted,
+            omitted_files=self.omitted_files,
+            omitted_matches=self.omitted_matches,
+            incomplete=self.incomplete,
+        )
+
+
+def context_window(num_lines: int, first_match: int, last_match: int, context: int) -> slice:
+    """Return the slice of a chunk that keeps ``context`` lines around its matched lines.
+
+    Args:
+        num_lines: Number of lines in the chunk
+        first_match: Index of the first matched line within the chunk
+        last_match: Index of the last matched line within the chunk
+        context: Number of context lines to keep before and after
+
+    Returns:
+        slice: Lines to keep
+    """
+    first_match = min(max(first_match, 0), max(num_lines - 1, 0))
+    last_match = min(max(last_match, first_match), max(num_lines - 1, 0))
+    return slice(max(first_match - context, 0), min(last_match + context + 1, num_lines))
+
+
+def line_span(text: str, lines: slice, num_lines: int) -> Tuple[int, int]:
+    """Return the start and end offsets of the lines ``lines`` of ``text``, which has ``num_lines`` lines.
+
+    Only the lines left out before and after the slice (e.g. by :func:`context_window`) are scanned.
+    """
+    start = 0
+    for _ in range(lines.start):
+        start = text.index("\n", start) + 1
+    end = len(text)
+    for _ in range(num_lines - lines.stop):
+        end = text.rindex("\n", start, end)
+    return start, end
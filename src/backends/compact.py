@@ -0,0 +1,66 @@
+"""Compact encoding of search results for clients that pay for every byte of the response."""
+
+import json
+import posixpath
+from typing import Any, Dict, List, Optional, Sequence
+
+from backends.models import FormattedResult
+
+JSON_ENCODING = "json"
+COMPACT_ENCODING = "compact"
+RESULT_ENCODINGS = (JSON_ENCODING, COMPACT_ENCODING)
+
+
+def encode_compact(results: Sequence[FormattedResult]) -> str:
+    """Encode formatted results as compact JSON.
+
+    The default encoding repeats the repository, file name and URL of every file.
+    Here files are grouped by repository, in the order their repository first
+    appears, and within it by directory::
+
+        {"repositories": [{"repository": "github.com/org/repo",
+                           "url": "https://github.com/org/repo/blob/main/",
+                           "files": {"src/": {"app.py": [[12, "text"]]}}}],
+         "notices": ["Output limit reached: ..."]}
+
+    A file's URL is the repository ``url`` followed by its path; URLs that do not
+    follow this pattern are listed under the repository's ``urls``, keyed by path.
+    Results without a file (repository listings) keep their matches and URL on the
+    repository entry, and results without a repository are messages to the agent,
+    listed under ``notices``.
+    """
+    repositories: Dict[str, Dict[str, Any]] = {}
+    notices: List[str] = []
+    for result in results:
+        if not result.repository:
+            notices.extend(match.text for match in result.matches)
+            continue
+
+        entry = repositories.setdefault(result.repository, {"repository": result.repository})
+        matches = [[match.line_number, match.text] for match in result.matches]
+        if not result.filename:
+            _add_url(entry, "", result.url, result.url)
+            entry.setdefault("matches", []).extend(matches)
+            continue
+
+        if result.url.endswith(result.filename):
+            _add_url(entry, result.filename, result.url, result.url[: -len(result.filename)])
+        else:
+            _add_url(entry, result.filename, result.url, None)
+        directory, name = posixpath.split(result.filename)
+        directory = f"{directory}/" if directory else ""
+        entry.setdefault("files", {}).setdefault(directory, {}).setdefault(name, []).extend(matches)
+
+    encoded: Dict[str, Any] = {"repositories": list(repositories.values())}
+    if notices:
+        encoded["notices"] = notices
+    return json.dumps(encoded, ensure_ascii=False, separators=(",", ":"))
+
+
+def _add_url(entry: Dict[str, Any], path: str, url: str, prefix: Optional[str]) -> None:
+    """Record the URL of ``path``, as the repository's URL prefix when it can be derived from it."""
+    if not url:
+        return
+    if prefix is not None and entry.setdefault("url", prefix) == prefix:
+        return
+    entry.setdefault("urls", {})[path] = url
@@ -0,0 +1,193 @@
+"""Commit-pinned content cache shared by the content fetchers."""
+
+import asyncio
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, NamedTuple, Optional, Tuple, TypeVar
+
+from backends.content_fetcher import select_lines
+from backends.content_store import PersistentContentStore
+
+_COMMIT_SHA_PATTERN = re.compile(r"[0-9a-f]{40}")
+
+BLOB = "blob"
+
+T = TypeVar("T")
+
+
+def is_commit_sha(ref: str) -> bool:
+    """Whether ``ref`` is a full commit SHA, which needs no resolution."""
+    return _COMMIT_SHA_PATTERN.fullmatch(ref) is not None
+
+
+class ResolvedRef(NamedTuple):
+    """The commit a Git reference pointed to when it was resolved."""
+
+    sha: str
+    # Backend-specific name of the indexed branch, if the reference had to be mapped to one
+    branch: Optional[str] = None
+
+
+class ContentCache:
+    """File contents and directory trees keyed by (repository, commit, path), plus short-lived ref resolutions.
+
+    Content at a commit never changes, so entries have no TTL; the least recently
+    used ones are evicted once the cache grows past ``max_bytes``. Only the mapping
+    of a ref such as HEAD or a branch name to its commit expires, after ``ref_ttl``.
+    One cache is shared by every session of the server, so files that are fetched
+    again and again skip the backend entirely. With a persistent ``store`` every
+    entry is also written to disk and read back from there after a restart. Writes
+    to the store happen on a background thread; async callers run lookups that may
+    read it through :meth:`alookup`, so the event loop never waits for the disk.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 256 * 1024 * 1024,
+        ref_ttl: float = 30.0,
+        store: Optional[PersistentContentStore] = None,
+    ):
+        """Initialize the cache.
+
+        Args:
+            max_bytes: Approximate memory budget of cached contents (counted in characters)
+            ref_ttl: Seconds before a ref is resolved to a commit again
+            store: Persistent store backing the in-memory entries (optional)
+        """
+        self.max_bytes = max_bytes
+        self.ref_ttl = ref_ttl
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self.store_hits = 0
+        self._contents: "OrderedDict[Tuple[str, str, str, str], str]" = OrderedDict()
+        self._refs: Dict[Tuple[str, str], Tuple[ResolvedRef, float]] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self._store_writer: Optional[ThreadPoolExecutor] = None
+
+    def resolve(self, repo: str, ref: str) -> Optional[ResolvedRef]:
+        """Return the commit ``ref`` resolved to, unless that was longer than the TTL ago."""
+        with self._lock:
+            resolved = self._refs.get((repo, ref))
+        if resolved is None or time.monotonic() - resolved[1] >= self.ref_ttl:
+            return None
+        return resolved[0]
+
+    def set_ref(self, repo: str, ref: str, sha: str, branch: Optional[str] = None) -> ResolvedRef:
+        resolved = ResolvedRef(sha, branch)
+        with self._lock:
+            self._refs[(repo, ref)] = (resolved, time.monotonic())
+        return resolved
+
+    async def alookup(self, lookup: Callable[..., T], *args) -> T:
+        """Run ``lookup``, which may read the persistent store, in a worker thread when there is a store."""
+        if self.store is None:
+            return lookup(*args)
+        return await asyncio.to_thread(lookup, *args)
+
+    def get(
+        self, repo: str, sha: str, path: str, start_line: Optional[int] = None, end_line: Optional[int] = None
+    ) -> Optional[str]:
+        """Return a cached file, or its lines ``start_line`` to ``end_line`` (see :func:`select_lines`).
+
+        A line range of a file that is only in the persistent store is read from there
+        on its own, without loading the whole file into memory.
+        """
+        key = (repo, sha, path, BLOB)
+        if start_line is None and end_line is None:
+            return self._get(key)
+        with self._lock:
+            content = self._contents.get(key)
+            if content is not None:
+                self.hits += 1
+                self._contents.move_to_end(key)
+        if content is not None:
+            return select_lines(content, start_line, end_line)
+        lines = None
+        if self.store is not None:
+            lines = self.store.get_lines(key, max((start_line or 1) - 1, 0), end_line)
+        with self._lock:
+            if lines is None:
+                self.misses += 1
+            else:
+                self.store_hits += 1
+        return lines
+
+    def put(self, repo: str, sha: str, path: str, content: str) -> None:
+        self._put((repo, sha, path, BLOB), content)
+
+    def get_tree(self, repo: str, sha: str, path: str, depth: int) -> Optional[str]:
+        """Return a directory tree rendered ``depth`` levels deep from the persistent store.
+
+        The fetchers keep their own in-memory listings, so trees are only persisted
+        to answer them after a restart.
+        """
+        if self.store is None:
+            return None
+        tree = self.store.get((repo, sha, path, f"tree:{depth}"))
+        if tree is not None:
+            with self._lock:
+                self.store_hits += 1
+        return tree
+
+    def put_tree(self, repo: str, sha: str, path: str, depth: int, tree: str) -> None:
+        if self.store is not None:
+            self._store_put((repo, sha, path, f"tree:{depth}"), tree)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = {
+                "entries": len(self._contents),
+                "bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "store_hits": self.store_hits,
+            }
+        if self.store is not None:
+            stats.update({f"store_{name}": value for name, value in self.store.stats().items()})
+        return stats
+
+    def _get(self, key: Tuple[str, str, str, str]) -> Optional[str]:
+        with self._lock:
+            content = self._contents.get(key)
+            if content is not None:
+                self.hits += 1
+                self._contents.move_to_end(key)
+                return content
+        content = self.store.get(key) if self.store is not None else None
+        with self._lock:
+            if content is None:
+                self.misses += 1
+                return None
+            self.store_hits += 1
+            self._remember(key, content)
+        return content
+
+    def _put(self, key: Tuple[str, str, str, str], content: str) -> None:
+        with self._lock:
+            self._remember(key, content)
+        if self.store is not None:
+            self._store_put(key, content)
+
+    def _store_put(self, key: Tuple[str, str, str, str], content: str) -> None:
+        """Append an entry to the persistent store on the writer thread, keeping the order of writes."""
+        with self._lock:
+            if self._store_writer is None:
+                self._store_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="content-store")
+        self._store_writer.submit(self.store.put, key, content)
+
+    def _remember(self, key: Tuple[str, str, str, str], content: str) -> None:
+        if len(content) > self.max_bytes:
+            return
+        previous = self._contents.pop(key, None)
+        if previous is not None:
+            self._size -= len(previous)
+        self._contents[key] = content
+        self._size += len(content)
+        while self._size > self.max_bytes:
+            _, evicted = self._contents.popitem(last=False)
+            self._size -= len(evicted)
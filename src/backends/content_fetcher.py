@@ -1,6 +1,89 @@
+import asyncio
 from abc import ABC, abstractmethod
+from typing import List, Optional, Sequence, Tuple, Union
 
 MAX_FILE_SIZE = 100_000
+# Combined output size of one batch fetch
+MAX_BATCH_OUTPUT_SIZE = 300_000
+
+NOT_FOUND_MESSAGE = "invalid arguments the given path or repository does not exist"
+
+
+def truncate_file_content(content: str, total_lines: Optional[Union[int, str]] = None) -> str:
+    """Cut file content down to MAX_FILE_SIZE at a line boundary and append a notice.
+
+    Args:
+        content: Full file content
+        total_lines: Line count reported by the backend, counted from content if omitted
+
+    Returns:
+        The content unchanged if it fits, otherwise the truncated content with a notice
+    """
+    if len(content) <= MAX_FILE_SIZE:
+        return content
+
+    truncated_content = content[:MAX_FILE_SIZE]
+    # Find last complete line
+    last_newline = truncated_content.rfind("\n")
+    if last_newline > 0:
+        truncated_content = truncated_content[:last_newline]
+
+    if total_lines is None:
+        total_lines = content.count("\n") + 1
+
+    return (
+        f"{truncated_content}\n\n"
+        f"[FILE TRUNCATED: File too large ({len(content):,} chars, {total_lines} lines). "
+        f"Showing first {len(truncated_content):,} chars; pass start_line and end_line to read further]"
+    )
+
+
+def select_lines(content: str, start_line: Optional[int] = None, end_line: Optional[int] = None) -> str:
+    """Return lines ``start_line`` to ``end_line`` of a file, counted from 1 and inclusive.
+
+    Either bound may be omitted to read from the first or up to the last line; without
+    both the content is returned as it is.
+    """
+    if start_line is None and end_line is None:
+        return content
+    return "\n".join(content.split("\n")[max((start_line or 1) - 1, 0) : end_line])
+
+
+def fit_batch_output(contents: Sequence[str], max_size: int = MAX_BATCH_OUTPUT_SIZE) -> List[str]:
+    """Truncate the contents of a batch so that together they fit ``max_size`` characters.
+
+    Contents smaller than an even share of the budget are kept whole and the space
+    they leave is shared among the larger ones, so one huge file cannot crowd out
+    the others. Truncated contents end at a line boundary followed by a notice.
+
+    Args:
+        contents: Content of each item of the batch
+        max_size: Combined size of the returned contents, notices excluded
+
+    Returns:
+        list: The contents in the same order, truncated where needed
+    """
+    allowances = [0] * len(contents)
+    remaining = max(max_size, 0)
+    by_size = sorted(range(len(contents)), key=lambda i: len(contents[i]))
+    for position, i in enumerate(by_size):
+        allowances[i] = min(len(contents[i]), remaining // (len(contents) - position))
+        remaining -= allowances[i]
+
+    fitted = []
+    for content, allowance in zip(contents, allowances):
+        if len(content) <= allowance:
+            fitted.append(content)
+            continue
+        truncated = content[:allowance]
+        last_newline = truncated.rfind("\n")
+        if last_newline > 0:
+            truncated = truncated[:last_newline]
+        fitted.append(
+            f"{truncated}\n\n[TRUNCATED: Batch output limit reached, showing first {len(truncated):,} of "
+            f"{len(content):,} chars. Fetch this path on its own to see more]"
+        )
+    return fitted
 
 
 class AbstractContentFetcher(ABC):
@@ -9,7 +92,15 @@ class AbstractContentFetcher(ABC):
     """
 
     @abstractmethod
-    def get_content(self, repository: str, path: str = "", depth: int = 2, ref: str = "HEAD") -> str:
+    def get_content(
+        self,
+        repository: str,
+        path: str = "",
+        depth: int = 2,
+        ref: str = "HEAD",
+        start_line: Optional[int] = None,
+        end_line: Optional[int] = None,
+    ) -> str:
         """Get content from repository.
 
         Args:
@@ -17,15 +108,66 @@ class AbstractContentFetcher(ABC):
             path: File or directory path (e.g., "Sources/DivarInterfaceClient/divar_interface_sms_sms.grpc.swift")
             depth: Tree depth for directory listings
             ref: Git reference (branch, tag, or commit SHA)
+            start_line: First line of a file to return, counted from 1 (the first line if omitted)
+            end_line: Last line of a file to return, inclusive (the last line if omitted)
 
         Returns:
-            File content if path is a file, directory tree if path is a directory
+            File content (or the requested lines of it) if path is a file, directory tree if path is a directory
 
         Raises:
             ValueError: If repository or path does not exist
+            BackendUnavailable: If the backend cannot be reached or fails to answer
         """
         ...
 
+    async def aget_content(
+        self,
+        repository: str,
+        path: str = "",
+        depth: int = 2,
+        ref: str = "HEAD",
+        start_line: Optional[int] = None,
+        end_line: Optional[int] = None,
+    ) -> str:
+        """Get content from repository without blocking the event loop.
+
+        Backends should override this with a native asynchronous implementation;
+        the default runs :meth:`get_content` in a worker thread.
+
+        Raises:
+            ValueError: If repository or path does not exist
+        """
+        return await asyncio.to_thread(self.get_content, repository, path, depth, ref, start_line, end_line)
+
+    def get_contents(self, items: Sequence[Tuple[str, str]], depth: int = 2, ref: str = "HEAD") -> List[str]:
+        """Get the content of several paths at once.
+
+        Backends should override this to fetch the batch in as few requests as
+        possible; the default fetches the items one at a time.
+
+        Args:
+            items: (repository, path) pairs, as taken by :meth:`get_content`
+            depth: Tree depth for directory listings
+            ref: Git reference (branch, tag, or commit SHA)
+
+        Returns:
+            list: Content of each item in order, NOT_FOUND_MESSAGE for paths that do not exist
+
+        Raises:
+            BackendUnavailable: If the backend cannot be reached or fails to answer
+        """
+        contents = []
+        for repository, path in items:
+            try:
+                contents.append(self.get_content(repository, path, depth, ref))
+            except ValueError:
+                contents.append(NOT_FOUND_MESSAGE)
+        return contents
+
+    async def aget_contents(self, items: Sequence[Tuple[str, str]], depth: int = 2, ref: str = "HEAD") -> List[str]:
+        """Asynchronous counterpart of :meth:`get_contents`."""
+        return await asyncio.to_thread(self.get_contents, items, depth, ref)
+
 
 class ContentFetcherFactory:
     """Factory class for creating content fetcher instances based on configuration."""
@@ -56,7 +198,7 @@ class ContentFetcherFactory:
         """Create and configure a Sourcegraph content fetcher.
 
         Args:
-            **kwargs: Must include 'endpoint', may include 'token'
+            **kwargs: Must include 'endpoint', may include 'token', 'transport' and 'content_cache'
 
         Returns:
             SourcegraphContentFetcher: Configured Sourcegraph content fetcher
@@ -72,23 +214,49 @@ class ContentFetcherFactory:
         if not endpoint:
             raise ValueError("Sourcegraph backend requires endpoint parameter")
 
-        return SourcegraphContentFetcher(endpoint=endpoint, token=token)
+        return SourcegraphContentFetcher(
+            endpoint=endpoint,
+            token=token,
+            transport=kwargs.get("transport"),
+            content_cache=kwargs.get("content_cache"),
+        )
 
     @staticmethod
-    def _create_zoekt_fetcher(**kwargs) -> "ZoektContentFetcher":
+    def _create_zoekt_fetcher(**kwargs) -> AbstractContentFetcher:
         """Create and configure a Zoekt content fetcher.
 
         Args:
-            **kwargs: Must include 'zoekt_url'
+            **kwargs: Must include 'zoekt_url' (shards separated by ';', the replicas of a shard by ','), may
+                include 'transport', 'shards' (a replica set per shard), 'router' (a ShardRouter over them),
+                'route_refresh_interval' and 'content_cache'
 
         Returns:
-            ZoektContentFetcher: Configured Zoekt content fetcher
+            AbstractContentFetcher: Configured Zoekt content fetcher, or one fetching from the shard that
+                indexes the repository
         """
+        from backends.zoekt.federated import FederatedContentFetcher, parse_shard_urls
         from backends.zoekt.fetcher import ZoektContentFetcher
+        from backends.zoekt.routing import ShardRouter
 
         zoekt_url = kwargs.get("zoekt_url")
 
         if not zoekt_url:
             raise ValueError("Zoekt backend requires zoekt_url parameter")
 
-        return ZoektContentFetcher(zoekt_url=zoekt_url)
+        shard_urls = parse_shard_urls(zoekt_url)
+        replica_sets = kwargs.get("shards") or [None] * len(shard_urls)
+        fetchers = [
+            ZoektContentFetcher(
+                zoekt_url=urls,
+                transport=kwargs.get("transport"),
+                content_cache=kwargs.get("content_cache"),
+                replicas=replicas,
+            )
+            for urls, replicas in zip(shard_urls, replica_sets)
+        ]
+        if len(fetchers) == 1:
+            return fetchers[0]
+        router = kwargs.get("router") or ShardRouter(
+            [fetcher.replicas for fetcher in fetchers], refresh_interval=kwargs.get("route_refresh_interval", 60.0)
+        )
+        return FederatedContentFetcher(fetchers, router=router)
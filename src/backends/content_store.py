@@ -0,0 +1,217 @@
+"""Persistent store of fetched contents, so a restarted server does not start cold."""
+
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+from array import array
+from typing import Dict, NamedTuple, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_NAME = "segment-{:06d}.dat"
+SEGMENT_PATTERN = re.compile(r"segment-(\d{6})\.dat")
+# magic, key length, body length, number of line offsets, CRC-32 of the body
+RECORD_HEADER = struct.Struct("<4sIIII")
+RECORD_MAGIC = b"CSR1"
+LINE_OFFSET_SIZE = array("I").itemsize
+KEY_SEPARATOR = "\0"
+
+
+class _Record(NamedTuple):
+    segment: int
+    # Offset of the line offset table; the body follows it
+    offset: int
+    lines: int
+    length: int
+    crc: int
+
+
+class PersistentContentStore:
+    """Append-only segment files of contents keyed by (repository, commit, path).
+
+    Every record holds the UTF-8 body and the byte offset of each of its lines, so a
+    range of lines is read straight from the memory-mapped segment without decoding
+    the whole body. Only the record positions are kept in memory; they are rebuilt
+    from the record headers when the store is opened. Once the store grows past
+    ``max_bytes`` the oldest segment is deleted. All methods do blocking file I/O,
+    so async callers should run them in a worker thread.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 1024 * 1024 * 1024, segment_size: int = 64 * 1024 * 1024):
+        """Open (or create) the store.
+
+        Args:
+            directory: Directory holding the segment files
+            max_bytes: Total size of segments to keep
+            segment_size: Size at which the active segment is sealed and a new one started
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_size = segment_size
+        self._records: Dict[str, _Record] = {}
+        self._sizes: Dict[int, int] = {}
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        segments = sorted(
+            int(match.group(1)) for match in map(SEGMENT_PATTERN.fullmatch, os.listdir(directory)) if match
+        )
+        for segment in segments:
+            self._load_segment(segment)
+        self._active = segments[-1] if segments else 1
+        self._writer = open(self._segment_path(self._active), "ab")
+        self._sizes.setdefault(self._active, self._writer.tell())
+        logger.info(
+            f"Opened content store {directory} with {len(self._records)} records in {len(self._sizes)} segments"
+        )
+
+    def get(self, parts: Sequence[str]) -> Optional[str]:
+        """Return the content stored under ``parts``, or None."""
+        body = self._read(parts)
+        return None if body is None else bytes(body).decode("utf-8", errors="replace")
+
+    def get_lines(self, parts: Sequence[str], start: int, end: Optional[int] = None) -> Optional[str]:
+        """Return lines ``start`` (0-based) up to ``end`` (exclusive) of a stored content, or None.
+
+        Only the requested byte range is read from the segment.
+        """
+        key = KEY_SEPARATOR.join(parts)
+        with self._lock:
+            record = self._records.get(key)
+        if record is None:
+            return None
+        view = self._view(record.segment, record.offset, record.lines * LINE_OFFSET_SIZE + record.length)
+        if view is None:
+            return None
+        offsets = array("I")
+        offsets.frombytes(view[: record.lines * LINE_OFFSET_SIZE])
+        body = view[record.lines * LINE_OFFSET_SIZE :]
+
+        start = max(start, 0)
+        end = record.lines + 1 if end is None else min(end, record.lines + 1)
+        if start >= end:
+            return ""
+        # Line 0 starts at offset 0; the table holds the starts of the following lines
+        first = offsets[start - 1] if start else 0
+        last = offsets[end - 1] - 1 if end <= record.lines else record.length
+        return bytes(body[first:last]).decode("utf-8", errors="replace")
+
+    def put(self, parts: Sequence[str], content: str) -> None:
+        """Append ``content`` unless it is stored already; contents under a commit never change."""
+        key = KEY_SEPARATOR.join(parts)
+        body = content.encode("utf-8")
+        with self._lock:
+            if key in self._records:
+                return
+            encoded_key = key.encode("utf-8")
+            offsets = _line_offsets(body)
+            header = RECORD_HEADER.pack(RECORD_MAGIC, len(encoded_key), len(body), len(offsets), zlib.crc32(body))
+            try:
+                if self._sizes[self._active] >= self.segment_size:
+                    self._rotate()
+                position = self._sizes[self._active]
+                self._writer.write(b"".join((header, encoded_key, offsets.tobytes(), body)))
+                self._writer.flush()
+            except OSError as exc:
+                logger.warning(f"Could not write to content store {self.directory}: {exc}")
+                return
+            offset = position + RECORD_HEADER.size + len(encoded_key)
+            self._records[key] = _Record(self._active, offset, len(offsets), len(body), zlib.crc32(body))
+            self._sizes[self._active] = offset + len(offsets) * LINE_OFFSET_SIZE + len(body)
+            self._evict()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"records": len(self._records), "segments": len(self._sizes), "bytes": sum(self._sizes.values())}
+
+    def close(self) -> None:
+        with self._lock:
+            self._writer.close()
+            for segment_map in self._maps.values():
+                try:
+                    segment_map.close()
+                except BufferError:
+                    # Still referenced by a view; released with it
+                    pass
+            self._maps.clear()
+
+    def _read(self, parts: Sequence[str]) -> Optional[memoryview]:
+        with self._lock:
+            record = self._records.get(KEY_SEPARATOR.join(parts))
+        if record is None:
+            return None
+        table = record.lines * LINE_OFFSET_SIZE
+        view = self._view(record.segment, record.offset + table, record.length)
+        if view is None or zlib.crc32(view) != record.crc:
+            return None
+        return view
+
+    def _view(self, segment: int, offset: int, length: int) -> Optional[memoryview]:
+        """Map the segment (again, if it grew) and return a view of the given range."""
+        with self._lock:
+            segment_map = self._maps.get(segment)
+            if segment_map is None or len(segment_map) < offset + length:
+                if segment not in self._sizes:
+                    # Evicted since the record was looked up
+                    return None
+                with open(self._segment_path(segment), "rb") as f:
+                    segment_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                # Views of a replaced map keep it alive until they are released
+                self._maps[segment] = segment_map
+        return memoryview(segment_map)[offset : offset + length]
+
+    def _load_segment(self, segment: int) -> None:
+        """Index the records of a segment, cutting off a record left incomplete by a crash."""
+        path = self._segment_path(segment)
+        size = os.path.getsize(path)
+        position = 0
+        with open(path, "rb") as f:
+            while position + RECORD_HEADER.size <= size:
+                f.seek(position)
+                magic, key_length, length, lines, crc = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+                end = position + RECORD_HEADER.size + key_length + lines * LINE_OFFSET_SIZE + length
+                if magic != RECORD_MAGIC or end > size:
+                    break
+                key = f.read(key_length).decode("utf-8", errors="replace")
+                self._records[key] = _Record(segment, position + RECORD_HEADER.size + key_length, lines, length, crc)
+                position = end
+        if position < size:
+            logger.warning(f"Truncating {size - position} bytes of incomplete records from {path}")
+            os.truncate(path, position)
+        self._sizes[segment] = position
+
+    def _rotate(self) -> None:
+        self._writer.close()
+        self._active += 1
+        self._writer = open(self._segment_path(self._active), "ab")
+        self._sizes[self._active] = 0
+
+    def _evict(self) -> None:
+        while sum(self._sizes.values()) > self.max_bytes and len(self._sizes) > 1:
+            oldest = min(self._sizes)
+            del self._sizes[oldest]
+            self._records = {key: record for key, record in self._records.items() if record.segment != oldest}
+            # Open views keep the mapping valid; the file is gone once they are released
+            self._maps.pop(oldest, None)
+            try:
+                os.remove(self._segment_path(oldest))
+            except OSError as exc:
+                logger.warning(f"Could not remove content store segment {oldest}: {exc}")
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, SEGMENT_NAME.format(segment))
+
+
+def _line_offsets(body: bytes) -> array:
+    """Byte offsets at which the second and following lines of ``body`` start."""
+    offsets = array("I")
+    position = body.find(b"\n")
+    while position != -1:
+        offsets.append(position + 1)
+        position = body.find(b"\n", position + 1)
+    return offsets
@@ -0,0 +1,187 @@
+"""Incremental decoding of large JSON responses dominated by one array."""
+
+import codecs
+import json
+import re
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+# Characters that open strings or change the nesting depth
+_STRUCTURAL_PATTERN = re.compile(r'["\[\]{}]')
+
+
+class JSONArrayStream:
+    """Decode a JSON document chunk by chunk, keeping a bounded number of array elements.
+
+    The elements of the array at ``path`` are decoded one at a time as their bytes
+    arrive and handed to ``keep``. Once it declines an element, the remaining ones
+    are only scanned for their end and counted, so neither memory nor decoding
+    cost grows with the size of the response. Elements must be objects, arrays or
+    strings. Everything outside the array is decoded normally once the stream ends.
+    """
+
+    def __init__(self, path: Sequence[str], keep: Optional[Callable[[Any], Optional[Any]]] = None):
+        """Initialize the decoder.
+
+        Args:
+            path: Keys leading to the array, e.g. ("Result", "Files"); the last key must be unique in the document
+            keep: Receives each decoded element and returns what to store (e.g. the element with
+                unused fields dropped), or None to stop keeping elements
+        """
+        self.path = tuple(path)
+        self.keep = keep
+        self.items: List[Any] = []
+        self.skipped = 0
+
+        self._key_pattern = re.compile(r'"%s"\s*:\s*(\[|null)' % re.escape(self.path[-1]))
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._stopped = False
+        self._state = "prefix"
+        self._head: List[str] = []
+        self._tail: List[str] = []
+        self._prefix = ""
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        # Text of the element being kept, or None between elements and while skipping one
+        self._item_parts: Optional[List[str]] = None
+        self._skipping = False
+
+    def feed(self, chunk: bytes) -> None:
+        """Consume the next chunk of the raw response body."""
+        if chunk:
+            self._process(self._decoder.decode(chunk))
+
+    def result(self) -> Dict[str, Any]:
+        """Finish decoding and return the document with the kept array elements.
+
+        Raises:
+            json.JSONDecodeError: If the document is not valid JSON
+        """
+        self._process(self._decoder.decode(b"", final=True))
+        if self._state == "prefix":
+            return json.loads(self._prefix)
+        if self._state != "suffix":
+            raise json.JSONDecodeError("Unterminated array", "".join(self._head), 0)
+
+        document = json.loads("".join(self._head) + "[]" + "".join(self._tail))
+        parent = document
+        for key in self.path[:-1]:
+            parent = parent[key]
+        parent[self.path[-1]] = self.items
+        return document
+
+    def _process(self, text: str) -> None:
+        if not text:
+            return
+        if self._state == "prefix":
+            text = self._find_array(text)
+        if self._state == "items":
+            text = self._scan_items(text)
+        if self._state == "suffix" and text:
+            self._tail.append(text)
+
+    def _find_array(self, text: str) -> str:
+        """Buffer the text before the array; return the text after its opening bracket once found."""
+        self._prefix += text
+        match = self._key_pattern.search(self._prefix)
+        if match is None:
+            return ""
+
+        self._head.append(self._prefix[: match.start(1)])
+        rest = self._prefix[match.end() :]
+        self._prefix = ""
+        # For null there is nothing to stream; the rest is decoded at the end
+        self._state = "items" if match.group(1) == "[" else "suffix"
+        self._depth = 1
+        return rest
+
+    def _scan_items(self, text: str) -> str:
+        """Scan one chunk of the array; return the text after the array if it ends in this chunk."""
+        depth = self._depth
+        # Start of the current chunk's part of a kept element
+        item_start = 0 if self._item_parts is not None else -1
+        pos = 0
+
+        while True:
+            if self._in_string:
+                pos = self._string_end(text, pos)
+                if pos < 0:
+                    break
+                self._in_string = False
+                if depth == 1:
+                    # A string element
+                    item_start = self._end_item(text, item_start, pos)
+                continue
+
+            token = _STRUCTURAL_PATTERN.search(text, pos)
+            if token is None:
+                break
+
+            char, start = token.group(), token.start()
+            pos = start + 1
+            if depth == 1 and char != "]":
+                item_start = self._begin_item(start)
+            if char == '"':
+                self._in_string = True
+            elif char in "[{":
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 1:
+                    item_start = self._end_item(text, item_start, pos)
+                elif depth == 0:
+                    # End of the array
+                    self._depth = depth
+                    self._state = "suffix"
+                    return text[pos:]
+
+        if item_start >= 0:
+            self._item_parts.append(text[item_start:])
+        self._depth = depth
+        return ""
+
+    def _begin_item(self, start: int) -> int:
+        if self._stopped:
+            self._skipping = True
+            return -1
+        self._item_parts = []
+        return start
+
+    def _end_item(self, text: str, item_start: int, end: int) -> int:
+        if self._skipping:
+            self._skipping = False
+            self.skipped += 1
+        else:
+            self._item_parts.append(text[item_start:end])
+            self._finish_item("".join(self._item_parts))
+            self._item_parts = None
+        return -1
+
+    def _string_end(self, text: str, pos: int) -> int:
+        """Return the index after the closing quote of the string being scanned, or -1 if it continues."""
+        if self._escaped:
+            # The previous chunk ended with an escaping backslash
+            self._escaped = False
+            pos += 1
+        while True:
+            quote = text.find('"', pos)
+            if quote < 0:
+                backslashes = len(text) - max(len(text.rstrip("\\")), pos)
+                self._escaped = backslashes % 2 == 1
+                return -1
+            escape = quote
+            while escape > pos and text[escape - 1] == "\\":
+                escape -= 1
+            if (quote - escape) % 2 == 0:
+                return quote + 1
+            pos = quote + 1
+
+    def _finish_item(self, text: str) -> None:
+        item = json.loads(text)
+        if self.keep is not None:
+            item = self.keep(item)
+        if item is None:
+            self._stopped = True
+            self.skipped += 1
+        else:
+            self.items.append(item)
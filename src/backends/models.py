@@ -1,16 +1,88 @@
 from dataclasses import dataclass
-from typing import List
+from typing import List, Optional
 
 
-@dataclass
+@dataclass(slots=True)
 class Match:
     line_number: int
     text: str
 
+    @property
+    def size(self) -> int:
+        """Characters of memory the match's text holds on to."""
+        return len(self.text)
 
-@dataclass
+
+class LazyMatch(Match):
+    """A match whose text is cut from the response text it was found in only when first read.
+
+    The text is the lines ``source[start:end]``, each shortened to ``line_limit``
+    characters (ending with ``...``) when a limit is given. Until it is read the match
+    keeps a reference to ``source`` rather than a copy, so matches that are never
+    serialized cost no string building; once read, the text replaces the source.
+    Serializers read ``text`` like that of any other match.
+    """
+
+    __slots__ = ("_source", "_start", "_end", "_line_limit", "_text")
+
+    def __init__(self, line_number: int, source: str, start: int, end: int, line_limit: Optional[int] = None):
+        self.line_number = line_number
+        self._source = source
+        self._start = start
+        self._end = end
+        self._line_limit = line_limit
+        self._text: Optional[str] = None
+
+    @property
+    def text(self) -> str:
+        source = self._source
+        if source is None:
+            return self._text
+        text = source[self._start : self._end]
+        if self._line_limit is not None:
+            text = "\n".join(truncate_line(line, self._line_limit) for line in text.split("\n"))
+        # Set before the source is dropped, so that a concurrent reader finds one or the other
+        self._text = text
+        self._source = None
+        return text
+
+    @property
+    def size(self) -> int:
+        source = self._source
+        return len(source) if source is not None else len(self._text)
+
+    def __repr__(self) -> str:
+        return f"LazyMatch(line_number={self.line_number!r}, text={self.text!r})"
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Match):
+            return NotImplemented
+        return (self.line_number, self.text) == (other.line_number, other.text)
+
+
+def truncate_line(line: str, max_length: int) -> str:
+    """Shorten ``line`` to ``max_length`` characters, marking the cut with ``...``."""
+    if len(line) > max_length:
+        return line[: max_length - 3] + "..."
+    return line
+
+
+@dataclass(slots=True)
 class FormattedResult:
     filename: str
     repository: str
     matches: List[Match]
     url: str
+
+
+@dataclass
+class ContentRequest:
+    repo: str
+    path: str = ""
+
+
+@dataclass(slots=True)
+class FetchedContent:
+    repo: str
+    path: str
+    content: str
@@ -1,5 +1,6 @@
+import asyncio
 from abc import ABC, abstractmethod
-from typing import List
+from typing import List, Optional
 
 from backends.models import FormattedResult
 
@@ -22,6 +23,32 @@ class AbstractSearchClient(ABC):
         """
         ...
 
+    async def asearch(self, query: str, num: int) -> dict:
+        """Execute a search query without blocking the event loop.
+
+        Backends should override this with a native asynchronous implementation;
+        the default runs :meth:`search` in a worker thread.
+
+        Args:
+            query: The search query string
+            num: Maximum number of results to return
+
+        Returns:
+            Raw search results as a dictionary
+        """
+        return await asyncio.to_thread(self.search, query, num)
+
+    async def aindex_generation(self) -> Optional[str]:
+        """Return an identifier that changes whenever the searched index changes.
+
+        Used to invalidate cached search results. The default reports no generation,
+        so cached results only expire by age.
+
+        Returns:
+            Index generation, or None if the backend cannot tell
+        """
+        return None
+
     @abstractmethod
     def format_results(self, results: dict, num: int) -> List[FormattedResult]:
         """Format raw search results into structured FormattedResult objects.
@@ -65,7 +92,7 @@ class SearchClientFactory:
         """Create and configure a Sourcegraph client.
 
         Args:
-            **kwargs: Must include 'endpoint', may include 'token'
+            **kwargs: Must include 'endpoint', may include 'token', 'transport', 'max_output_tokens' and 'search_timeout'
 
         Returns:
             SourcegraphClient: Configured Sourcegraph client
@@ -86,27 +113,53 @@ class SearchClientFactory:
             token=token,
             max_line_length=kwargs.get("max_line_length", 300),
             max_output_length=kwargs.get("max_output_length", 100000),
+            transport=kwargs.get("transport"),
+            max_output_tokens=kwargs.get("max_output_tokens"),
+            search_timeout=kwargs.get("search_timeout", 10.0),
         )
 
     @staticmethod
-    def _create_zoekt_client(**kwargs) -> "ZoektClient":
+    def _create_zoekt_client(**kwargs) -> AbstractSearchClient:
         """Create and configure a Zoekt client.
 
+        Several shards, each indexing a different slice of the repositories, are searched
+        together by a federated client, which sends repository-scoped queries to the
+        shards indexing those repositories only.
+
         Args:
-            **kwargs: Must include 'base_url'
+            **kwargs: Must include 'base_url' (shards separated by ';', the replicas of a shard by ','), may include
+                'transport', 'shards' (a replica set per shard), 'router' (a ShardRouter over them),
+                'route_refresh_interval', 'shard_timeout', 'search_timeout' and 'max_output_tokens'
 
         Returns:
-            ZoektClient: Configured Zoekt client
+            AbstractSearchClient: Configured Zoekt client, or a federated client over several shards
         """
         from backends.zoekt import Client as ZoektClient
+        from backends.zoekt.federated import FederatedClient, parse_shard_urls
+        from backends.zoekt.routing import ShardRouter
 
         base_url = kwargs.get("base_url")
 
         if not base_url:
             raise ValueError("Zoekt backend requires base_url parameter")
 
-        return ZoektClient(
-            base_url=base_url,
-            max_line_length=kwargs.get("max_line_length", 300),
-            max_output_length=kwargs.get("max_output_length", 100000),
+        shard_urls = parse_shard_urls(base_url)
+        replica_sets = kwargs.get("shards") or [None] * len(shard_urls)
+        clients = [
+            ZoektClient(
+                base_url=urls,
+                max_line_length=kwargs.get("max_line_length", 300),
+                max_output_length=kwargs.get("max_output_length", 100000),
+                transport=kwargs.get("transport"),
+                max_output_tokens=kwargs.get("max_output_tokens"),
+                search_timeout=kwargs.get("search_timeout", 10.0),
+                replicas=replicas,
+            )
+            for urls, replicas in zip(shard_urls, replica_sets)
+        ]
+        if len(clients) == 1:
+            return clients[0]
+        router = kwargs.get("router") or ShardRouter(
+            [client.replicas for client in clients], refresh_interval=kwargs.get("route_refresh_interval", 60.0)
         )
+        return FederatedClient(clients, shard_timeout=kwargs.get("shard_timeout", 12.0), router=router)
@@ -0,0 +1,198 @@
+"""Formatted search results shared by concurrent and repeated identical queries."""
+
+import asyncio
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from backends.budget import MATCH_OVERHEAD, RESULT_OVERHEAD
+from backends.models import FormattedResult
+
+logger = logging.getLogger(__name__)
+
+# A run of non-space characters, where a quoted string may contain spaces
+_QUERY_TOKEN_PATTERN = re.compile(r'(?:"(?:[^"\\]|\\.)*"|[^\s"]|")+')
+
+
+def normalize_query(query: str) -> str:
+    """Normalize insignificant differences (whitespace between terms) so equivalent queries share a cache key."""
+    return " ".join(_QUERY_TOKEN_PATTERN.findall(query))
+
+
+def results_size(results: List[FormattedResult]) -> int:
+    """Approximate memory footprint of formatted results, in characters."""
+    size = 0
+    for result in results:
+        size += RESULT_OVERHEAD + len(result.filename) + len(result.repository) + len(result.url or "")
+        # Sizes of matches whose text is not built yet count the response text they hold on to
+        size += sum(MATCH_OVERHEAD + match.size for match in result.matches)
+    return size
+
+
+class _Entry:
+    __slots__ = ("results", "size", "generation", "created_at")
+
+    def __init__(self, results: List[FormattedResult], size: int, generation: Optional[str]):
+        self.results = results
+        self.size = size
+        self.generation = generation
+        self.created_at = time.monotonic()
+
+
+class SearchResultCache:
+    """LRU of formatted search results bounded by size and age, with single-flight searches.
+
+    Entries expire after ``ttl`` seconds and are dropped as soon as the backend reports
+    a new index generation. While a query is being searched, identical queries of the
+    same group wait for its result instead of reaching the backend. Meant to be used
+    from one event loop.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 60.0,
+        generation: Optional[Callable[[], Awaitable[Optional[str]]]] = None,
+        generation_interval: float = 10.0,
+    ):
+        """Initialize the cache.
+
+        Args:
+            max_bytes: Approximate memory budget of cached results (counted in characters)
+            ttl: Seconds a result is served from the cache
+            generation: Returns the current index generation of the backend, or None if it has none
+            generation_interval: Seconds between checks of the index generation
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.generation_interval = generation_interval
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+        self._generation_source = generation
+        self._generation: Optional[str] = None
+        self._generation_checked_at = float("-inf")
+        self._generation_check: Optional[asyncio.Future] = None
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        # Keyed by (key, group)
+        self._inflight: Dict[Tuple[Hashable, Hashable], asyncio.Future] = {}
+        self._size = 0
+
+    async def get_or_search(
+        self, key: Hashable, search: Callable[[], Awaitable[List[FormattedResult]]], group: Hashable = None
+    ) -> List[FormattedResult]:
+        """Return the cached results of ``key``, or run ``search`` once for all concurrent callers.
+
+        Failed searches are not cached; their exception is raised to every waiting caller.
+        Incomplete results, and results of a fallback backend, are returned to the waiting
+        callers but not cached either. Concurrent callers share a search only within their
+        ``group`` (e.g. a priority class, so that one class being shed does not fail the
+        callers of another), while the cached results are shared by all groups.
+
+        Returns:
+            list: A copy of the results, which callers may modify
+        """
+        await self._check_generation()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            if time.monotonic() - entry.created_at < self.ttl and entry.generation == self._generation:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return list(entry.results)
+            self._remove(key)
+
+        inflight = self._inflight.get((key, group))
+        if inflight is not None:
+            self.coalesced += 1
+            return list(await asyncio.shield(inflight))
+
+        self.misses += 1
+        # The search runs in a task of its own, so that a caller giving up (e.g. a client that
+        # disconnected) cancels only its own wait, never the search the other callers wait for
+        task = asyncio.ensure_future(self._search(key, search, group))
+        task.add_done_callback(_retrieve_exception)
+        self._inflight[(key, group)] = task
+        return list(await asyncio.shield(task))
+
+    async def _search(
+        self, key: Hashable, search: Callable[[], Awaitable[List[FormattedResult]]], group: Hashable
+    ) -> List[FormattedResult]:
+        generation = self._generation
+        try:
+            results = await search()
+        finally:
+            del self._inflight[(key, group)]
+        # Partial results (e.g. of a search that timed out) are served once but not kept, and so are
+        # fallback results, which would otherwise outlive the outage and escape the generation checks
+        cacheable = not getattr(results, "incomplete", False) and not getattr(results, "fallback", False)
+        if generation == self._generation and cacheable:
+            self._put(key, results, generation)
+        return results
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+        }
+
+    async def _check_generation(self) -> None:
+        """Drop every entry when the index generation changed; checked at most once per interval."""
+        if self._generation_source is None:
+            return
+        if self._generation_check is not None:
+            await asyncio.shield(self._generation_check)
+            return
+        if time.monotonic() - self._generation_checked_at < self.generation_interval:
+            return
+
+        self._generation_check = asyncio.ensure_future(self._fetch_generation())
+        try:
+            generation = await asyncio.shield(self._generation_check)
+        finally:
+            self._generation_check = None
+        self._generation_checked_at = time.monotonic()
+        if generation is not None and generation != self._generation:
+            if self._generation is not None:
+                logger.info("Search index generation changed, dropping cached search results")
+                self.invalidations += 1
+            self._generation = generation
+            self._entries.clear()
+            self._size = 0
+
+    async def _fetch_generation(self) -> Optional[str]:
+        try:
+            return await self._generation_source()
+        except Exception as exc:
+            # Keep serving within the TTL; the next interval checks again
+            logger.warning(f"Could not check the search index generation: {exc}")
+            return None
+
+    def _put(self, key: Hashable, results: List[FormattedResult], generation: Optional[str]) -> None:
+        size = results_size(results)
+        if size > self.max_bytes:
+            return
+        self._remove(key)
+        self._entries[key] = _Entry(results, size, generation)
+        self._size += size
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= evicted.size
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry.size
+
+
+def _retrieve_exception(task: asyncio.Future) -> None:
+    """Retrieve the exception of a search so the loop does not warn when every caller stopped waiting."""
+    if not task.cancelled():
+        task.exception()
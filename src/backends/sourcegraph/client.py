@@ -1,70 +1,115 @@
+import asyncio
 import json
 import logging
-from typing import Any, Dict, Iterator, List
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from urllib.parse import urlencode
 
+import httpx
 import requests
 
-from backends.models import FormattedResult, Match
+from backends.budget import OutputBudget, context_window, line_span
+from backends.models import FormattedResult, LazyMatch, Match, truncate_line
 from backends.search import AbstractSearchClient
+from backends.transport import HTTPTransport, raise_for_status
 
 logger = logging.getLogger(__name__)
 
+# Context lines requested around each match; trimmed further as the output budget runs out
+CONTEXT_LINES = 5
 
-class SSEParser:
-    def __init__(self, response: requests.Response):
-        self.response = response
-        self.buffer = ""
-
-    def __iter__(self) -> Iterator[Dict[str, str]]:
-        try:
-            for chunk in self.response.iter_content(chunk_size=8192, decode_unicode=False):
-                if chunk:
-                    try:
-                        text = chunk.decode("utf-8", errors="replace")
-                        self.buffer += text
-                        yield from self._parse_buffer()
-                    except Exception as e:
-                        logger.warning(f"Error processing chunk: {e}")
-        except Exception as e:
-            logger.error(f"Error reading SSE stream: {e}")
 
-        if self.buffer:
-            yield from self._parse_buffer(final=True)
+class SSEParser:
+    """Incremental parser for a server-sent events stream.
+
+    Raw bytes are appended to a bytearray and scanned from an offset, so a large
+    event arriving in many chunks is scanned once and consumed bytes are released
+    without re-copying the rest of the buffer. Lines end with ``\\r\\n``, ``\\n``
+    or ``\\r``. Each line is decoded only once it is complete, so multi-byte UTF-8
+    characters split across chunks are never corrupted.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        # Where to resume looking for a line terminator, relative to the buffer start
+        self._scan = 0
+        self._event_type = ""
+        self._data: List[str] = []
+
+    def feed(self, chunk: bytes) -> Iterator[Dict[str, str]]:
+        """Consume a chunk of the raw stream and yield the events it completes."""
+        if chunk:
+            self._buffer += chunk
+            yield from self._parse_buffer()
+
+    def close(self) -> Iterator[Dict[str, str]]:
+        """Yield a trailing event that was not terminated by a blank line."""
+        yield from self._parse_buffer(final=True)
+        if self._buffer:
+            self._parse_line(self._buffer, 0, len(self._buffer))
+            self._buffer.clear()
+        event = self._dispatch()
+        if event:
+            yield event
 
     def _parse_buffer(self, final: bool = False) -> Iterator[Dict[str, str]]:
+        buffer = self._buffer
+        start = 0
         while True:
-            event_end = self.buffer.find("\n\n")
-            if event_end == -1:
-                if final and self.buffer.strip():
-                    event_data = self._parse_event(self.buffer)
-                    if event_data:
-                        yield event_data
-                    self.buffer = ""
+            line_end, next_line = self._find_line_end(buffer, self._scan, final)
+            if line_end < 0:
                 break
 
-            event_text = self.buffer[:event_end]
-            self.buffer = self.buffer[event_end + 2 :]  # Skip the \n\n
-
-            event_data = self._parse_event(event_text)
-            if event_data:
-                yield event_data
-
-    def _parse_event(self, event_text: str) -> Dict[str, str]:
-        event_type = None
-        data_lines = []
-
-        for line in event_text.split("\n"):
-            if line.startswith("event: "):
-                event_type = line[7:].strip()
-            elif line.startswith("data: "):
-                data_lines.append(line[6:])
-
-        if event_type and data_lines:
+            if line_end == start:
+                event = self._dispatch()
+                if event:
+                    yield event
+            else:
+                self._parse_line(buffer, start, line_end)
+            start = self._scan = next_line
+
+        if start:
+            # Deleting from the front of a bytearray does not move the remaining bytes
+            del buffer[:start]
+        # Resume after what was scanned, keeping a possible trailing CR in view
+        self._scan = max(len(buffer) - 1, 0)
+
+    @staticmethod
+    def _find_line_end(buffer: bytearray, pos: int, final: bool) -> Tuple[int, int]:
+        """Return the offsets of the next line terminator and of the line after it, or (-1, -1)."""
+        lf = buffer.find(b"\n", pos)
+        cr = buffer.find(b"\r", pos, len(buffer) if lf < 0 else lf)
+        if cr < 0:
+            return (lf, lf + 1) if lf >= 0 else (-1, -1)
+        if cr + 1 < len(buffer):
+            return cr, cr + 2 if buffer[cr + 1] == 0x0A else cr + 1
+        # A trailing CR may be the first half of CRLF
+        return (cr, cr + 1) if final else (-1, -1)
+
+    def _parse_line(self, buffer: bytearray, start: int, end: int) -> None:
+        if buffer[start] == 0x3A:  # ":" starts a comment
+            return
+
+        colon = buffer.find(b":", start, end)
+        if colon < 0:
+            name, value_start = bytes(buffer[start:end]), end
+        else:
+            name, value_start = bytes(buffer[start:colon]), colon + 1
+            if value_start < end and buffer[value_start] == 0x20:
+                value_start += 1
+
+        if name == b"data":
+            self._data.append(buffer[value_start:end].decode("utf-8", errors="replace"))
+        elif name == b"event":
+            self._event_type = buffer[value_start:end].decode("utf-8", errors="replace").strip()
+
+    def _dispatch(self) -> Dict[str, str]:
+        """Complete the current event at a blank line."""
+        event_type, data = self._event_type, self._data
+        self._event_type, self._data = "", []
+        if event_type and data:
             # Join multi-line data fields
-            data = "\n".join(data_lines)
-            return {"event": event_type, "data": data}
-
+            return {"event": event_type, "data": "\n".join(data)}
         return {}
 
 
@@ -75,6 +120,9 @@ class SourcegraphClient(AbstractSearchClient):
         token: str = "",
         max_line_length: int = 300,
         max_output_length: int = 100000,
+        transport: Optional[HTTPTransport] = None,
+        max_output_tokens: Optional[int] = None,
+        search_timeout: float = 10.0,
     ):
         """Initialize Sourcegraph client.
 
@@ -83,6 +131,9 @@ class SourcegraphClient(AbstractSearchClient):
             token: Authentication token (optional for public instances)
             max_line_length: Maximum length for a single line before truncation
             max_output_length: Maximum length for the entire output before truncation
+            transport: Shared HTTP transport (a private one is created if omitted)
+            max_output_tokens: Maximum estimated number of tokens for the entire output (optional)
+            search_timeout: Seconds after which a search stream is closed and partial results returned
         """
         if not endpoint:
             raise ValueError("Sourcegraph endpoint is required")
@@ -91,23 +142,105 @@ class SourcegraphClient(AbstractSearchClient):
         self.token = token
         self.max_line_length = max_line_length
         self.max_output_length = max_output_length
+        self.max_output_tokens = max_output_tokens
+        self.transport = transport or HTTPTransport()
+        self.search_timeout = search_timeout
 
     def search(self, query: str, num: int) -> dict:
         """Execute a search query on Sourcegraph and return raw results.
 
+        The stream is closed as soon as ``num`` matches have arrived or
+        ``search_timeout`` has passed, rather than when Sourcegraph finishes.
+
         Args:
             query: The search query string
             num: Maximum number of results to return
 
         Returns:
-            Raw search results as a dictionary
+            Raw search results as a dictionary. ``incomplete`` is True when the
+            stream was closed before the ``done`` event, and ``stop_reason`` says why.
         """
+        url, headers = self._stream_request(query, num)
+        deadline = time.monotonic() + self.search_timeout
+        # Waiting for the response headers counts against the deadline as well
+        timeout = (self.transport.timeout[0], self.search_timeout)
+
+        try:
+            response = self.transport.get(url, headers=headers, stream=True, timeout=timeout)
+            raise_for_status(response)
+        except requests.RequestException as e:
+            logger.error(f"Sourcegraph search request failed: {e}")
+            raise requests.exceptions.HTTPError(f"Search failed: {e}")
+
+        results = self._new_results()
+        parser = SSEParser()
+
+        try:
+            self._limit_next_read(response, deadline)
+            # chunk_size=None yields each chunk of the chunked response as soon as it arrives, so
+            # events are seen (and reading can stop) without waiting for a fixed-size buffer to fill
+            for chunk in response.iter_content(chunk_size=None):
+                if any(self._handle_event(results, event, num) for event in parser.feed(chunk)):
+                    return self._finish(results, deadline)
+                if time.monotonic() >= deadline:
+                    self._stop(results, "deadline")
+                    return self._finish(results, deadline)
+                self._limit_next_read(response, deadline)
+        except requests.RequestException as e:
+            # Including a read timed out at the deadline; the events received so far are returned
+            logger.error(f"Error reading SSE stream: {e}")
+        finally:
+            response.close()
+        for event in parser.close():
+            if self._handle_event(results, event, num):
+                break
+
+        return self._finish(results, deadline)
+
+    async def asearch(self, query: str, num: int) -> dict:
+        """Asynchronous counterpart of :meth:`search`."""
+        url, headers = self._stream_request(query, num)
+        deadline = time.monotonic() + self.search_timeout
+        results = self._new_results()
+
+        try:
+            async with asyncio.timeout(self.search_timeout):
+                async with self.transport.astream("GET", url, headers=headers) as response:
+                    raise_for_status(response)
+                    parser = SSEParser()
+                    try:
+                        async for chunk in response.aiter_bytes():
+                            if any(self._handle_event(results, event, num) for event in parser.feed(chunk)):
+                                return self._finish(results, deadline)
+                    except httpx.HTTPError as e:
+                        logger.error(f"Error reading SSE stream: {e}")
+                    for event in parser.close():
+                        if self._handle_event(results, event, num):
+                            break
+        except TimeoutError:
+            self._stop(results, "deadline")
+        except requests.RequestException as e:
+            logger.error(f"Sourcegraph search request failed: {e}")
+            raise requests.exceptions.HTTPError(f"Search failed: {e}")
+
+        return self._finish(results, deadline)
+
+    @staticmethod
+    def _limit_next_read(response: requests.Response, deadline: float) -> None:
+        """Make the next read of a streamed response time out at ``deadline`` rather than a full read timeout later."""
+        connection = getattr(response.raw, "connection", None)
+        sock = getattr(connection, "sock", None)
+        if sock is not None:
+            sock.settimeout(max(deadline - time.monotonic(), 0.001))
+
+    def _stream_request(self, query: str, num: int) -> Tuple[str, Dict[str, str]]:
+        """Build the URL and headers of a streaming search request."""
         params = {
             "q": query,
             "t": "keyword",
             "v": "V3",
             "cm": "true",  # chunk matches
-            "cl": "5",
+            "cl": str(CONTEXT_LINES),
             "display": str(num),  # Limit results on the server side
         }
 
@@ -120,61 +253,86 @@ class SourcegraphClient(AbstractSearchClient):
         if self.token:
             headers["Authorization"] = f"token {self.token}"
 
-        try:
-            response = requests.get(url, headers=headers, stream=True)
-            response.raise_for_status()
-        except requests.RequestException as e:
-            logger.error(f"Sourcegraph search request failed: {e}")
-            raise requests.exceptions.HTTPError(f"Search failed: {e}")
+        return url, headers
 
-        matches = []
-        filters = []
-        progress = []
-        alerts = []
-
-        try:
-            parser = SSEParser(response)
-            for event in parser:
-                event_type = event.get("event", "")
-                data_str = event.get("data", "")
-
-                if event_type == "done":
-                    break
-
-                if not data_str:
-                    continue
+    @staticmethod
+    def _new_results() -> Dict[str, Any]:
+        return {
+            "matches": [],
+            "filters": [],
+            "progress": {"skipped": {}},
+            "alerts": [],
+            "incomplete": False,
+            "stop_reason": None,
+        }
 
-                try:
-                    data = json.loads(data_str)
+    @staticmethod
+    def _stop(results: Dict[str, Any], reason: str) -> None:
+        results["stop_reason"] = reason
+        results["incomplete"] = reason != "done"
+
+    def _finish(self, results: Dict[str, Any], deadline: float) -> Dict[str, Any]:
+        if results["stop_reason"] is None:
+            # The stream ended without a done event, e.g. after a read timeout
+            self._stop(results, "deadline" if time.monotonic() >= deadline else "interrupted")
+        if results["incomplete"]:
+            logger.info(
+                f"Sourcegraph stream closed early ({results['stop_reason']}) with {len(results['matches'])} matches"
+            )
+        return results
+
+    @classmethod
+    def _handle_event(cls, results: Dict[str, Any], event: Dict[str, str], num: int) -> bool:
+        """Merge one stream event into ``results``.
 
-                    if event_type == "matches" and isinstance(data, list):
-                        matches.extend(data)
-                    elif event_type == "filters" and isinstance(data, list):
-                        filters = data  # Replace, don't extend
-                    elif event_type == "progress":
-                        progress.append(data)
-                    elif event_type == "alert":
-                        alerts.append(data)
+        Returns:
+            True once the stream can be closed: the ``done`` event has been received
+            or ``num`` matches have been collected
+        """
+        event_type = event.get("event", "")
+        data_str = event.get("data", "")
 
-                except json.JSONDecodeError as e:
-                    logger.warning(f"Failed to parse JSON for event '{event_type}': {e}")
-                    logger.debug(f"Problematic data: {data_str[:500]}...")
+        if event_type == "done":
+            cls._stop(results, "done")
+            return True
 
-        finally:
-            response.close()
+        if not data_str:
+            return False
 
-        return {
-            "matches": matches,
-            "filters": filters,
-            "progress": progress,
-            "alerts": alerts,
-        }
+        try:
+            data = json.loads(data_str)
+
+            if event_type == "matches" and isinstance(data, list):
+                results["matches"].extend(data)
+                if len(results["matches"]) >= num:
+                    del results["matches"][num:]
+                    cls._stop(results, "limit")
+                    return True
+            elif event_type == "filters" and isinstance(data, list):
+                results["filters"] = data  # Replace, don't extend
+            elif event_type == "progress" and isinstance(data, dict):
+                cls._summarize_progress(results["progress"], data)
+            elif event_type == "alert":
+                results["alerts"].append(data)
+
+        except json.JSONDecodeError as e:
+            logger.warning(f"Failed to parse JSON for event '{event_type}': {e}")
+            logger.debug(f"Problematic data: {data_str[:500]}...")
+
+        return False
+
+    @staticmethod
+    def _summarize_progress(summary: Dict[str, Any], progress: Dict[str, Any]) -> None:
+        """Keep the latest counters and the distinct skip reasons of progress events."""
+        for key in ("matchCount", "repositoriesCount", "durationMs"):
+            if key in progress:
+                summary[key] = progress[key]
+        for skipped in progress.get("skipped") or ():
+            summary["skipped"][skipped.get("reason", "")] = skipped.get("title") or skipped.get("message", "")
 
     def _truncate_line(self, line: str) -> str:
         """Truncate a line if it exceeds max_line_length."""
-        if len(line) > self.max_line_length:
-            return line[: self.max_line_length - 3] + "..."
-        return line
+        return truncate_line(line, self.max_line_length)
 
     def _safe_get(self, obj: dict, *keys, default=None):
         """Safely get nested dictionary values."""
@@ -189,21 +347,28 @@ class SourcegraphClient(AbstractSearchClient):
     def format_results(self, results: dict, num: int) -> List[FormattedResult]:
         """Format Sourcegraph search results into structured FormattedResult objects.
 
+        Formatting stops once ``max_output_length`` is spent; context lines around
+        matches shrink as the budget runs out.
+
         Args:
             results: Raw search results from the search method
             num: Maximum number of results to format
 
         Returns:
-            List of formatted results
+            List of formatted results, with the files and matches left out by the
+            output budget counted in its ``omitted_files`` and ``omitted_matches``
         """
+        budget = OutputBudget(self.max_output_length, self.max_output_tokens, context_lines=CONTEXT_LINES)
+        # Stopping at the requested number of matches is the only early stop that leaves nothing out
+        budget.incomplete = bool(results) and results.get("stop_reason") not in ("done", "limit")
         formatted = []
 
         if not results or "matches" not in results:
-            return formatted
+            return budget.results(formatted)
 
         matches = results["matches"]
         if not matches:
-            return formatted
+            return budget.results(formatted)
 
         # Log any alerts
         for alert in results.get("alerts", []):
@@ -236,46 +401,19 @@ class SourcegraphClient(AbstractSearchClient):
                 other_matches.append(match)
 
         # Process content matches
-        for key, matches in file_matches.items():
+        for index, (key, matches) in enumerate(file_matches.items()):
             repo, file_path = key.split(":", 1)
-            formatted_matches = []
-            url = ""
-
-            for match in matches:
-                # Handle chunk matches if available
-                chunk_matches = match.get("chunkMatches", [])
-                if chunk_matches:
-                    for chunk in chunk_matches:
-                        content = chunk.get("content", "")
-                        content_start = self._safe_get(chunk, "contentStart", default={})
-                        line_number = content_start.get("line", 0) + 1  # 1-indexed
-                        lines = content.split("\n")
-                        truncated_lines = [self._truncate_line(line) for line in lines]
-                        text = "\n".join(truncated_lines)
-                        if not url:
-                            url = f"https://{repo}/-/blob/HEAD/{file_path}"
-                        formatted_matches.append(
-                            Match(
-                                line_number=line_number,
-                                text=text,
-                            )
-                        )
-                else:
-                    # Fall back to line matches if no chunk matches
-                    line_matches = match.get("lineMatches", [])
-                    for line_match in line_matches:
-                        line = line_match.get("line", "")
-                        line_number = line_match.get("lineNumber", 0) + 1
-                        text = self._truncate_line(line)
-                        if not url:
-                            url = f"https://{repo}/-/blob/HEAD/{file_path}"
-                        formatted_matches.append(
-                            Match(
-                                line_number=line_number,
-                                text=text,
-                            )
-                        )
+            url = f"https://{repo}/-/blob/HEAD/{file_path}"
+            if not budget.charge_result(file_path, repo, url):
+                remaining = list(file_matches.values())[index:]
+                budget.omit(
+                    files=len(remaining) + len(other_matches),
+                    matches=sum(self._match_count(match) for group in remaining for match in group)
+                    + len(other_matches),
+                )
+                return budget.results(formatted)
 
+            formatted_matches = self._content_matches(matches, budget)
             if formatted_matches:
                 formatted.append(
                     FormattedResult(
@@ -285,9 +423,15 @@ class SourcegraphClient(AbstractSearchClient):
                         url=url,
                     )
                 )
+            elif budget.exhausted:
+                budget.omit(files=1)
+
+        # Process other match types
+        for index, match in enumerate(other_matches):
+            if budget.exhausted:
+                budget.omit(files=len(other_matches) - index, matches=len(other_matches) - index)
+                break
 
-        # Process other match types (keeping the same as before)
-        for match in other_matches:
             match_type = match.get("type", "")
             repo = match.get("repository", "")
 
@@ -321,8 +465,9 @@ class SourcegraphClient(AbstractSearchClient):
                         )
                     )
 
+                url = f"https://{repo}/-/blob/HEAD/{file_path}" if file_path else ""
+                formatted_matches = self._fit_matches(formatted_matches, budget, file_path, repo, url)
                 if formatted_matches:
-                    url = f"https://{repo}/-/blob/HEAD/{file_path}" if file_path else ""
                     formatted.append(
                         FormattedResult(
                             filename=file_path,
@@ -343,14 +488,16 @@ class SourcegraphClient(AbstractSearchClient):
                     )
                 )
 
-                formatted.append(
-                    FormattedResult(
-                        filename="",  # No specific file for repo matches
-                        repository=repo,
-                        matches=formatted_matches,
-                        url=f"https://{repo}",
+                formatted_matches = self._fit_matches(formatted_matches, budget, repo, f"https://{repo}")
+                if formatted_matches:
+                    formatted.append(
+                        FormattedResult(
+                            filename="",  # No specific file for repo matches
+                            repository=repo,
+                            matches=formatted_matches,
+                            url=f"https://{repo}",
+                        )
                     )
-                )
 
             elif match_type in ["path", "commit", "diff"]:
                 # Handle path, commit, and diff matches with basic information
@@ -376,8 +523,9 @@ class SourcegraphClient(AbstractSearchClient):
                     )
                 )
 
+                url = f"https://{repo}/-/blob/HEAD/{file_path}" if file_path else f"https://{repo}"
+                formatted_matches = self._fit_matches(formatted_matches, budget, file_path, repo, url)
                 if formatted_matches:
-                    url = f"https://{repo}/-/blob/HEAD/{file_path}" if file_path else f"https://{repo}"
                     formatted.append(
                         FormattedResult(
                             filename=file_path,
@@ -387,4 +535,72 @@ class SourcegraphClient(AbstractSearchClient):
                         )
                     )
 
-        return formatted
+        return budget.results(formatted)
+
+    @staticmethod
+    def _match_count(match: Dict[str, Any]) -> int:
+        return len(match.get("chunkMatches") or match.get("lineMatches") or ()) or 1
+
+    def _content_matches(self, matches: List[Dict[str, Any]], budget: OutputBudget) -> List[Match]:
+        """Format the chunk or line matches of one file within the output budget."""
+        formatted_matches = []
+        for match_index, match in enumerate(matches):
+            # Handle chunk matches if available, fall back to line matches
+            chunk_matches = match.get("chunkMatches", [])
+            line_matches = [] if chunk_matches else match.get("lineMatches", [])
+            entries = chunk_matches or line_matches
+
+            for index, entry in enumerate(entries):
+                if chunk_matches:
+                    formatted_match = self._chunk_match(entry, budget)
+                else:
+                    kept = budget.take_lines([self._truncate_line(entry.get("line", ""))])
+                    formatted_match = Match(line_number=entry.get("lineNumber", 0) + 1, text=kept[0]) if kept else None
+
+                if formatted_match is None:
+                    budget.omit(
+                        matches=len(entries)
+                        - index
+                        + sum(self._match_count(rest) for rest in matches[match_index + 1 :])
+                    )
+                    return formatted_matches
+                formatted_matches.append(formatted_match)
+        return formatted_matches
+
+    def _chunk_match(self, chunk: Dict[str, Any], budget: OutputBudget) -> Optional[LazyMatch]:
+        """Charge the lines of a chunk that fit the budget and its context, as a match cut from the chunk later."""
+        content_start = self._safe_get(chunk, "contentStart", "line", default=0)
+        content = chunk.get("content", "")
+        start, end = 0, len(content)
+        ranges = chunk.get("ranges") or []
+        if ranges:
+            first = self._safe_get(ranges[0], "start", "line", default=content_start) - content_start
+            last = self._safe_get(ranges[-1], "end", "line", default=content_start) - content_start
+            num_lines = content.count("\n") + 1
+            window = context_window(num_lines, first, last, budget.context_lines())
+            start, end = line_span(content, window, num_lines)
+            content_start += window.start
+
+        taken = budget.take_span(content, start, end, self.max_line_length)
+        if taken is None:
+            return None
+        end, truncated = taken
+        # 1-indexed
+        return LazyMatch(content_start + 1, content, start, end, self.max_line_length if truncated else None)
+
+    @staticmethod
+    def _fit_matches(matches: List[Match], budget: OutputBudget, *fields: str) -> List[Match]:
+        """Charge a result and its matches, keeping the matches that fit."""
+        if not budget.charge_result(*fields):
+            budget.omit(files=1, matches=len(matches))
+            return []
+
+        kept = []
+        for index, match in enumerate(matches):
+            if budget.take_lines([match.text]) is None:
+                budget.omit(matches=len(matches) - index)
+                break
+            kept.append(match)
+        if not kept:
+            budget.omit(files=1)
+        return kept
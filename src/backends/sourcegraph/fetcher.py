@@ -1,23 +1,143 @@
 """Sourcegraph content fetcher implementation."""
 
 import json
-from typing import Any, List, Optional
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 from urllib.parse import urljoin
 
 import requests
 
-from backends.content_fetcher import MAX_FILE_SIZE, AbstractContentFetcher
+from backends.breaker import raise_if_unavailable
+from backends.content_cache import ContentCache, is_commit_sha
+from backends.content_fetcher import (
+    NOT_FOUND_MESSAGE,
+    AbstractContentFetcher,
+    select_lines,
+    truncate_file_content,
+)
+from backends.sourcegraph.tree_cache import TreeCache, TreeListing
+from backends.transport import HTTPTransport, raise_for_status
+from backends.tree import PathTree, TreeNode
+
+# Resolves the path as a file or a directory in one round trip, selecting only the fields
+# that are rendered (richHTML in particular makes Sourcegraph highlight the whole file).
+# The selection is filled in by path_content_query for the requested depth.
+PATH_CONTENT_QUERY = """
+query GetPathContent($name: String!, $path: String!, $rev: String!) {
+    repository(name: $name) {
+        commit(rev: $rev) {
+            oid
+            path(path: $path) {%s
+            }
+        }
+    }
+}
+"""
+
+# Deeper listings are fetched recursively as flat paths instead of as nested selections
+MAX_NESTED_TREE_DEPTH = 4
+
+
+def path_selection(depth: int) -> List[str]:
+    """Return the lines selected on a path for a directory listing of the given depth.
+
+    Up to MAX_NESTED_TREE_DEPTH levels, ``entries`` is nested once per level, so no
+    level below the requested depth is downloaded. Deeper listings use a single
+    recursive ``entries`` selection that returns the whole subtree.
+    """
+    lines = ["__typename", "... on GitBlob {", "    content", "}"]
+    if depth <= 0:
+        return lines
+
+    if depth > MAX_NESTED_TREE_DEPTH:
+        entries = ["entries(recursive: true) {", "    path", "    isDirectory", "}"]
+    else:
+        entries = _nested_entries(depth)
+    return lines + ["... on GitTree {", *(f"    {line}" for line in entries), "}"]
+
+
+@lru_cache(maxsize=32)
+def path_content_query(depth: int) -> str:
+    """Build the ``GetPathContent`` query for a directory listing of the given depth."""
+    return PATH_CONTENT_QUERY % _indent(path_selection(depth), 16)
+
+
+def batch_content_query(
+    items: Sequence[Tuple[str, str]], revs: Dict[str, str], depth: int
+) -> Tuple[str, Dict[str, str], List[Tuple[str, str]]]:
+    """Build one ``GetPathContents`` query resolving several paths through aliased fields.
+
+    Paths of the same repository share one aliased ``repository`` field, ``rN``, read
+    at the revision ``$vN``; the path of the i-th item is aliased ``pi``.
+
+    Args:
+        items: (repository, path) pairs, with cleaned paths ("" for the root)
+        revs: Revision to read each repository at
+        depth: Tree depth for directory listings
+
+    Returns:
+        tuple: (query, variables, (repository alias, path alias) of each item)
+    """
+    variables: Dict[str, str] = {}
+    repo_aliases: Dict[str, str] = {}
+    paths_by_repo: Dict[str, List[str]] = {}
+    aliases = []
+    for i, (repository, path) in enumerate(items):
+        repo_alias = repo_aliases.get(repository)
+        if repo_alias is None:
+            repo_alias = repo_aliases[repository] = f"r{len(repo_aliases)}"
+            variables[repo_alias] = repository
+            variables[f"v{repo_alias[1:]}"] = revs[repository]
+            paths_by_repo[repo_alias] = []
+        variables[f"p{i}"] = path or "."
+        paths_by_repo[repo_alias].append(f"p{i}")
+        aliases.append((repo_alias, f"p{i}"))
+
+    selection = _indent(path_selection(depth), 16)
+    lines = [f"query GetPathContents({', '.join(f'${name}: String!' for name in variables)}) {{"]
+    for repo_alias, path_aliases in paths_by_repo.items():
+        lines += [
+            f"    {repo_alias}: repository(name: ${repo_alias}) {{",
+            f"        commit(rev: $v{repo_alias[1:]}) {{",
+            "            oid",
+        ]
+        for path_alias in path_aliases:
+            lines += [f"            {path_alias}: path(path: ${path_alias}) {{{selection}", "            }"]
+        lines += ["        }", "    }"]
+    lines.append("}")
+    return "\n".join(lines), variables, aliases
+
+
+def _nested_entries(levels: int) -> List[str]:
+    lines = ["entries {", "    name", "    isDirectory"]
+    if levels > 1:
+        lines += ["    ... on GitTree {", *(f"        {line}" for line in _nested_entries(levels - 1)), "    }"]
+    return lines + ["}"]
+
+
+def _indent(lines: List[str], width: int) -> str:
+    return "".join(f"\n{' ' * width}{line}" for line in lines)
 
 
 class SourcegraphContentFetcher(AbstractContentFetcher):
     """Fetches content from Sourcegraph repositories."""
 
-    def __init__(self, endpoint: str, token: str = ""):
+    def __init__(
+        self,
+        endpoint: str,
+        token: str = "",
+        transport: Optional[HTTPTransport] = None,
+        tree_cache: Optional[TreeCache] = None,
+        content_cache: Optional[ContentCache] = None,
+    ):
         """Initialize Sourcegraph content fetcher.
 
         Args:
             endpoint: Sourcegraph API endpoint
             token: Authentication token (optional for public instances)
+            transport: Shared HTTP transport (a private one is created if omitted)
+            tree_cache: Directory listing cache (a private one is created if omitted)
+            content_cache: Commit-pinned file content cache (a private one is created if omitted)
 
         Raises:
             ValueError: If endpoint is not provided
@@ -27,10 +147,21 @@ class SourcegraphContentFetcher(AbstractContentFetcher):
 
         self.endpoint = endpoint
         self.token = token
+        self.transport = transport or HTTPTransport()
+        self._trees = tree_cache or TreeCache()
+        self._contents = content_cache or ContentCache()
 
         self.src_url = urljoin(self.endpoint, ".api/graphql")
 
-    def get_content(self, repository: str, path: str = "", depth: int = 2, ref: str = "HEAD") -> str:
+    def get_content(
+        self,
+        repository: str,
+        path: str = "",
+        depth: int = 2,
+        ref: str = "HEAD",
+        start_line: Optional[int] = None,
+        end_line: Optional[int] = None,
+    ) -> str:
         """Get content from Sourcegraph repository.
 
         Args:
@@ -38,181 +169,272 @@ class SourcegraphContentFetcher(AbstractContentFetcher):
             path: File or directory path (e.g., "src/main.py" or "src/api/handlers.go")
             depth: Tree depth for directory listings
             ref: Git reference (branch, tag, or commit SHA)
+            start_line: First line of a file to return, counted from 1 (the first line if omitted)
+            end_line: Last line of a file to return, inclusive (the last line if omitted)
 
         Returns:
-            File content if path is a file, directory tree if path is a directory
+            File content (or the requested lines of it) if path is a file, directory tree if path is a directory
 
         Raises:
             ValueError: If repository or path does not exist
         """
-        # Clean repository path for Sourcegraph
         repository = self._clean_repository_path(repository)
+        path = self._clean_path(path)
+        cached, rev = self._cached_content(repository, path, depth, ref, start_line, end_line)
+        if cached is not None:
+            return cached
+
+        data = self._graphql(path_content_query(depth), {"name": repository, "path": path or ".", "rev": rev})
+        return self._render_path_content(repository, path, data, depth, ref, start_line, end_line)
+
+    async def aget_content(
+        self,
+        repository: str,
+        path: str = "",
+        depth: int = 2,
+        ref: str = "HEAD",
+        start_line: Optional[int] = None,
+        end_line: Optional[int] = None,
+    ) -> str:
+        """Asynchronous counterpart of :meth:`get_content`."""
+        repository = self._clean_repository_path(repository)
+        path = self._clean_path(path)
+        cached, rev = await self._contents.alookup(
+            self._cached_content, repository, path, depth, ref, start_line, end_line
+        )
+        if cached is not None:
+            return cached
 
-        if not path:
-            try:
-                tree = self._get_sourcegraph_tree(repository, ".", depth)
-                return tree
-            except ValueError:
-                raise ValueError("invalid arguments the given path or repository does not exist")
+        data = await self._agraphql(path_content_query(depth), {"name": repository, "path": path or ".", "rev": rev})
+        return self._render_path_content(repository, path, data, depth, ref, start_line, end_line)
 
-        # Try file first, then directory
-        try:
-            file_content = self._get_sourcegraph_file_content(repository, path)
-            if file_content:
-                return file_content
-        except ValueError:
-            pass  # File not found, try as directory
+    def get_contents(self, items: Sequence[Tuple[str, str]], depth: int = 2, ref: str = "HEAD") -> List[str]:
+        """Get the content of several paths with a single GraphQL request.
 
-        try:
-            tree = self._get_sourcegraph_tree(repository, path, depth)
-            return tree
-        except ValueError:
-            # Only raise "not found" if both file and directory lookups fail
-            raise ValueError("invalid arguments the given path or repository does not exist")
+        Directories answered by the tree cache are left out of the request.
 
-    def _get_sourcegraph_file_content(self, repo_name: str, path: str) -> Optional[str]:
-        """Get file content from Sourcegraph."""
-        query = """
-        query GetFileContent($name: String!, $path: String!) {
-            repository(name: $name) {
-                commit(rev: "HEAD") {
-                    file(path: $path) {
-                        path
-                        name
-                        content
-                        totalLines
-                        binary
-                        contentType
-                        richHTML
-                        languages
-                    }
-                }
-            }
-        }
+        Raises:
+            BackendUnavailable: If Sourcegraph cannot be reached
         """
+        items, contents, revs, missing = self._batch_lookup(items, depth, ref)
+        if missing:
+            query, variables, aliases = batch_content_query([items[i] for i in missing], revs, depth)
+            data = self._graphql(query, variables)
+            self._fill_batch(contents, items, missing, aliases, data, depth, ref)
+        return contents
+
+    async def aget_contents(self, items: Sequence[Tuple[str, str]], depth: int = 2, ref: str = "HEAD") -> List[str]:
+        """Asynchronous counterpart of :meth:`get_contents`."""
+        items, contents, revs, missing = await self._contents.alookup(self._batch_lookup, items, depth, ref)
+        if missing:
+            query, variables, aliases = batch_content_query([items[i] for i in missing], revs, depth)
+            data = await self._agraphql(query, variables)
+            self._fill_batch(contents, items, missing, aliases, data, depth, ref)
+        return contents
+
+    def _batch_lookup(
+        self, items: Sequence[Tuple[str, str]], depth: int, ref: str
+    ) -> Tuple[List[Tuple[str, str]], List[Optional[str]], Dict[str, str], List[int]]:
+        """Clean the items of a batch and answer what the caches can.
 
-        variables = {"name": repo_name, "path": path}
-        headers = {
-            "Content-Type": "application/json",
-        }
-        if self.token:
-            headers["Authorization"] = f"token {self.token}"
-        payload = {"query": query, "variables": variables}
-
-        try:
-            response = requests.post(self.src_url, json=payload, headers=headers)
-            response.raise_for_status()
-
-            data = response.json()
-
-            if "errors" in data:
-                raise ValueError("invalid arguments the given path or repository does not exist")
-
-            content = self._safe_get(data, ["data", "repository", "commit", "file", "content"], default=None)
-
-            if content and len(content) > MAX_FILE_SIZE:
-                total_lines = self._safe_get(
-                    data, ["data", "repository", "commit", "file", "totalLines"], default="unknown"
-                )
-                truncated_content = content[:MAX_FILE_SIZE]
-                # Find last complete line
-                last_newline = truncated_content.rfind("\n")
-                if last_newline > 0:
-                    truncated_content = truncated_content[:last_newline]
+        Returns:
+            tuple: (cleaned items, contents with None where unknown, revision to read each repository at,
+                indexes of the unknown items)
+        """
+        items = [(self._clean_repository_path(repository), self._clean_path(path)) for repository, path in items]
+        contents: List[Optional[str]] = []
+        revs: Dict[str, str] = {}
+        for repository, path in items:
+            content, revs[repository] = self._cached_content(repository, path, depth, ref)
+            contents.append(content)
+        return items, contents, revs, [i for i, content in enumerate(contents) if content is None]
+
+    def _fill_batch(
+        self,
+        contents: List[Optional[str]],
+        items: List[Tuple[str, str]],
+        missing: List[int],
+        aliases: List[Tuple[str, str]],
+        data: Dict[str, Any],
+        depth: int,
+        ref: str,
+    ) -> None:
+        """Render the items of a ``GetPathContents`` response into ``contents``.
+
+        Errors are reported per aliased field, so an item whose field is missing is
+        answered with the not-found message without failing the rest of the batch.
+        """
+        repositories = self._safe_get(data, ["data"], default=None)
+        if not isinstance(repositories, dict):
+            raise ValueError(NOT_FOUND_MESSAGE)
 
-                return (
-                    f"{truncated_content}\n\n"
-                    f"[FILE TRUNCATED: File too large ({len(content):,} chars, {total_lines} lines). "
-                    f"Showing first {len(truncated_content):,} chars]"
-                )
+        for i, (repo_alias, path_alias) in zip(missing, aliases):
+            repository, path = items[i]
+            commit = self._safe_get(repositories, [repo_alias, "commit"], default=None)
+            try:
+                contents[i] = self._render_entry(repository, path, commit, path_alias, depth, ref)
+            except ValueError:
+                contents[i] = NOT_FOUND_MESSAGE
+
+    def _cached_content(
+        self,
+        repository: str,
+        path: str,
+        depth: int,
+        ref: str,
+        start_line: Optional[int] = None,
+        end_line: Optional[int] = None,
+    ) -> Tuple[Optional[str], str]:
+        """Look a path up in the caches under the commit ``ref`` currently resolves to.
 
-            return content
+        Returns:
+            tuple: (cached file content or directory tree, or None, and the revision to query
+                otherwise, pinned to the resolved commit when it is known)
+        """
+        if is_commit_sha(ref):
+            sha = ref
+        else:
+            resolved = self._contents.resolve(repository, ref)
+            if resolved is None:
+                return None, ref
+            sha = resolved.sha
+
+        node = self._trees.get(repository, sha, path, depth)
+        if node is not None:
+            return PathTree(node).render(depth), sha
+        cached = self._contents.get(repository, sha, path, start_line, end_line) if path else None
+        if cached is not None:
+            return truncate_file_content(cached), sha
+        return self._contents.get_tree(repository, sha, path, depth), sha
+
+    def _graphql(self, query: str, variables: Dict[str, Any]) -> Dict[str, Any]:
+        """Run a read-only GraphQL query and return the decoded response.
 
-        except (requests.exceptions.RequestException, json.JSONDecodeError):
+        Raises:
+            ValueError: If the response is not valid JSON or the request was rejected
+            BackendUnavailable: If Sourcegraph cannot be reached or fails to answer
+        """
+        try:
+            response = self.transport.post(
+                self.src_url, json={"query": query, "variables": variables}, headers=self._headers(), idempotent=True
+            )
+            raise_for_status(response)
+            return response.json()
+        except (requests.exceptions.RequestException, json.JSONDecodeError) as exc:
+            raise_if_unavailable(exc)
             raise ValueError("invalid arguments the given path or repository does not exist")
 
-    def _get_sourcegraph_tree(self, repo_name: str, path: str, depth: int) -> str:
-        """Get directory tree from Sourcegraph."""
-        query = """
-        query GetRepositoryTree($name: String!, $path: String = ".") {
-            repository(name: $name) {
-                name
-                commit(rev: "HEAD") {
-                    message
-                    tree(path: $path) {
-                        entries {
-                            name
-                            isDirectory
-                            ... on GitTree {
-                                entries {
-                                    name
-                                    isDirectory
-                                }
-                            }
-                        }
-                    }
-                    languages
-                }
-            }
-        }
-        """
+    async def _agraphql(self, query: str, variables: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            response = await self.transport.apost(
+                self.src_url, json={"query": query, "variables": variables}, headers=self._headers(), idempotent=True
+            )
+            raise_for_status(response)
+            return response.json()
+        except (requests.exceptions.RequestException, json.JSONDecodeError) as exc:
+            raise_if_unavailable(exc)
+            raise ValueError("invalid arguments the given path or repository does not exist")
 
-        variables = {"name": repo_name, "path": path}
+    def _headers(self) -> Dict[str, str]:
         headers = {
             "Content-Type": "application/json",
         }
         if self.token:
             headers["Authorization"] = f"token {self.token}"
-        payload = {"query": query, "variables": variables}
-
-        try:
-            response = requests.post(self.src_url, json=payload, headers=headers)
-            response.raise_for_status()
-
-            data = response.json()
+        return headers
+
+    def _render_path_content(
+        self,
+        repository: str,
+        path: str,
+        data: Dict[str, Any],
+        depth: int,
+        ref: str,
+        start_line: Optional[int] = None,
+        end_line: Optional[int] = None,
+    ) -> str:
+        """Render the file content (or the requested lines of it) or directory tree of a ``GetPathContent`` response.
 
-            if "errors" in data:
-                raise ValueError("invalid arguments the given path or repository does not exist")
+        Raises:
+            ValueError: If the repository or path does not exist
+        """
+        if "errors" in data:
+            raise ValueError("invalid arguments the given path or repository does not exist")
 
-            # Check if repository exists
-            repository = self._safe_get(data, ["data", "repository"], default=None)
-            if repository is None:
-                raise ValueError("invalid arguments the given path or repository does not exist")
+        commit = self._safe_get(data, ["data", "repository", "commit"], default=None)
+        return self._render_entry(repository, path, commit, "path", depth, ref, start_line, end_line)
+
+    def _render_entry(
+        self,
+        repository: str,
+        path: str,
+        commit: Optional[Dict[str, Any]],
+        field: str,
+        depth: int,
+        ref: str,
+        start_line: Optional[int] = None,
+        end_line: Optional[int] = None,
+    ) -> str:
+        """Render the blob (or the requested lines of it) or tree selected as ``field`` on a commit.
+
+        The commit ``ref`` resolved to is remembered, and the whole blob or rendered tree
+        is added to the caches under that commit.
 
-            tree_data = self._safe_get(data, ["data", "repository", "commit", "tree"], default=None)
-            if tree_data is None:
-                raise ValueError("invalid arguments the given path or repository does not exist")
+        Raises:
+            ValueError: If the repository or path does not exist
+        """
+        entry = self._safe_get(commit, [field], default=None)
+        if not isinstance(entry, dict):
+            raise ValueError("invalid arguments the given path or repository does not exist")
 
-            entries = self._safe_get(tree_data, ["entries"], default=[])
+        oid = commit.get("oid")
+        if oid and not is_commit_sha(ref):
+            self._contents.set_ref(repository, ref, oid)
 
-            return self._format_sourcegraph_tree(entries, depth, 0)
+        if entry.get("__typename") == "GitTree":
+            node = TreeNode(is_dir=True)
+            entries = entry.get("entries") or []
+            recursive = depth > MAX_NESTED_TREE_DEPTH
+            if recursive:
+                self._add_tree_paths(node, entries, len(path) + 1 if path else 0)
+            else:
+                self._add_tree_entries(node, entries)
+            tree = PathTree(node).render(depth)
+            if depth > 0 and oid:
+                self._trees.put(repository, oid, path, TreeListing(node, None if recursive else depth))
+                self._contents.put_tree(repository, oid, path, depth, tree)
+            return tree
 
-        except (requests.exceptions.RequestException, json.JSONDecodeError):
+        content = entry.get("content")
+        if content is None:
             raise ValueError("invalid arguments the given path or repository does not exist")
+        if oid:
+            self._contents.put(repository, oid, path, content)
+        return truncate_file_content(select_lines(content, start_line, end_line))
 
-    def _format_sourcegraph_tree(self, entries: list, max_depth: int, current_depth: int) -> str:
-        """Format Sourcegraph tree entries into a string representation."""
-        if current_depth >= max_depth:
-            return ""
-
-        output_lines = []
-        for entry in sorted(entries, key=lambda x: x.get("name", "")):
-            indent = "  " * current_depth
-            name = entry.get("name", "")
+    def _add_tree_entries(self, node: TreeNode, entries: list) -> None:
+        for entry in entries:
             is_dir = entry.get("isDirectory", False)
-
-            if is_dir:
-                name += "/"
-
-            output_lines.append(f"{indent}{name}")
-
-            # If it's a directory and has nested entries, process them recursively
-            if is_dir and "entries" in entry and entry["entries"] and current_depth < max_depth - 1:
-                nested_output = self._format_sourcegraph_tree(entry["entries"], max_depth, current_depth + 1)
-                if nested_output:
-                    output_lines.append(nested_output)
-
-        return "\n".join(output_lines)
+            child = node.add_child(entry.get("name", ""), is_dir)
+            if is_dir and entry.get("entries"):
+                self._add_tree_entries(child, entry["entries"])
+
+    @staticmethod
+    def _add_tree_paths(root: TreeNode, entries: list, strip_prefix: int) -> None:
+        """Add the flat entries of a recursive listing, whose paths start at the repository root."""
+        for entry in entries:
+            parts = entry.get("path", "")[strip_prefix:].split("/")
+            node = root
+            for name in parts[:-1]:
+                node = node.add_child(name, is_dir=True)
+            if parts[-1]:
+                node.add_child(parts[-1], entry.get("isDirectory", False))
+
+    @staticmethod
+    def _clean_path(path: str) -> str:
+        """Normalize a path relative to the repository root ("" for the root)."""
+        path = path.strip("/")
+        return "" if path == "." else path
 
     def _clean_repository_path(self, repository: str) -> str:
         """Clean repository path for Sourcegraph."""
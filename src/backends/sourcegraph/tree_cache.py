@@ -0,0 +1,91 @@
+"""In-memory directory listings used to answer Sourcegraph trees without re-fetching them."""
+
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from backends.tree import TreeNode
+
+
+class TreeListing:
+    """A directory of one commit, loaded ``depth`` levels deep (None when complete)."""
+
+    __slots__ = ("node", "depth", "size")
+
+    def __init__(self, node: TreeNode, depth: Optional[int]):
+        self.node = node
+        self.depth = depth
+        self.size = _count_nodes(node)
+
+    def covers(self, depth: int) -> bool:
+        return self.depth is None or self.depth >= depth
+
+
+class TreeCache:
+    """LRU of directory listings keyed by (repository, commit, path).
+
+    A listing also answers requests for any directory below it, as long as it was
+    loaded deep enough, so a deep listing of ``src`` serves ``src/api`` as well.
+    """
+
+    def __init__(self, max_nodes: int = 500_000):
+        """Initialize the cache.
+
+        Args:
+            max_nodes: Maximum number of tree entries kept across all listings
+        """
+        self.max_nodes = max_nodes
+        self._listings: "OrderedDict[Tuple[str, str, str], TreeListing]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, repo: str, oid: str, path: str, depth: int) -> Optional[TreeNode]:
+        """Return the directory node of ``path`` from the closest listing that covers ``depth`` levels.
+
+        Args:
+            repo: Repository name
+            oid: Commit ID
+            path: Directory path relative to the repository root ("" for the root)
+            depth: Number of levels the caller will render
+
+        Returns:
+            TreeNode or None if no cached listing covers the request
+        """
+        parts = path.split("/") if path else []
+        with self._lock:
+            for i in range(len(parts), -1, -1):
+                key = (repo, oid, "/".join(parts[:i]))
+                listing = self._listings.get(key)
+                if listing is None or not listing.covers(depth + len(parts) - i):
+                    continue
+                self._listings.move_to_end(key)
+                node = listing.node
+                for name in parts[i:]:
+                    node = node.children.get(name) if node.children else None
+                    if node is None or not node.is_dir:
+                        return None
+                return node
+        return None
+
+    def put(self, repo: str, oid: str, path: str, listing: TreeListing) -> None:
+        key = (repo, oid, path)
+        with self._lock:
+            previous = self._listings.pop(key, None)
+            if previous is not None:
+                self._size -= previous.size
+            self._listings[key] = listing
+            self._size += listing.size
+            while self._size > self.max_nodes and len(self._listings) > 1:
+                _, evicted = self._listings.popitem(last=False)
+                self._size -= evicted.size
+
+
+def _count_nodes(node: TreeNode) -> int:
+    count = 0
+    stack = [node]
+    while stack:
+        children = stack.pop().children
+        if children:
+            count += len(children)
+            stack.extend(children.values())
+    return count
@@ -0,0 +1,370 @@
+"""Pooled HTTP transport shared by all search and content backends."""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+RETRY_STATUS_CODES = frozenset({502, 503, 504})
+
+
+def raise_for_status(response: Union[requests.Response, httpx.Response]) -> None:
+    """Raise ``requests.exceptions.HTTPError`` for 4xx/5xx responses of either HTTP stack."""
+    if response.status_code >= 400:
+        raise requests.exceptions.HTTPError(f"{response.status_code} error for url: {response.url}", response=response)
+
+
+# (host, status code or None, seconds, response bytes)
+ResponseObserver = Callable[[str, Optional[int], float, int], None]
+
+
+def host_key(url: str) -> str:
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    return f"{parts.hostname}:{port}"
+
+
+class HTTPTransport:
+    """Keep-alive HTTP transport with timeouts and jittered retries.
+
+    One instance is meant to be shared by every client and fetcher of a server
+    process so that connections to each backend host are pooled and reused.
+    Blocking calls go through a ``requests`` session; the ``a*`` coroutines go
+    through an ``httpx.AsyncClient`` with the same limits and translate httpx
+    errors into ``requests`` exceptions so callers handle both paths alike.
+    """
+
+    def __init__(
+        self,
+        pool_connections: int = 10,
+        pool_maxsize: int = 32,
+        connect_timeout: float = 3.0,
+        read_timeout: float = 30.0,
+        max_retries: int = 2,
+        backoff_factor: float = 0.1,
+        backoff_max: float = 2.0,
+        observer: Optional[ResponseObserver] = None,
+    ):
+        """Initialize the transport.
+
+        Args:
+            pool_connections: Number of distinct hosts to keep connection pools for
+            pool_maxsize: Maximum number of keep-alive connections per host
+            connect_timeout: Seconds to wait for a TCP/TLS connection to be established
+            read_timeout: Seconds to wait between bytes received from the server
+            max_retries: Retries for idempotent requests on connection errors or 502/503/504
+            backoff_factor: Base delay in seconds for exponential backoff between retries
+            backoff_max: Upper bound in seconds for a single backoff delay
+            observer: Called after every attempt with the host, status code (None on a
+                connection error), seconds taken and response bytes, e.g. to export metrics
+        """
+        if pool_maxsize <= 0:
+            raise ValueError("pool_maxsize must be a positive integer")
+
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.timeout: Tuple[float, float] = (connect_timeout, read_timeout)
+        self.max_retries = max(0, max_retries)
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.observer = observer
+
+        self._adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=0,
+        )
+        self._session = requests.Session()
+        self._session.mount("http://", self._adapter)
+        self._session.mount("https://", self._adapter)
+        # requests transparently decodes gzip/deflate bodies when advertised
+        self._session.headers["Accept-Encoding"] = "gzip, deflate"
+
+        self._async_client: Optional[httpx.AsyncClient] = None
+
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, int] = defaultdict(int)
+        self._counters: Dict[str, int] = defaultdict(int)
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        idempotent: Optional[bool] = None,
+        timeout: Optional[Tuple[float, float]] = None,
+        **kwargs: Any,
+    ) -> requests.Response:
+        """Send a request through the shared connection pool.
+
+        Args:
+            method: HTTP method
+            url: Absolute request URL
+            idempotent: Whether the request may be retried. Defaults to True for GET/HEAD/OPTIONS.
+                Read-only POSTs (e.g. GraphQL queries) can opt in explicitly.
+            timeout: Optional (connect, read) timeout overriding the transport default
+            **kwargs: Passed through to ``requests.Session.request``
+
+        Returns:
+            The HTTP response. Status codes are not checked here.
+
+        Raises:
+            requests.exceptions.RequestException: If the request fails after all retries
+        """
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        retries = self.max_retries if idempotent else 0
+        timeout = timeout or self.timeout
+        host = host_key(url)
+
+        attempt = 0
+        while True:
+            self._track(host, 1)
+            start = time.perf_counter()
+            try:
+                response = self._session.request(method, url, timeout=timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as exc:
+                self._count("errors")
+                self._observe(host, None, start, 0)
+                if attempt >= retries:
+                    raise
+                logger.debug(f"{method} {url} failed ({exc}), retrying")
+            else:
+                # Streamed bodies are still unread; only their announced length is known
+                size = (
+                    int(response.headers.get("Content-Length") or 0) if kwargs.get("stream") else len(response.content)
+                )
+                self._observe(host, response.status_code, start, size)
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= retries:
+                    self._count("requests")
+                    return response
+                self._count("retryable_statuses")
+                response.close()
+                logger.debug(f"{method} {url} returned {response.status_code}, retrying")
+            finally:
+                self._track(host, -1)
+
+            self._count("retries")
+            time.sleep(self._backoff_delay(attempt))
+            attempt += 1
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    async def arequest(
+        self,
+        method: str,
+        url: str,
+        idempotent: Optional[bool] = None,
+        timeout: Optional[Tuple[float, float]] = None,
+        **kwargs: Any,
+    ) -> httpx.Response:
+        """Asynchronous counterpart of :meth:`request`.
+
+        Args:
+            method: HTTP method
+            url: Absolute request URL
+            idempotent: Whether the request may be retried (see :meth:`request`)
+            timeout: Optional (connect, read) timeout overriding the transport default
+            **kwargs: Passed through to ``httpx.AsyncClient.request``
+
+        Returns:
+            The HTTP response with its body fully read. Status codes are not checked here.
+
+        Raises:
+            requests.exceptions.RequestException: If the request fails after all retries
+        """
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        retries = self.max_retries if idempotent else 0
+        if timeout is not None:
+            kwargs["timeout"] = self._httpx_timeout(timeout)
+        host = host_key(url)
+        client = self._get_async_client()
+
+        attempt = 0
+        while True:
+            self._track(host, 1)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+            except httpx.TransportError as exc:
+                self._count("errors")
+                self._observe(host, None, start, 0)
+                if attempt >= retries:
+                    raise _translate_httpx_error(exc) from exc
+                logger.debug(f"{method} {url} failed ({exc}), retrying")
+            else:
+                self._observe(host, response.status_code, start, response.num_bytes_downloaded)
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= retries:
+                    self._count("requests")
+                    return response
+                self._count("retryable_statuses")
+                logger.debug(f"{method} {url} returned {response.status_code}, retrying")
+            finally:
+                self._track(host, -1)
+
+            self._count("retries")
+            await asyncio.sleep(self._backoff_delay(attempt))
+            attempt += 1
+
+    async def aget(self, url: str, **kwargs: Any) -> httpx.Response:
+        return await self.arequest("GET", url, **kwargs)
+
+    async def apost(self, url: str, **kwargs: Any) -> httpx.Response:
+        return await self.arequest("POST", url, **kwargs)
+
+    @asynccontextmanager
+    async def astream(
+        self,
+        method: str,
+        url: str,
+        timeout: Optional[Tuple[float, float]] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[httpx.Response]:
+        """Open a streaming response, e.g. for server-sent events.
+
+        Streams are not retried because the body may already be partially consumed.
+
+        Raises:
+            requests.exceptions.RequestException: If the connection cannot be established
+        """
+        if timeout is not None:
+            kwargs["timeout"] = self._httpx_timeout(timeout)
+        host = host_key(url)
+        client = self._get_async_client()
+
+        self._track(host, 1)
+        start = time.perf_counter()
+        status, size = None, 0
+        try:
+            async with client.stream(method.upper(), url, **kwargs) as response:
+                self._count("requests")
+                status = response.status_code
+                try:
+                    yield response
+                finally:
+                    size = response.num_bytes_downloaded
+        except httpx.TransportError as exc:
+            self._count("errors")
+            raise _translate_httpx_error(exc) from exc
+        finally:
+            self._track(host, -1)
+            self._observe(host, status, start, size)
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.pool_connections * self.pool_maxsize,
+                    max_keepalive_connections=self.pool_maxsize,
+                ),
+                timeout=self._httpx_timeout(self.timeout),
+                headers={"Accept-Encoding": "gzip, deflate"},
+            )
+        return self._async_client
+
+    @staticmethod
+    def _httpx_timeout(timeout: Tuple[float, float]) -> httpx.Timeout:
+        connect_timeout, read_timeout = timeout
+        return httpx.Timeout(read_timeout, connect=connect_timeout)
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """Full-jitter exponential backoff so that retrying clients do not synchronize."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_factor * (2**attempt)))
+
+    def _track(self, host: str, delta: int) -> None:
+        with self._lock:
+            self._in_flight[host] += delta
+
+    def _observe(self, host: str, status: Optional[int], start: float, size: int) -> None:
+        if self.observer is not None:
+            self.observer(host, status, time.perf_counter() - start, size)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def in_flight(self) -> Dict[str, int]:
+        """Return the number of requests currently in flight per backend host."""
+        with self._lock:
+            return dict(self._in_flight)
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """Return connection pool statistics, useful for sizing ``pool_maxsize``.
+
+        Returns:
+            Dictionary with global counters and one entry per backend host holding
+            the number of idle keep-alive connections, connections opened so far,
+            requests served and requests currently in flight.
+        """
+        hosts: Dict[str, Dict[str, int]] = {}
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            netloc = f"{pool.host}:{pool.port}"
+            # The pool queue is pre-filled with None placeholders for unopened slots
+            idle = sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool is not None else 0
+            hosts[netloc] = {
+                "idle_connections": idle,
+                "connections_opened": pool.num_connections,
+                "requests": pool.num_requests,
+            }
+
+        with self._lock:
+            for netloc, in_flight in self._in_flight.items():
+                hosts.setdefault(netloc, {"idle_connections": 0, "connections_opened": 0, "requests": 0})
+                hosts[netloc]["in_flight"] = in_flight
+            counters = dict(self._counters)
+
+        if self._async_client is not None:
+            # httpx does not expose per-host pool state publicly; report the total when available
+            pool = getattr(self._async_client._transport, "_pool", None)
+            async_connections = len(getattr(pool, "connections", []))
+        else:
+            async_connections = 0
+
+        return {
+            "pool_maxsize": self.pool_maxsize,
+            "requests": counters.get("requests", 0),
+            "retries": counters.get("retries", 0),
+            "errors": counters.get("errors", 0),
+            "retryable_statuses": counters.get("retryable_statuses", 0),
+            "async_connections": async_connections,
+            "hosts": hosts,
+        }
+
+    def close(self) -> None:
+        self._session.close()
+
+    async def aclose(self) -> None:
+        self.close()
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+
+def _translate_httpx_error(exc: httpx.TransportError) -> requests.exceptions.RequestException:
+    if isinstance(exc, httpx.TimeoutException):
+        return requests.exceptions.Timeout(str(exc))
+    if isinstance(exc, httpx.NetworkError):
+        return requests.exceptions.ConnectionError(str(exc))
+    return requests.exceptions.RequestException(str(exc))
@@ -0,0 +1,192 @@
+"""Prefix-tree engine for rendering directory listings of any backend."""
+
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Sequence
+
+# Output budget for a rendered listing
+MAX_TREE_ENTRIES = 2_000
+MAX_DIR_ENTRIES = 200
+
+
+class TreeNode:
+    """A file (no children) or directory (children keyed by name) in a PathTree."""
+
+    __slots__ = ("children",)
+
+    def __init__(self, is_dir: bool = False):
+        self.children: Optional[Dict[str, "TreeNode"]] = {} if is_dir else None
+
+    @property
+    def is_dir(self) -> bool:
+        return self.children is not None
+
+    def add_child(self, name: str, is_dir: bool) -> "TreeNode":
+        """Return the child with the given name, creating it if needed.
+
+        A child first seen as a file is promoted to a directory when needed.
+        """
+        child = self.children.get(name)
+        if child is None:
+            child = TreeNode(is_dir)
+            self.children[name] = child
+        elif is_dir and child.children is None:
+            child.children = {}
+        return child
+
+
+class PathTree:
+    """Directory tree built in one pass and rendered depth-limited in one traversal."""
+
+    def __init__(self, root: Optional[TreeNode] = None) -> None:
+        self.root = root if root is not None else TreeNode(is_dir=True)
+
+    @classmethod
+    def from_paths(cls, paths: Iterable[str], max_depth: Optional[int] = None, strip_prefix: int = 0) -> "PathTree":
+        """Build a tree from file paths.
+
+        Args:
+            paths: File paths, separated by "/"
+            max_depth: Only keep this many levels; deeper files just mark their ancestor directories
+            strip_prefix: Number of leading characters to drop from every path (e.g. the listed directory)
+
+        Returns:
+            PathTree: The populated tree
+        """
+        tree = cls()
+        root = tree.root
+        maxsplit = max_depth if max_depth is not None else -1
+        prev_head = None
+        node, show_leaf = root, max_depth != 0
+        for path in paths:
+            if strip_prefix:
+                path = path[strip_prefix:]
+            head, _, leaf = path.rpartition("/")
+
+            # Sorted input keeps siblings together, so the parent is usually the previous one
+            if head != prev_head:
+                prev_head = head
+                node, show_leaf = root, max_depth != 0
+                if head:
+                    dirs = head.split("/", maxsplit)
+                    if max_depth is not None and len(dirs) >= max_depth:
+                        # The file lies below the depth limit, only its directories are kept
+                        dirs, show_leaf = dirs[:max_depth], False
+                    for name in dirs:
+                        node = node.add_child(name, is_dir=True)
+
+            if leaf and show_leaf and leaf not in node.children:
+                node.children[leaf] = TreeNode()
+        return tree
+
+    @classmethod
+    def from_sorted_paths(cls, paths: Sequence[str], max_depth: int, strip_prefix: int = 0) -> "PathTree":
+        """Build a depth-limited tree from a sorted sequence of file paths.
+
+        Equivalent to :meth:`from_paths`, but once a directory at the depth limit is
+        seen, all paths below it are skipped with a binary search, so the cost grows
+        with the size of the listing rather than the size of the repository.
+
+        Args:
+            paths: Lexicographically sorted file paths, separated by "/"
+            max_depth: Number of levels to keep
+            strip_prefix: Number of leading characters shared by every path to ignore
+
+        Returns:
+            PathTree: The populated tree
+        """
+        tree = cls()
+        if max_depth <= 0:
+            return tree
+
+        i, end = 0, len(paths)
+        node, prev_head = tree.root, None
+        while i < end:
+            full_path = paths[i]
+            path = full_path[strip_prefix:]
+            head, _, leaf = path.rpartition("/")
+
+            if head != prev_head:
+                parts = path.split("/", max_depth)
+                node, prev_head = tree.root, None
+                if len(parts) > max_depth:
+                    for name in parts[:max_depth]:
+                        node = node.add_child(name, is_dir=True)
+                    # "0" sorts right after "/": jump past every path inside the cut-off directory
+                    cut = len(full_path) - len(parts[max_depth]) - 1
+                    i = bisect_left(paths, f"{full_path[:cut]}0", i + 1, end)
+                    continue
+                for name in parts[:-1]:
+                    node = node.add_child(name, is_dir=True)
+                prev_head = head
+
+            if leaf and leaf not in node.children:
+                node.children[leaf] = TreeNode()
+            i += 1
+        return tree
+
+    def render(
+        self,
+        max_depth: int,
+        max_entries: Optional[int] = MAX_TREE_ENTRIES,
+        max_dir_entries: Optional[int] = MAX_DIR_ENTRIES,
+    ) -> str:
+        """Render the tree as an indented listing.
+
+        Directories get a trailing "/". Directories with more than ``max_dir_entries``
+        children, and everything left once ``max_entries`` is spent, collapse into a
+        "... N more entries" line.
+
+        Args:
+            max_depth: Number of levels to render
+            max_entries: Total number of entries rendered (None for unlimited)
+            max_dir_entries: Maximum entries rendered per directory (None for unlimited)
+
+        Returns:
+            str: Formatted tree structure
+        """
+        lines: List[str] = []
+        budget = [max_entries if max_entries is not None else -1]
+        self._render_node(self.root, 0, max_depth, max_dir_entries, budget, lines)
+        return "\n".join(lines)
+
+    def _render_node(
+        self,
+        node: TreeNode,
+        depth: int,
+        max_depth: int,
+        max_dir_entries: Optional[int],
+        budget: List[int],
+        lines: List[str],
+    ) -> bool:
+        """Append the children of ``node``; returns False once the entry budget is spent."""
+        if depth >= max_depth or not node.children:
+            return True
+
+        indent = "  " * depth
+        names = sorted(node.children)
+        shown = names if max_dir_entries is None else names[:max_dir_entries]
+
+        for i, name in enumerate(shown):
+            if budget[0] == 0:
+                lines.append(_more_entries(indent, len(names) - i))
+                return False
+            budget[0] -= 1
+
+            child = node.children[name]
+            if child.children is not None:
+                lines.append(f"{indent}{name}/")
+                if not self._render_node(child, depth + 1, max_depth, max_dir_entries, budget, lines):
+                    remaining = len(names) - i - 1
+                    if remaining:
+                        lines.append(_more_entries(indent, remaining))
+                    return False
+            else:
+                lines.append(f"{indent}{name}")
+
+        if len(shown) < len(names):
+            lines.append(_more_entries(indent, len(names) - len(shown)))
+        return True
+
+
+def _more_entries(indent: str, count: int) -> str:
+    return f"{indent}... {count} more {'entry' if count == 1 else 'entries'}"
@@ -1,4 +1,6 @@
 from .client import Client
+from .federated import FederatedClient, FederatedContentFetcher
 from .fetcher import ZoektContentFetcher
+from .routing import ShardRouter
 
-__all__ = ["Client", "ZoektContentFetcher"]
+__all__ = ["Client", "FederatedClient", "FederatedContentFetcher", "ShardRouter", "ZoektContentFetcher"]
@@ -0,0 +1,57 @@
+"""Helpers for Zoekt's JSON API (``/api/search`` and ``/api/list``)."""
+
+import base64
+import re
+from typing import Any, Dict, Optional
+
+SEARCH_API_PATH = "/api/search"
+LIST_API_PATH = "/api/list"
+
+_SPECIAL_QUERY_CHARS = re.compile(r"[\s\"]")
+
+
+def exact_regex(value: str) -> str:
+    """Return a Zoekt query value matching ``value`` exactly as an anchored regex."""
+    pattern = f"^{re.escape(value)}$"
+    if _SPECIAL_QUERY_CHARS.search(pattern):
+        pattern = '"' + pattern.replace("\\", "\\\\").replace('"', '\\"') + '"'
+    return pattern
+
+
+def decode_bytes(value: Optional[str]) -> str:
+    """Decode a []byte field, which Go's encoding/json serializes as base64, into text."""
+    if not value:
+        return ""
+    return base64.b64decode(value).decode("utf-8", errors="replace")
+
+
+def encode_bytes(text: str) -> str:
+    """Encode text the way Go's encoding/json serializes a []byte field."""
+    return base64.b64encode(text.encode("utf-8")).decode("ascii")
+
+
+def search_request(query: str, **opts: Any) -> Dict[str, Any]:
+    """Build an ``/api/search`` request body with the given search options."""
+    return {"Q": query, "Opts": opts}
+
+
+_TEMPLATE_ARG_PATTERN = re.compile(r'"((?:[^"\\]|\\.)*)"|(\.\w+)')
+
+
+def file_url(template: Optional[str], version: str, path: str) -> Optional[str]:
+    """Render a repository URL template from ``Result.RepoURLs`` for one file.
+
+    Zoekt stores Go templates, either ``https://host/repo/blob/{{.Version}}/{{.Path}}``
+    or ``{{URLJoinPath "https://host/repo" "blob" .Version .Path}}``.
+    """
+    if not template:
+        return None
+
+    fields = {".Version": version, ".Path": path}
+    if "URLJoinPath" in template:
+        parts = [
+            literal if literal else fields.get(field, "") for literal, field in _TEMPLATE_ARG_PATTERN.findall(template)
+        ]
+        return "/".join(part.strip("/") for part in parts if part)
+
+    return template.replace("{{.Version}}", version).replace("{{.Path}}", path)
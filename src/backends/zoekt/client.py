@@ -1,125 +1,360 @@
-from typing import List
+import hashlib
+import json
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
 import requests
 
-from backends.models import FormattedResult, Match
+from backends.budget import FormattedResults, OutputBudget, context_window, line_span
+from backends.jsonstream import JSONArrayStream
+from backends.models import FormattedResult, LazyMatch, Match, truncate_line
 from backends.search import AbstractSearchClient
+from backends.transport import HTTPTransport, raise_for_status
+from backends.zoekt.api import LIST_API_PATH, SEARCH_API_PATH, decode_bytes, encode_bytes, file_url, search_request
+from backends.zoekt.replicas import ReplicaSet
+
+# Queries made only of repository filters list repositories instead of searching content
+REPO_QUERY_PATTERN = re.compile(r"^\s*(?:-?(?:r|repo):\S+\s*)+$", re.IGNORECASE)
+
+MAX_CONTEXT_LINES = 5
+# How many more matches than displayed Zoekt may collect, so that ranking still has candidates
+SHARD_MATCH_OVERSAMPLING = 10
+TOTAL_MATCH_OVERSAMPLING = 100
+
+
+# Files are kept while their estimated formatted size is below this multiple of the output
+# budget; the estimate ignores context shrinking, so the formatter may still use files beyond it
+STREAM_BUDGET_FACTOR = 2
+STREAM_CHUNK_SIZE = 64 * 1024
+# Key under which the number of files dropped while streaming is stored in ``Result``
+SKIPPED_FILES_KEY = "SkippedFiles"
+# zoekt.RepoListFieldReposMap: list repositories as a map of ID to index time and branches
+REPO_LIST_FIELD_REPOS_MAP = 2
 
 
 class Client(AbstractSearchClient):
     def __init__(
         self,
-        base_url: str,
+        base_url: Union[str, Sequence[str]],
         max_line_length: int = 300,
         max_output_length: int = 100000,
+        transport: Optional[HTTPTransport] = None,
+        search_timeout: float = 10.0,
+        max_output_tokens: Optional[int] = None,
+        replicas: Optional[ReplicaSet] = None,
     ):
-        self.base_url = base_url.rstrip("/")
+        """Initialize the client.
+
+        Args:
+            base_url: Base URL of the Zoekt webserver, or a comma-separated list of replicas
+            replicas: Replica set shared with the fetcher; built from ``base_url`` when omitted
+        """
         self.max_line_length = max_line_length
         self.max_output_length = max_output_length
+        self.max_output_tokens = max_output_tokens
+        self.transport = transport or HTTPTransport()
+        self.replicas = replicas or ReplicaSet(base_url, self.transport)
+        self.search_timeout = search_timeout
 
     def search(self, query: str, num: int) -> dict:
-        params = {
-            "q": query,
-            "num": num,
-            "format": "json",
-            "ctx": 5,
-        }
+        api_path, body = self._search_request(query, num)
+        if api_path == LIST_API_PATH:
+            return self._parse_search_response(self.replicas.post(api_path, json=body, idempotent=True))
+        return self.replicas.call(lambda base_url: self._search_files(f"{base_url}{api_path}", body, num))
+
+    def _search_files(self, url: str, body: Dict[str, Any], num: int) -> dict:
+        response = self.transport.post(url, json=body, idempotent=True, stream=True)
+        try:
+            if response.status_code != 200:
+                self._raise_search_error(response, response.text)
+            stream = self._files_stream(num)
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                stream.feed(chunk)
+            return self._stream_result(stream)
+        finally:
+            response.close()
+
+    async def asearch(self, query: str, num: int) -> dict:
+        api_path, body = self._search_request(query, num)
+        if api_path == LIST_API_PATH:
+            return self._parse_search_response(await self.replicas.apost(api_path, json=body, idempotent=True))
+        # The whole streamed search is one attempt, so a hedged duplicate races it to the parsed result
+        return await self.replicas.acall(lambda base_url: self._asearch_files(f"{base_url}{api_path}", body, num))
+
+    async def _asearch_files(self, url: str, body: Dict[str, Any], num: int) -> dict:
+        async with self.transport.astream("POST", url, json=body) as response:
+            if response.status_code != 200:
+                self._raise_search_error(response, (await response.aread()).decode("utf-8", "replace"))
+            stream = self._files_stream(num)
+            async for chunk in response.aiter_bytes(STREAM_CHUNK_SIZE):
+                stream.feed(chunk)
+            return self._stream_result(stream)
+
+    async def aindex_generation(self) -> Optional[str]:
+        """Digest of the index time and branch versions of every indexed repository.
+
+        Asks /api/list for the minimal repository map, which newer Zoekt builds return
+        as ``ReposMap`` and older ones as ``Minimal``; builds that know neither list
+        full repositories.
+        """
+        body = {"Q": "", "Opts": {"Minimal": True, "Field": REPO_LIST_FIELD_REPOS_MAP}}
+        # Replicas may finish indexing at slightly different times; hedging would mix their generations
+        response = await self.replicas.apost(LIST_API_PATH, json=body, idempotent=True, hedge=False)
+        raise_for_status(response)
+        listing = response.json().get("List") or {}
+        repos = listing.get("ReposMap") or listing.get("Minimal")
+        if repos is None:
+            repos = {
+                (entry.get("Repository") or {}).get("Name"): [
+                    (entry.get("IndexMetadata") or {}).get("IndexTime"),
+                    (entry.get("Repository") or {}).get("Branches"),
+                ]
+                for entry in listing.get("Repos") or []
+            }
+        return hashlib.sha1(json.dumps(repos, sort_keys=True).encode()).hexdigest()
+
+    def _search_request(self, query: str, num: int) -> Tuple[str, Dict[str, Any]]:
+        """Build the JSON API request for a query.
+
+        Display and match limits are derived from ``num`` and the per-match share of
+        ``max_output_length`` so that Zoekt stops collecting, and serializing, matches
+        that would be dropped by ``format_results`` anyway.
+
+        Returns:
+            tuple: (API path, request body)
+        """
+        if REPO_QUERY_PATTERN.match(query):
+            return LIST_API_PATH, {"Q": query}
+
+        num = max(num, 1)
+        per_match_budget = self.max_output_length // num
+        context_lines = (per_match_budget // self.max_line_length - 1) // 2
+        return SEARCH_API_PATH, search_request(
+            query,
+            MaxDocDisplayCount=num,
+            MaxMatchDisplayCount=num,
+            ShardMaxMatchCount=num * SHARD_MATCH_OVERSAMPLING,
+            TotalMaxMatchCount=num * TOTAL_MATCH_OVERSAMPLING,
+            NumContextLines=max(0, min(MAX_CONTEXT_LINES, context_lines)),
+            ChunkMatches=True,
+            MaxWallTime=int(self.search_timeout * 1e9),  # time.Duration in nanoseconds
+        )
+
+    def _files_stream(self, num: int) -> JSONArrayStream:
+        """Decoder that keeps only as many files of the response as ``format_results`` can use."""
+        matches_left = num
+        size_left = self.max_output_length * STREAM_BUDGET_FACTOR
+
+        def keep(file_match: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            nonlocal matches_left, size_left
+            if matches_left <= 0 or size_left <= 0:
+                return None
+            file_match = self._compact_file(file_match, matches_left)
+            matches_left -= self._match_count(file_match)
+            size_left -= self._estimated_size(file_match)
+            return file_match
+
+        return JSONArrayStream(("Result", "Files"), keep=keep)
+
+    def _compact_file(self, file_match: Dict[str, Any], limit: int) -> Dict[str, Any]:
+        """Trim a streamed file to the matches and lines ``format_results`` can show.
+
+        Kept files then take memory in proportion to the output, not to the lines
+        Zoekt returned (e.g. for minified files, where a single line can be huge).
+        """
+        for key in ("ChunkMatches", "LineMatches"):
+            if file_match.get(key):
+                file_match[key] = file_match[key][:limit]
 
-        url = f"{self.base_url}/search"
-        response = requests.get(url, params=params)
+        for chunk in file_match.get("ChunkMatches") or ():
+            if chunk.get("FileName") or not chunk.get("Content"):
+                continue
+            _, start_line, lines = self._chunk_lines(chunk, MAX_CONTEXT_LINES)
+            chunk["Content"] = encode_bytes("\n".join(lines))
+            chunk["ContentStart"] = {"LineNumber": start_line}
+        return file_match
 
+    def _estimated_size(self, file_match: Dict[str, Any]) -> int:
+        """Upper bound of the formatted size of a file, computed without decoding its content."""
+        size = len(file_match.get("FileName", "")) + len(file_match.get("Repository", ""))
+        max_chunk_size = (2 * MAX_CONTEXT_LINES + 1) * (self.max_line_length + 1)
+        for chunk in file_match.get("ChunkMatches") or file_match.get("LineMatches") or ():
+            encoded = len(chunk.get("Content") or chunk.get("Line") or "")
+            encoded += len(chunk.get("Before") or "") + len(chunk.get("After") or "")
+            # base64 encodes 3 bytes in 4 characters
+            size += min(encoded * 3 // 4, max_chunk_size)
+        return size
+
+    @staticmethod
+    def _stream_result(stream: JSONArrayStream) -> dict:
+        try:
+            results = stream.result()
+        except json.JSONDecodeError as e:
+            raise requests.exceptions.HTTPError(f"Invalid search response: {e}")
+        if stream.skipped:
+            results["Result"][SKIPPED_FILES_KEY] = stream.skipped
+        return results
+
+    @staticmethod
+    def _raise_search_error(response, text: str) -> None:
+        raise requests.exceptions.HTTPError(
+            f"Search failed with status code: {response.status_code}. Response: {text}", response=response
+        )
+
+    @classmethod
+    def _parse_search_response(cls, response) -> dict:
         if response.status_code != 200:
-            raise requests.exceptions.HTTPError(
-                f"Search failed with status code: {response.status_code}. Response: {response.text}"
-            )
+            cls._raise_search_error(response, response.text)
         return response.json()
 
     def _truncate_line(self, line: str) -> str:
-        if len(line) > self.max_line_length:
-            return line[: self.max_line_length - 3] + "..."
-        return line
+        return truncate_line(line, self.max_line_length)
 
     def format_results(self, results: dict, num: int) -> List[FormattedResult]:
+        """Format search results, stopping once ``max_output_length`` is spent.
+
+        Context lines around matches shrink as the budget runs out. Files and matches
+        that no longer fit are counted in the returned list's ``omitted_*`` fields.
+        """
+        budget = OutputBudget(self.max_output_length, self.max_output_tokens, context_lines=MAX_CONTEXT_LINES)
         formatted = []
 
         # Handle repository results (when using r: queries)
-        if "repos" in results and "Repos" in results["repos"]:
-            for repo in results["repos"]["Repos"][:num]:
-                repo_name = repo.get("Name", "")
-                repo_url = repo.get("URL", f"https://{repo_name}")
+        repos = (results.get("List") or {}).get("Repos") if results else None
+        if repos is not None:
+            for index, repo in enumerate(repos[:num]):
+                repository = repo.get("Repository") or {}
+                repo_name = repository.get("Name", "")
+                repo_url = repository.get("URL") or f"https://{repo_name}"
+
+                text = budget.take_lines([f"Repository: {repo_name}"]) if budget.charge_result(repo_url) else None
+                if text is None:
+                    budget.omit(files=len(repos[:num]) - index)
+                    break
 
                 formatted.append(
                     FormattedResult(
                         filename="",
                         repository=repo_name,
-                        matches=[
-                            Match(
-                                line_number=0,
-                                text=f"Repository: {repo_name}",
-                            )
-                        ],
+                        matches=[Match(line_number=0, text=text[0])],
                         url=repo_url,
                     )
                 )
-            return formatted
+            return budget.results(formatted)
 
         # Handle file match results
-        if not results or "result" not in results or "FileMatches" not in results["result"]:
-            return formatted
+        result = (results or {}).get("Result") or {}
+        files = result.get("Files") or []
+        budget.omit(files=result.get(SKIPPED_FILES_KEY, 0))
 
-        if results["result"]["FileMatches"] is None:
-            return formatted
+        repo_urls = result.get("RepoURLs") or {}
 
         # Track total matches processed across all files
         total_matches_processed = 0
 
-        for file_match in results["result"]["FileMatches"]:
+        for index, file_match in enumerate(files):
             if total_matches_processed >= num:
                 break
 
-            matches = []
+            filename = file_match.get("FileName", "")
+            repo_name = file_match.get("Repository", "")
+            url = file_url(repo_urls.get(repo_name), file_match.get("Version", ""), filename)
+            if not budget.charge_result(filename, repo_name, url):
+                budget.omit(
+                    files=len(files) - index,
+                    matches=sum(self._match_count(remaining) for remaining in files[index:]),
+                )
+                break
 
-            # Calculate how many matches we can process from this file
             remaining_matches = num - total_matches_processed
-            matches_to_process = min(remaining_matches, len(file_match["Matches"]))
-
-            for match in file_match["Matches"][:matches_to_process]:
-                # Combine fragments to get the full line
-                full_line = ""
-                for fragment in match["Fragments"]:
-                    full_line += fragment["Pre"] + fragment["Match"] + fragment["Post"]
-
-                # Create match with the full context
-                full_text = []
-                if match.get("Before"):
-                    full_text.extend(match["Before"].strip().splitlines())
-                full_text.append(full_line.strip())
-                if match.get("After"):
-                    full_text.extend(match["After"].strip().splitlines())
-
-                # Truncate each line in the text for readability
-                truncated_text = [self._truncate_line(line) for line in full_text]
-
-                matches.append(
-                    Match(
-                        line_number=match["LineNum"],
-                        text="\n".join(truncated_text),
-                    )
-                )
+            if file_match.get("ChunkMatches"):
+                matches = self._chunk_matches(file_match, remaining_matches, budget)
+            else:
+                matches = self._line_matches(file_match, remaining_matches, budget)
 
             if matches:  # Only add file to results if it has matches
                 formatted.append(
                     FormattedResult(
-                        filename=file_match["FileName"],
-                        repository=file_match["Repo"],
+                        filename=filename,
+                        repository=repo_name,
                         matches=matches,
-                        url=(
-                            file_match["Matches"][0]["URL"].split("#L")[0]
-                            if file_match["Matches"] and "URL" in file_match["Matches"][0]
-                            else None
-                        ),
+                        url=url,
                     )
                 )
                 total_matches_processed += len(matches)
+            elif budget.exhausted:
+                budget.omit(files=1)
+
+        return budget.results(formatted)
+
+    @staticmethod
+    def _match_count(file_match: Dict[str, Any]) -> int:
+        return len(file_match.get("ChunkMatches") or file_match.get("LineMatches") or ())
+
+    def _chunk_matches(self, file_match: Dict[str, Any], limit: int, budget: OutputBudget) -> List[Match]:
+        """Convert ``ChunkMatches`` (a match with its context lines) into matches."""
+        matches = []
+        chunks = file_match["ChunkMatches"][:limit]
+        for index, chunk in enumerate(chunks):
+            if chunk.get("FileName"):
+                # The query matched the file name, not its content
+                kept = budget.take_lines([self._truncate_line(file_match.get("FileName", ""))])
+                match = Match(line_number=0, text=kept[0]) if kept is not None else None
+            else:
+                match = self._chunk_match(chunk, budget)
+            if match is None:
+                budget.omit(matches=len(chunks) - index)
+                break
+            matches.append(match)
+        return matches
 
-        return formatted
+    def _chunk_match(self, chunk: Dict[str, Any], budget: OutputBudget) -> Optional[LazyMatch]:
+        """Charge the lines of a chunk that fit and return them as a match whose text is cut from the chunk later."""
+        content_line = (chunk.get("ContentStart") or {}).get("LineNumber", 1)
+        ranges = chunk.get("Ranges") or []
+        first = ranges[0]["Start"]["LineNumber"] if ranges else content_line
+        last = (ranges[-1].get("End") or ranges[-1]["Start"])["LineNumber"] if ranges else first
+        content = decode_bytes(chunk.get("Content")).rstrip("\n")
+        num_lines = content.count("\n") + 1
+        window = context_window(num_lines, first - content_line, last - content_line, budget.context_lines())
+        start, end = line_span(content, window, num_lines)
+        taken = budget.take_span(content, start, end, self.max_line_length)
+        if taken is None:
+            return None
+        end, truncated = taken
+        return LazyMatch(first, content, start, end, self.max_line_length if truncated else None)
+
+    def _chunk_lines(self, chunk: Dict[str, Any], context: int) -> Tuple[int, int, List[str]]:
+        """Return the matched line number, the first shown line number and the truncated lines of a chunk."""
+        content_line = (chunk.get("ContentStart") or {}).get("LineNumber", 1)
+        ranges = chunk.get("Ranges") or []
+        first = ranges[0]["Start"]["LineNumber"] if ranges else content_line
+        last = (ranges[-1].get("End") or ranges[-1]["Start"])["LineNumber"] if ranges else first
+        lines = decode_bytes(chunk.get("Content")).rstrip("\n").split("\n")
+        window = context_window(len(lines), first - content_line, last - content_line, context)
+        return first, content_line + window.start, [self._truncate_line(line) for line in lines[window]]
+
+    def _line_matches(self, file_match: Dict[str, Any], limit: int, budget: OutputBudget) -> List[Match]:
+        """Convert ``LineMatches``, returned by servers without chunk support, into matches."""
+        matches = []
+        line_matches = (file_match.get("LineMatches") or [])[:limit]
+        for index, line_match in enumerate(line_matches):
+            if line_match.get("FileName"):
+                lines = [self._truncate_line(file_match.get("FileName", ""))]
+                line_number = 0
+            else:
+                context = budget.context_lines()
+                before = decode_bytes(line_match.get("Before")).strip().splitlines()
+                after = decode_bytes(line_match.get("After")).strip().splitlines()
+                full_text = before[-context:] if context else []
+                full_text.append(decode_bytes(line_match.get("Line")).strip())
+                full_text.extend(after[:context])
+                lines = [self._truncate_line(line) for line in full_text]
+                line_number = line_match.get("LineNumber", 0)
+
+            kept = budget.take_lines(lines)
+            if kept is None:
+                budget.omit(matches=len(line_matches) - index)
+                break
+            matches.append(Match(line_number=line_number, text="\n".join(kept)))
+        return matches
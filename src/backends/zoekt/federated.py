@@ -0,0 +1,275 @@
+"""Scatter-gather over Zoekt webservers that each index a different slice of the repositories."""
+
+import asyncio
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+import requests
+
+from backends.budget import FormattedResults
+from backends.content_fetcher import NOT_FOUND_MESSAGE, AbstractContentFetcher
+from backends.models import FormattedResult
+from backends.search import AbstractSearchClient
+from backends.zoekt.client import SKIPPED_FILES_KEY, Client
+from backends.zoekt.fetcher import ZoektContentFetcher
+from backends.zoekt.routing import ShardRouter
+
+logger = logging.getLogger(__name__)
+
+# Key under which the number of shards that did not answer in time, or failed, is stored in merged results
+MISSING_SHARDS_KEY = "MissingShards"
+
+
+def parse_shard_urls(urls: Union[str, Sequence[str]]) -> List[Union[str, Sequence[str]]]:
+    """Split a ``;``-separated list of shards, each one URL or a comma-separated list of its replicas."""
+    if not isinstance(urls, str):
+        return [urls]
+    return [shard.strip() for shard in urls.split(";") if shard.strip()]
+
+
+class FederatedClient(AbstractSearchClient):
+    """Searches every shard concurrently and merges their results into one ranked response.
+
+    Files are ranked by the score Zoekt gave them on their shard; a (repository, file)
+    pair found on several shards is kept once, with its best score. At most ``num``
+    files are kept, as a single shard would. Shards that have not answered within
+    ``shard_timeout`` seconds, or that failed, are left out and the results are marked
+    incomplete; the search fails only when no shard answered. Queries whose repository
+    filters the router can place only go to the shards indexing those repositories.
+    """
+
+    def __init__(self, shards: Sequence[Client], shard_timeout: float = 12.0, router: Optional[ShardRouter] = None):
+        """Initialize the client.
+
+        Args:
+            shards: One client per shard, in the order of the router's shard indices; the first one formats the
+                merged results
+            shard_timeout: Seconds to wait for the slowest shard
+            router: Repository map of the shards; without it every query goes to every shard
+        """
+        if not shards:
+            raise ValueError("FederatedClient needs at least one shard")
+        self.shards = list(shards)
+        self.shard_timeout = shard_timeout
+        self.router = router
+        self._executor = ThreadPoolExecutor(max_workers=4 * len(self.shards), thread_name_prefix="zoekt-shard")
+
+    def search(self, query: str, num: int) -> dict:
+        targets = self._targets(query)
+        futures = [self._executor.submit(self.shards[index].search, query, num) for index in targets]
+        wait(futures, timeout=self.shard_timeout)
+        for future in futures:
+            future.cancel()
+        return self._merge(targets, [self._outcome(future) for future in futures], num)
+
+    async def asearch(self, query: str, num: int) -> dict:
+        targets = self._targets(query)
+        tasks = [asyncio.ensure_future(self.shards[index].asearch(query, num)) for index in targets]
+        try:
+            await asyncio.wait(tasks, timeout=self.shard_timeout)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+        return self._merge(targets, [self._outcome(task) for task in tasks], num)
+
+    async def aindex_generation(self) -> Optional[str]:
+        """Digest of the index generations of all shards, or None if no shard reports one."""
+        generations = await asyncio.gather(*(shard.aindex_generation() for shard in self.shards))
+        if all(generation is None for generation in generations):
+            return None
+        return hashlib.sha1("\n".join(generation or "" for generation in generations).encode()).hexdigest()
+
+    def format_results(self, results: dict, num: int) -> List[FormattedResult]:
+        formatted = self.shards[0].format_results(results, num)
+        if isinstance(formatted, FormattedResults) and results and results.get(MISSING_SHARDS_KEY):
+            formatted.incomplete = True
+        return formatted
+
+    def _targets(self, query: str) -> Sequence[int]:
+        """Indices of the shards that may have results for ``query``."""
+        owners = self.router.shards_for_query(query) if self.router is not None else None
+        return owners if owners is not None else range(len(self.shards))
+
+    @staticmethod
+    def _outcome(future: Any) -> Union[dict, BaseException, None]:
+        """Results of a shard's future, its exception, or None if it did not finish in time."""
+        if future.cancelled() or not future.done():
+            return None
+        return future.exception() or future.result()
+
+    def _merge(self, targets: Sequence[int], outcomes: Sequence[Union[dict, BaseException, None]], num: int) -> dict:
+        """Merge the outcomes of the ``targets`` shards into one response.
+
+        An outcome is the shard's results, its exception, or None when it did not answer in time.
+
+        Raises:
+            Exception: The first shard error, when no shard returned results
+            requests.exceptions.Timeout: When no shard answered in time
+        """
+        results = []
+        errors = []
+        for index, outcome in zip(targets, outcomes):
+            if isinstance(outcome, BaseException):
+                logger.warning(f"Zoekt shard {index} failed: {outcome}")
+                errors.append(outcome)
+            elif outcome is None:
+                logger.warning(f"Zoekt shard {index} did not answer within {self.shard_timeout:g}s")
+            else:
+                results.append(outcome)
+        if not results:
+            if errors:
+                raise errors[0]
+            raise requests.exceptions.Timeout(f"No Zoekt shard answered within {self.shard_timeout:g}s")
+
+        missing = len(outcomes) - len(results)
+        if any("List" in result for result in results):
+            merged = self._merge_repos(results)
+        else:
+            merged = self._merge_files(results, num)
+        if missing:
+            merged[MISSING_SHARDS_KEY] = missing
+        return merged
+
+    @staticmethod
+    def _merge_files(results: Sequence[dict], num: int) -> dict:
+        files: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        repo_urls: Dict[str, str] = {}
+        skipped = 0
+        for result in results:
+            result = result.get("Result") or {}
+            repo_urls.update(result.get("RepoURLs") or {})
+            skipped += result.get(SKIPPED_FILES_KEY, 0)
+            for file_match in result.get("Files") or ():
+                key = (file_match.get("Repository", ""), file_match.get("FileName", ""))
+                kept = files.get(key)
+                if kept is None or file_match.get("Score", 0) > kept.get("Score", 0):
+                    files[key] = file_match
+
+        # Stable, so equally scored files keep the order of their shards
+        ranked = sorted(files.values(), key=lambda file_match: file_match.get("Score", 0), reverse=True)
+        merged = {"Files": ranked[:num], "RepoURLs": repo_urls}
+        skipped += len(ranked[num:])
+        if skipped:
+            merged[SKIPPED_FILES_KEY] = skipped
+        return {"Result": merged}
+
+    @staticmethod
+    def _merge_repos(results: Sequence[dict]) -> dict:
+        repos: Dict[str, Dict[str, Any]] = {}
+        for result in results:
+            for repo in (result.get("List") or {}).get("Repos") or ():
+                repos.setdefault((repo.get("Repository") or {}).get("Name", ""), repo)
+        return {"List": {"Repos": list(repos.values())}}
+
+
+class FederatedContentFetcher(AbstractContentFetcher):
+    """Fetches content from the shard indexing the repository.
+
+    Repositories the router knows are fetched from their shards only; others are
+    tried on every shard in order until one has them.
+    """
+
+    def __init__(self, shards: Sequence[ZoektContentFetcher], router: Optional[ShardRouter] = None):
+        """Initialize the fetcher.
+
+        Args:
+            shards: One fetcher per shard, in the order of the router's shard indices
+            router: Repository map of the shards; without it every shard is tried
+        """
+        if not shards:
+            raise ValueError("FederatedContentFetcher needs at least one shard")
+        self.shards = list(shards)
+        self.router = router
+
+    def get_content(self, repository: str, path: str = "", depth: int = 2, ref: str = "HEAD") -> str:
+        error: Optional[ValueError] = None
+        for index in self._candidates(repository):
+            try:
+                return self.shards[index].get_content(repository, path, depth, ref)
+            except ValueError as exc:
+                error = exc
+        raise error
+
+    async def aget_content(self, repository: str, path: str = "", depth: int = 2, ref: str = "HEAD") -> str:
+        error: Optional[ValueError] = None
+        for index in self._candidates(repository):
+            try:
+                return await self.shards[index].aget_content(repository, path, depth, ref)
+            except ValueError as exc:
+                error = exc
+        raise error
+
+    def get_contents(self, items: Sequence[Tuple[str, str]], depth: int = 2, ref: str = "HEAD") -> List[str]:
+        """Fetch each path from its first candidate shard, one batch per shard, then the missing ones from the next."""
+        candidates = [self._candidates(repository) for repository, _ in items]
+        contents = [NOT_FOUND_MESSAGE] * len(items)
+        missing = set(range(len(items)))
+        error: Optional[ValueError] = None
+        for attempt in range(len(self.shards)):
+            for index, batch in self._batches(candidates, missing, attempt).items():
+                try:
+                    fetched = self.shards[index].get_contents([items[i] for i in batch], depth, ref)
+                except ValueError as exc:
+                    # An unreachable shard may still leave the paths to the others
+                    error = exc
+                    continue
+                missing -= self._fill(contents, batch, fetched)
+        if error is not None and len(missing) == len(items):
+            raise error
+        return contents
+
+    async def aget_contents(self, items: Sequence[Tuple[str, str]], depth: int = 2, ref: str = "HEAD") -> List[str]:
+        """Asynchronous counterpart of :meth:`get_contents`; batches of different shards are fetched concurrently."""
+        candidates = [self._candidates(repository) for repository, _ in items]
+        contents = [NOT_FOUND_MESSAGE] * len(items)
+        missing = set(range(len(items)))
+        error: Optional[ValueError] = None
+        for attempt in range(len(self.shards)):
+            batches = self._batches(candidates, missing, attempt)
+            outcomes = await asyncio.gather(
+                *(
+                    self.shards[index].aget_contents([items[i] for i in batch], depth, ref)
+                    for index, batch in batches.items()
+                ),
+                return_exceptions=True,
+            )
+            for batch, fetched in zip(batches.values(), outcomes):
+                if isinstance(fetched, ValueError):
+                    error = fetched
+                elif isinstance(fetched, BaseException):
+                    raise fetched
+                else:
+                    missing -= self._fill(contents, batch, fetched)
+        if error is not None and len(missing) == len(items):
+            raise error
+        return contents
+
+    def _candidates(self, repository: str) -> Sequence[int]:
+        """Indices of the shards to try for ``repository``, in order."""
+        if self.router is not None:
+            owners = self.router.shards_for_repo(repository.replace("https://", "").replace("http://", ""))
+            if owners is not None:
+                return owners
+        return range(len(self.shards))
+
+    @staticmethod
+    def _batches(candidates: Sequence[Sequence[int]], missing: Set[int], attempt: int) -> Dict[int, List[int]]:
+        """Group the missing items by the shard of their ``attempt``-th candidate."""
+        batches: Dict[int, List[int]] = {}
+        for i in sorted(missing):
+            if attempt < len(candidates[i]):
+                batches.setdefault(candidates[i][attempt], []).append(i)
+        return batches
+
+    @staticmethod
+    def _fill(contents: List[str], batch: List[int], fetched: Sequence[str]) -> Set[int]:
+        """Store the found contents of a shard's batch and return their indices."""
+        found = set()
+        for i, content in zip(batch, fetched):
+            if content != NOT_FOUND_MESSAGE:
+                contents[i] = content
+                found.add(i)
+        return found
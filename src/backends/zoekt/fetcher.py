@@ -1,32 +1,79 @@
 import html
 import json
+import logging
 import re
-from typing import Dict, List, Optional, Set
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 
 import requests
 
-from backends.content_fetcher import MAX_FILE_SIZE, AbstractContentFetcher
+from backends.breaker import raise_if_unavailable
+from backends.content_cache import ContentCache, ResolvedRef, is_commit_sha
+from backends.content_fetcher import NOT_FOUND_MESSAGE, AbstractContentFetcher, select_lines, truncate_file_content
+from backends.transport import HTTPTransport, raise_for_status
+from backends.tree import PathTree
+from backends.zoekt.api import LIST_API_PATH, SEARCH_API_PATH, decode_bytes, exact_regex, search_request
+from backends.zoekt.file_index import FileIndexCache, RepoFileIndex
+from backends.zoekt.replicas import ReplicaSet
+
+logger = logging.getLogger(__name__)
+
+# /print renders one <pre class="inline-pre"> per line, led by a non-selectable line number span
+PRINT_LINE_PATTERN = re.compile(
+    r'<pre[^>]*class="inline-pre"[^>]*>(?:<span[^>]*class="noselect"[^>]*>.*?</span>)?(.*?)</pre>', re.DOTALL
+)
+PRINT_MARKUP_PATTERN = re.compile(r'<span[^>]*class="noselect"[^>]*>.*?</span>|<[^>]+>', re.DOTALL)
+# Go's html/template only emits these entities; "&amp;" must be replaced last
+GO_HTML_ENTITIES = (("&lt;", "<"), ("&gt;", ">"), ("&#34;", '"'), ("&#39;", "'"), ("&#43;", "+"), ("&amp;", "&"))
+OTHER_ENTITY_PATTERN = re.compile(r"&(?!(?:lt|gt|amp|#34|#39|#43);)")
+
+
+# Upper bound on the file list of a repository whose document count is unknown
+DEFAULT_FILE_LIST_LIMIT = 1_000_000
+# ``branch:`` matches branch names by substring, so a path may come back once per similarly named branch
+FILE_VERSIONS_PER_BRANCH_QUERY = 4
 
 
 class ZoektContentFetcher(AbstractContentFetcher):
-    def __init__(self, zoekt_url: str):
-        self.zoekt_url = zoekt_url.rstrip("/")
+    def __init__(
+        self,
+        zoekt_url: Union[str, Sequence[str]],
+        transport: Optional[HTTPTransport] = None,
+        file_index_cache: Optional[FileIndexCache] = None,
+        content_cache: Optional[ContentCache] = None,
+        replicas: Optional[ReplicaSet] = None,
+    ):
+        self.transport = transport or HTTPTransport()
+        # Shared with the search client when given, so both balance over the same replica state
+        self.replicas = replicas or ReplicaSet(zoekt_url, self.transport)
+        self._json_api_supported = True
+        self._file_indexes = file_index_cache or FileIndexCache()
+        self._contents = content_cache or ContentCache()
 
     def _clean_repository_path(self, repository: str) -> str:
         repository = repository.replace("https://", "").replace("http://", "")
         return repository
 
-    def get_content(self, repository: str, path: str = "", depth: int = 2, ref: str = "HEAD") -> str:
+    def get_content(
+        self,
+        repository: str,
+        path: str = "",
+        depth: int = 2,
+        ref: str = "HEAD",
+        start_line: Optional[int] = None,
+        end_line: Optional[int] = None,
+    ) -> str:
         """Get content from repository using Zoekt.
 
         Args:
             repository: Repository path (e.g., "github.com/example/project" or "gitlab.com/org/repo")
             path: File or directory path (e.g., "src/main.py" or "src/api/handlers.go")
             depth: Tree depth for directory listings
-            ref: Git reference (not used in Zoekt implementation)
+            ref: Git reference; HEAD, an indexed branch, or the commit SHA an indexed branch is at
+            start_line: First line of a file to return, counted from 1 (the first line if omitted)
+            end_line: Last line of a file to return, inclusive (the last line if omitted)
 
         Returns:
-            File content if path is a file, directory tree if path is a directory
+            File content (or the requested lines of it) if path is a file, directory tree if path is a directory
 
         Raises:
             ValueError: If repository or path does not exist
@@ -38,87 +85,446 @@ class ZoektContentFetcher(AbstractContentFetcher):
         if not path:
             path = "."
 
-        if path != "." and not path.endswith("/"):
-            file_content = self._fetch_file_content(repository, path)
+        resolved = self._resolve_ref(repository, ref)
+        branch = resolved.branch if resolved else None
+
+        if self._may_be_file(repository, path, branch):
+            cached = self._contents.get(repository, resolved.sha, path, start_line, end_line) if resolved else None
+            if cached is not None:
+                return truncate_file_content(cached)
+            file_content = self._fetch_file_content(repository, path, branch)
             if file_content is not None:
-                return file_content
+                if resolved:
+                    self._contents.put(repository, resolved.sha, path, file_content)
+                return truncate_file_content(select_lines(file_content, start_line, end_line))
 
         # If not a file or failed to fetch, show directory tree
-        return self._get_directory_tree(repository, path, depth)
+        return self._get_directory_tree(repository, path, depth, resolved)
+
+    async def aget_content(
+        self,
+        repository: str,
+        path: str = "",
+        depth: int = 2,
+        ref: str = "HEAD",
+        start_line: Optional[int] = None,
+        end_line: Optional[int] = None,
+    ) -> str:
+        """Asynchronous counterpart of :meth:`get_content`."""
+        repository = self._clean_repository_path(repository)
+
+        if not path:
+            path = "."
+
+        resolved = await self._aresolve_ref(repository, ref)
+        branch = resolved.branch if resolved else None
+
+        if self._may_be_file(repository, path, branch):
+            cached = None
+            if resolved:
+                cached = await self._contents.alookup(
+                    self._contents.get, repository, resolved.sha, path, start_line, end_line
+                )
+            if cached is not None:
+                return truncate_file_content(cached)
+            file_content = await self._afetch_file_content(repository, path, branch)
+            if file_content is not None:
+                if resolved:
+                    self._contents.put(repository, resolved.sha, path, file_content)
+                return truncate_file_content(select_lines(file_content, start_line, end_line))
+
+        return await self._aget_directory_tree(repository, path, depth, resolved)
+
+    def get_contents(self, items: Sequence[Tuple[str, str]], depth: int = 2, ref: str = "HEAD") -> List[str]:
+        """Get the content of several paths, fetching all uncached files with one union query.
+
+        Paths the union query does not return are listed as directories.
+        """
+        items = [(self._clean_repository_path(repository), path or ".") for repository, path in items]
+        refs: Dict[str, Optional[ResolvedRef]] = {}
+        for repository in dict.fromkeys(repository for repository, _ in items):
+            try:
+                refs[repository] = self._resolve_ref(repository, ref)
+            except ValueError:
+                pass
+        contents, candidates = self._batch_lookup(items, refs)
+
+        files = None
+        if candidates and self._json_api_supported:
+            try:
+                response = self.replicas.post(
+                    SEARCH_API_PATH, json=self._files_request(candidates, refs), idempotent=True
+                )
+            except requests.exceptions.RequestException as exc:
+                raise_if_unavailable(exc)
+                raise ValueError(NOT_FOUND_MESSAGE)
+            files = self._store_batch_files(response, refs)
+
+        for i, (repository, path) in enumerate(items):
+            if contents[i] is not None:
+                continue
+            if files is not None and (repository, path) in files:
+                contents[i] = truncate_file_content(files[(repository, path)])
+                continue
+            try:
+                if files is None:
+                    # Without a union query result every path is looked up on its own
+                    contents[i] = self.get_content(repository, path, depth, ref)
+                else:
+                    contents[i] = self._get_directory_tree(repository, path, depth, refs[repository])
+            except ValueError:
+                contents[i] = NOT_FOUND_MESSAGE
+        return contents
+
+    async def aget_contents(self, items: Sequence[Tuple[str, str]], depth: int = 2, ref: str = "HEAD") -> List[str]:
+        """Asynchronous counterpart of :meth:`get_contents`."""
+        items = [(self._clean_repository_path(repository), path or ".") for repository, path in items]
+        refs: Dict[str, Optional[ResolvedRef]] = {}
+        for repository in dict.fromkeys(repository for repository, _ in items):
+            try:
+                refs[repository] = await self._aresolve_ref(repository, ref)
+            except ValueError:
+                pass
+        contents, candidates = await self._contents.alookup(self._batch_lookup, items, refs)
+
+        files = None
+        if candidates and self._json_api_supported:
+            try:
+                response = await self.replicas.apost(
+                    SEARCH_API_PATH, json=self._files_request(candidates, refs), idempotent=True
+                )
+            except requests.exceptions.RequestException as exc:
+                raise_if_unavailable(exc)
+                raise ValueError(NOT_FOUND_MESSAGE)
+            files = self._store_batch_files(response, refs)
+
+        for i, (repository, path) in enumerate(items):
+            if contents[i] is not None:
+                continue
+            if files is not None and (repository, path) in files:
+                contents[i] = truncate_file_content(files[(repository, path)])
+                continue
+            try:
+                if files is None:
+                    contents[i] = await self.aget_content(repository, path, depth, ref)
+                else:
+                    contents[i] = await self._aget_directory_tree(repository, path, depth, refs[repository])
+            except ValueError:
+                contents[i] = NOT_FOUND_MESSAGE
+        return contents
+
+    def _batch_lookup(
+        self, items: List[Tuple[str, str]], refs: Dict[str, Optional[ResolvedRef]]
+    ) -> Tuple[List[Optional[str]], List[Tuple[str, str]]]:
+        """Answer what the content cache can and pick the distinct uncached items that may be files.
+
+        Items of repositories missing from ``refs`` (not indexed) are answered as not found.
+
+        Returns:
+            tuple: (contents with None where unknown, file candidates)
+        """
+        contents: List[Optional[str]] = []
+        candidates: List[Tuple[str, str]] = []
+        for repository, path in items:
+            if repository not in refs:
+                contents.append(NOT_FOUND_MESSAGE)
+                continue
+            resolved = refs[repository]
+            branch = resolved.branch if resolved else None
+            cached = None
+            if self._may_be_file(repository, path, branch):
+                cached = self._contents.get(repository, resolved.sha, path) if resolved else None
+                if cached is None and (repository, path) not in candidates:
+                    candidates.append((repository, path))
+            contents.append(truncate_file_content(cached) if cached is not None else None)
+        return contents, candidates
+
+    def _store_batch_files(
+        self, response, refs: Dict[str, Optional[ResolvedRef]]
+    ) -> Optional[Dict[Tuple[str, str], str]]:
+        """Decode a union query response and add the files to the content cache.
+
+        Returns:
+            dict: File contents keyed by (repository, path), or None if the JSON API is unusable
+        """
+        branches = {repository: resolved.branch for repository, resolved in refs.items() if resolved}
+        supported, files = self._decode_files_response(response, branches=branches)
+        if not supported:
+            return None
+        for (repository, path), content in files.items():
+            resolved = refs.get(repository)
+            if resolved:
+                self._contents.put(repository, resolved.sha, path, content)
+        return files
+
+    def _may_be_file(self, repo: str, path: str, branch: Optional[str]) -> bool:
+        return path != "." and not path.endswith("/") and not self._is_known_dir(repo, path, branch)
+
+    def _is_known_dir(self, repo: str, path: str, branch: Optional[str] = None) -> bool:
+        """Check a cached file list, if any, to skip the file lookup for directories."""
+        index = self._file_indexes.get(repo, branch)
+        return index is not None and index.is_dir(path)
+
+    def _resolve_ref(self, repo: str, ref: str) -> Optional[ResolvedRef]:
+        """Resolve ``ref`` to the indexed commit (and branch) it points to.
+
+        Resolutions are cached for a short TTL; otherwise the branches of the
+        repository are read from /api/list.
+
+        Returns:
+            ResolvedRef or None if this Zoekt build has no JSON API
+
+        Raises:
+            ValueError: If the repository is not indexed or ``ref`` matches none of its indexed branches
+        """
+        resolved = self._contents.resolve(repo, ref)
+        if resolved is not None or not self._json_api_supported:
+            return resolved
+        listing = self._post_api(LIST_API_PATH, self._repo_list_request(repo))
+        if listing is None:
+            return None
+        return self._indexed_ref(repo, ref, self._store_refs(listing, repo))
+
+    async def _aresolve_ref(self, repo: str, ref: str) -> Optional[ResolvedRef]:
+        resolved = self._contents.resolve(repo, ref)
+        if resolved is not None or not self._json_api_supported:
+            return resolved
+        listing = await self._apost_api(LIST_API_PATH, self._repo_list_request(repo))
+        if listing is None:
+            return None
+        return self._indexed_ref(repo, ref, self._store_refs(listing, repo))
+
+    def _store_refs(self, listing: Dict, repo: str) -> Dict[str, str]:
+        """Cache the commits of the indexed branches of a repository from an /api/list response.
+
+        HEAD maps to the first (default) branch. Repositories indexed without branch
+        metadata fall back to their index generation as the version of HEAD.
+
+        Returns:
+            dict: Commit of each indexed branch
+
+        Raises:
+            ValueError: If the repository is not indexed
+        """
+        for entry in (listing.get("List") or {}).get("Repos") or []:
+            repository = entry.get("Repository") or {}
+            if repository.get("Name") != repo:
+                continue
+            branches = {b["Name"]: b["Version"] for b in repository.get("Branches") or [] if b.get("Name")}
+            for name, version in branches.items():
+                self._contents.set_ref(repo, name, version, branch=name)
+            if branches:
+                default = next(iter(branches))
+                self._contents.set_ref(repo, "HEAD", branches[default], branch=default)
+            else:
+                generation = str((entry.get("IndexMetadata") or {}).get("IndexTime", ""))
+                self._contents.set_ref(repo, "HEAD", f"generation:{generation}")
+            return branches
+        raise ValueError("invalid arguments the given path or repository does not exist")
+
+    def _indexed_ref(self, repo: str, ref: str, branches: Dict[str, str]) -> ResolvedRef:
+        """Match ``ref`` against the freshly listed branches of a repository.
 
-    def _fetch_file_content(self, repo: str, file_path: str) -> Optional[str]:
+        Raises:
+            ValueError: If no indexed branch has that name or is at that commit
+        """
+        resolved = self._contents.resolve(repo, ref)
+        if resolved is not None:
+            return resolved
+        if is_commit_sha(ref):
+            for name, version in branches.items():
+                if version == ref:
+                    return self._contents.set_ref(repo, ref, ref, branch=name)
+        raise ValueError(f"invalid arguments the ref {ref} is not indexed for this repository")
+
+    def _fetch_file_content(self, repo: str, file_path: str, branch: Optional[str] = None) -> Optional[str]:
         """Fetch individual file content from Zoekt.
 
+        Uses the JSON search API with whole-file content and falls back to
+        scraping the /print page on Zoekt builds that lack it.
+
         Args:
             repo: Repository name
             file_path: Path to the file
+            branch: Indexed branch to read the file from (any branch if omitted)
 
         Returns:
-            str: File content or None if error/not found
+            str: Whole file content, not truncated, or None if error/not found
         """
-        params = {"r": repo, "f": file_path}
-        url = f"{self.zoekt_url}/print"
+        if self._json_api_supported:
+            try:
+                response = self.replicas.post(
+                    SEARCH_API_PATH,
+                    json=self._files_request([(repo, file_path)], {repo: ResolvedRef("", branch)}),
+                    idempotent=True,
+                )
+            except requests.exceptions.RequestException as exc:
+                raise_if_unavailable(exc)
+                return None
+            supported, content = self._decode_file_response(response, repo, file_path, branch)
+            if supported:
+                return content
 
         try:
-            response = requests.get(url, params=params)
-            response.raise_for_status()
+            response = self.replicas.get("/print", params={"r": repo, "f": file_path})
+            raise_for_status(response)
+        except requests.exceptions.RequestException as exc:
+            raise_if_unavailable(exc)
+            return None
+        return self._parse_print_page(response.text)
+
+    async def _afetch_file_content(self, repo: str, file_path: str, branch: Optional[str] = None) -> Optional[str]:
+        if self._json_api_supported:
+            try:
+                response = await self.replicas.apost(
+                    SEARCH_API_PATH,
+                    json=self._files_request([(repo, file_path)], {repo: ResolvedRef("", branch)}),
+                    idempotent=True,
+                )
+            except requests.exceptions.RequestException as exc:
+                raise_if_unavailable(exc)
+                return None
+            supported, content = self._decode_file_response(response, repo, file_path, branch)
+            if supported:
+                return content
 
-            html_content = response.text
+        try:
+            response = await self.replicas.aget("/print", params={"r": repo, "f": file_path})
+            raise_for_status(response)
+        except requests.exceptions.RequestException as exc:
+            raise_if_unavailable(exc)
+            return None
+        return self._parse_print_page(response.text)
 
-            lines = []
-            pre_pattern = r'<pre[^>]*class="inline-pre"[^>]*>(.*?)</pre>'
+    @staticmethod
+    def _files_request(files: Sequence[Tuple[str, str]], refs: Dict[str, Optional[ResolvedRef]]) -> Dict:
+        """Build one whole-file query for the union of several (repository, path) pairs.
 
-            for match in re.finditer(pre_pattern, html_content, re.DOTALL):
-                line_content = match.group(1)
-                line_content = re.sub(r'<span[^>]*class="noselect"[^>]*>.*?</span>', "", line_content)
-                line_content = re.sub(r"<[^>]+>", "", line_content)
-                line_content = html.unescape(line_content)
-                lines.append(line_content)
+        Files of repositories read at a named branch are restricted to it; since
+        ``branch:`` matches substrings, the exact branch is checked when decoding.
+        """
+        clauses = []
+        for repo, file_path in files:
+            clause = f"r:{exact_regex(repo)} f:{exact_regex(file_path)}"
+            branch = refs[repo].branch if refs.get(repo) else None
+            if branch:
+                clause += f" branch:{branch}"
+            clauses.append(clause)
+        query = clauses[0] if len(clauses) == 1 else " or ".join(f"({clause})" for clause in clauses)
+        # A file shared by several indexed branches is one document, but differing versions are not
+        limit = len(files) * (FILE_VERSIONS_PER_BRANCH_QUERY if any(" branch:" in c for c in clauses) else 1)
+        return search_request(query, Whole=True, MaxDocDisplayCount=limit, NumContextLines=0)
+
+    def _decode_file_response(
+        self, response, repo: str, file_path: str, branch: Optional[str] = None
+    ) -> Tuple[bool, Optional[str]]:
+        """Decode whole-file content from a JSON search API response.
 
-            if lines:
-                content = "\n".join(lines)
+        Returns:
+            tuple: (whether the JSON API is usable, file content or None if not found)
+        """
+        supported, files = self._decode_files_response(response, default_repo=repo, branches={repo: branch})
+        return supported, files.get((repo, file_path)) if files else None
 
-                if len(content) > MAX_FILE_SIZE:
-                    truncated_content = content[:MAX_FILE_SIZE]
-                    last_newline = truncated_content.rfind("\n")
-                    if last_newline > 0:
-                        truncated_content = truncated_content[:last_newline]
+    def _decode_files_response(
+        self, response, default_repo: Optional[str] = None, branches: Optional[Dict[str, Optional[str]]] = None
+    ) -> Tuple[bool, Optional[Dict[Tuple[str, str], str]]]:
+        """Decode the whole-file contents of a JSON search API response.
 
-                    line_count = content.count("\n") + 1
-                    return (
-                        f"{truncated_content}\n\n"
-                        f"[FILE TRUNCATED: File too large ({len(content):,} chars, {line_count} lines). "
-                        f"Showing first {len(truncated_content):,} chars]"
-                    )
+        Args:
+            response: Response of a whole-file search
+            default_repo: Repository of files whose match lacks one
+            branches: Branch the files of each repository must belong to, if any
 
-                return content
-            return None
-        except requests.exceptions.RequestException:
-            return None
+        Returns:
+            tuple: (whether the JSON API is usable, file contents keyed by (repository, path))
+        """
+        if response.status_code in (404, 405):
+            logger.info("Zoekt JSON search API is unavailable, falling back to /print scraping")
+            self._json_api_supported = False
+            return False, None
 
-    def _fetch_zoekt_data(self, repo: str, path: str) -> Optional[Dict]:
-        """Fetch data from Zoekt API.
+        try:
+            raise_for_status(response)
+            files = (response.json().get("Result") or {}).get("Files") or []
+        except (requests.exceptions.RequestException, ValueError) as exc:
+            raise_if_unavailable(exc)
+            return True, {}
+
+        contents = {}
+        for file_match in files:
+            if "Content" not in file_match:
+                logger.info("Zoekt did not return whole-file content, falling back to /print scraping")
+                self._json_api_supported = False
+                return False, None
+            repo = file_match.get("Repository", default_repo)
+            branch = (branches or {}).get(repo)
+            if branch and branch not in (file_match.get("Branches") or ()):
+                continue
+            contents[(repo, file_match.get("FileName"))] = decode_bytes(file_match["Content"])
+        return True, contents
+
+    def _parse_print_page(self, html_content: str) -> Optional[str]:
+        """Extract file content from the HTML rendered by Zoekt's /print page.
 
         Args:
-            repo: Repository name
-            path: Directory path
+            html_content: Raw HTML page
 
         Returns:
-            dict: JSON response data or None if error
+            str: File content or None if the page holds no lines
         """
+        lines = PRINT_LINE_PATTERN.findall(html_content)
+        if not lines:
+            return None
+
+        # Entities and tags never span lines, so strip and unescape the joined text once
+        content = "\n".join(lines)
+        if "<" in content:
+            content = PRINT_MARKUP_PATTERN.sub("", content)
+        if "&" in content:
+            if OTHER_ENTITY_PATTERN.search(content):
+                content = html.unescape(content)
+            else:
+                for entity, char in GO_HTML_ENTITIES:
+                    content = content.replace(entity, char)
+        return content
+
+    @staticmethod
+    def _tree_search_params(repo: str, path: str) -> Dict[str, str]:
         # Handle root directory case
         if path == ".":
             query = f"r:{repo} f:\\.*"
         else:
             query = f"r:{repo} file:^{path}/"
+        return {"q": query, "format": "json", "num": "1000"}
+
+    def _fetch_zoekt_data(self, repo: str, path: str) -> Optional[Dict]:
+        """Fetch data from Zoekt API.
+
+        Args:
+            repo: Repository name
+            path: Directory path
 
-        params = {"q": query, "format": "json", "num": "1000"}
+        Returns:
+            dict: JSON response data or None if error
+        """
+        try:
+            response = self.replicas.get("/search", params=self._tree_search_params(repo, path))
+            raise_for_status(response)
+            return response.json()
+        except requests.exceptions.RequestException as exc:
+            raise_if_unavailable(exc)
+            return None
+        except json.JSONDecodeError:
+            return None
 
+    async def _afetch_zoekt_data(self, repo: str, path: str) -> Optional[Dict]:
         try:
-            response = requests.get(f"{self.zoekt_url}/search", params=params)
-            response.raise_for_status()
+            response = await self.replicas.aget("/search", params=self._tree_search_params(repo, path))
+            raise_for_status(response)
             return response.json()
-        except requests.exceptions.RequestException:
+        except requests.exceptions.RequestException as exc:
+            raise_if_unavailable(exc)
             return None
         except json.JSONDecodeError:
             return None
@@ -149,106 +555,199 @@ class ZoektContentFetcher(AbstractContentFetcher):
 
         return sorted(all_files)
 
-    def _build_directory_structure(self, all_files: List[str], path: str, max_depth: int) -> Dict[int, Set[str]]:
-        """Build directory structure from file list.
+    def _get_directory_tree(self, repo: str, path: str, depth: int, resolved: Optional[ResolvedRef] = None) -> str:
+        """Get formatted directory tree listing using Zoekt.
 
         Args:
-            all_files: List of file paths
-            path: Base path
-            max_depth: Maximum depth to include
+            repo: Repository name
+            path: Directory path
+            depth: Maximum depth
+            resolved: Indexed commit and branch to list (every indexed file if omitted)
 
         Returns:
-            dict: Directory structure organized by depth
+            str: Formatted directory tree
+
+        Raises:
+            ValueError: If the given path or repository does not exist
         """
+        path = path.rstrip("/")
+        if resolved:
+            tree = self._contents.get_tree(repo, resolved.sha, path, depth)
+            if tree is not None:
+                return tree
+        if self._json_api_supported:
+            index = self._get_file_index(repo, resolved.branch if resolved else None)
+            if index is not None:
+                return self._store_tree(repo, path, depth, resolved, self._render_index_tree(index, path, depth))
+        return self._render_directory_tree(self._fetch_zoekt_data(repo, path), path, depth)
+
+    async def _aget_directory_tree(
+        self, repo: str, path: str, depth: int, resolved: Optional[ResolvedRef] = None
+    ) -> str:
+        path = path.rstrip("/")
+        if resolved:
+            tree = await self._contents.alookup(self._contents.get_tree, repo, resolved.sha, path, depth)
+            if tree is not None:
+                return tree
+        if self._json_api_supported:
+            index = await self._aget_file_index(repo, resolved.branch if resolved else None)
+            if index is not None:
+                return self._store_tree(repo, path, depth, resolved, self._render_index_tree(index, path, depth))
+        return self._render_directory_tree(await self._afetch_zoekt_data(repo, path), path, depth)
+
+    def _store_tree(self, repo: str, path: str, depth: int, resolved: Optional[ResolvedRef], tree: str) -> str:
+        if resolved:
+            self._contents.put_tree(repo, resolved.sha, path, depth, tree)
+        return tree
+
+    def _render_index_tree(self, index: RepoFileIndex, path: str, depth: int) -> str:
+        all_files = index.files_under(path)
+        if not all_files and path != ".":
+            raise ValueError("invalid arguments the given path or repository does not exist")
+
+        return self._format_tree(all_files, path, depth)
+
+    @staticmethod
+    def _format_tree(all_files: Sequence[str], path: str, depth: int) -> str:
+        """Format the sorted file paths below ``path`` as a directory tree of the given depth."""
         base_len = len(f"{path}/") if path != "." else 0
-        dirs_at_depth = {}
+        return PathTree.from_sorted_paths(all_files, max_depth=depth, strip_prefix=base_len).render(depth)
+
+    def _get_file_index(self, repo: str, branch: Optional[str] = None) -> Optional[RepoFileIndex]:
+        """Return the file list of a repository for its current index generation.
 
-        for f in all_files:
-            rel_path = f[base_len:] if base_len > 0 else f
-            parts = rel_path.split("/")
+        The generation is re-checked through /api/list once the cached entry is older
+        than the cache TTL; the file list is only downloaded again when it changed.
 
-            # Process each directory level
-            for depth in range(min(len(parts) - 1, max_depth)):
-                dir_path = "/".join(parts[: depth + 1])
+        Args:
+            repo: Repository name
+            branch: Indexed branch to list (every indexed file if omitted)
 
-                if depth not in dirs_at_depth:
-                    dirs_at_depth[depth] = set()
+        Returns:
+            RepoFileIndex or None if this Zoekt build has no JSON API
 
-                dirs_at_depth[depth].add(dir_path)
+        Raises:
+            ValueError: If the repository is not indexed
+            BackendUnavailable: If Zoekt cannot be reached or fails to answer
+        """
+        entry = self._file_indexes.get(repo, branch)
+        if entry is not None and self._file_indexes.is_fresh(entry):
+            return entry
 
-            # Add files only if they're within max_depth
-            if len(parts) - 1 < max_depth:
-                file_depth = len(parts) - 1
-                if file_depth not in dirs_at_depth:
-                    dirs_at_depth[file_depth] = set()
-                dirs_at_depth[file_depth].add(rel_path)
+        listing = self._post_api(LIST_API_PATH, self._repo_list_request(repo))
+        if listing is None:
+            return None
+        generation, documents = self._repo_generation(listing, repo)
+        self._store_refs(listing, repo)
+        if entry is not None and entry.generation == generation:
+            self._file_indexes.mark_checked(entry)
+            return entry
+
+        result = self._post_api(SEARCH_API_PATH, self._file_list_request(repo, documents, branch))
+        if result is None:
+            return None
+        return self._store_file_index(repo, generation, result, branch)
 
-        return dirs_at_depth
+    async def _aget_file_index(self, repo: str, branch: Optional[str] = None) -> Optional[RepoFileIndex]:
+        entry = self._file_indexes.get(repo, branch)
+        if entry is not None and self._file_indexes.is_fresh(entry):
+            return entry
 
-    def _format_tree_structure(self, dirs_at_depth: Dict[int, Set[str]], max_depth: int) -> str:
-        """Format the directory tree structure.
+        listing = await self._apost_api(LIST_API_PATH, self._repo_list_request(repo))
+        if listing is None:
+            return None
+        generation, documents = self._repo_generation(listing, repo)
+        self._store_refs(listing, repo)
+        if entry is not None and entry.generation == generation:
+            self._file_indexes.mark_checked(entry)
+            return entry
+
+        result = await self._apost_api(SEARCH_API_PATH, self._file_list_request(repo, documents, branch))
+        if result is None:
+            return None
+        return self._store_file_index(repo, generation, result, branch)
 
-        Args:
-            dirs_at_depth: Directory structure by depth
-            max_depth: Maximum depth
+    def _post_api(self, api_path: str, body: Dict) -> Optional[Dict]:
+        """POST to a Zoekt JSON API endpoint.
 
         Returns:
-            str: Formatted tree structure
+            dict: Decoded response or None if this Zoekt build has no JSON API
+
+        Raises:
+            ValueError: If the request was rejected
+            BackendUnavailable: If Zoekt cannot be reached or fails to answer
         """
-        output_lines = []
-        printed_paths = set()
-
-        def format_item(item_path: str, depth: int, is_file: bool) -> str:
-            indent = "  " * depth
-            name = item_path.split("/")[-1]
-            if not is_file and depth < max_depth:
-                name += "/"
-            return f"{indent}{name}"
-
-        all_paths = []
-        for depth in range(max_depth + 1):
-            if depth in dirs_at_depth:
-                for item in sorted(dirs_at_depth[depth]):
-                    parts = item.split("/")
-                    is_file = len(parts) - 1 < max_depth and "." in parts[-1]
-                    all_paths.append((item, len(parts) - 1, is_file))
-
-        all_paths.sort(key=lambda x: x[0])
-        for item_path, depth, is_file in all_paths:
-            if item_path not in printed_paths:
-                printed_paths.add(item_path)
-                parts = item_path.split("/")
-                if depth > 0:
-                    parent_path = "/".join(parts[:-1])
-                    if parent_path not in printed_paths and parent_path:
-                        parent_parts = parent_path.split("/")
-                        for i in range(1, len(parent_parts) + 1):
-                            sub_parent = "/".join(parent_parts[:i])
-                            if sub_parent not in printed_paths:
-                                printed_paths.add(sub_parent)
-                                output_lines.append(format_item(sub_parent, i - 1, False))
-
-                output_lines.append(format_item(item_path, depth, is_file))
-
-        return "\n".join(output_lines)
-
-    def _get_directory_tree(self, repo: str, path: str, depth: int) -> str:
-        """Get formatted directory tree listing using Zoekt.
+        try:
+            response = self.replicas.post(api_path, json=body, idempotent=True)
+        except requests.exceptions.RequestException as exc:
+            raise_if_unavailable(exc)
+            raise ValueError("invalid arguments the given path or repository does not exist")
+        return self._decode_api_response(response)
 
-        Args:
-            repo: Repository name
-            path: Directory path
-            depth: Maximum depth
+    async def _apost_api(self, api_path: str, body: Dict) -> Optional[Dict]:
+        try:
+            response = await self.replicas.apost(api_path, json=body, idempotent=True)
+        except requests.exceptions.RequestException as exc:
+            raise_if_unavailable(exc)
+            raise ValueError("invalid arguments the given path or repository does not exist")
+        return self._decode_api_response(response)
 
-        Returns:
-            str: Formatted directory tree
+    def _decode_api_response(self, response) -> Optional[Dict]:
+        if response.status_code in (404, 405):
+            logger.info("Zoekt JSON API is unavailable, falling back to the HTML endpoints")
+            self._json_api_supported = False
+            return None
+        try:
+            raise_for_status(response)
+            return response.json()
+        except (requests.exceptions.RequestException, ValueError) as exc:
+            raise_if_unavailable(exc)
+            raise ValueError("invalid arguments the given path or repository does not exist")
+
+    @staticmethod
+    def _repo_list_request(repo: str) -> Dict:
+        return {"Q": f"r:{exact_regex(repo)}"}
+
+    @staticmethod
+    def _repo_generation(listing: Dict, repo: str) -> Tuple[str, int]:
+        """Find the index generation and document count of a repository in an /api/list response.
 
         Raises:
-            ValueError: If the given path or repository does not exist
+            ValueError: If the repository is not indexed
         """
-        path = path.rstrip("/")
-
-        data = self._fetch_zoekt_data(repo, path)
+        for entry in (listing.get("List") or {}).get("Repos") or []:
+            if (entry.get("Repository") or {}).get("Name") == repo:
+                generation = str((entry.get("IndexMetadata") or {}).get("IndexTime", ""))
+                documents = (entry.get("Stats") or {}).get("Documents") or 0
+                return generation, documents
+        raise ValueError("invalid arguments the given path or repository does not exist")
+
+    @staticmethod
+    def _file_list_request(repo: str, documents: int, branch: Optional[str] = None) -> Dict:
+        # Every document matches "f:." exactly once, on its file name
+        limit = documents or DEFAULT_FILE_LIST_LIMIT
+        query = f"r:{exact_regex(repo)} f:."
+        if branch:
+            query += f" branch:{branch}"
+        return search_request(
+            query,
+            MaxDocDisplayCount=limit,
+            ShardMaxMatchCount=limit,
+            TotalMaxMatchCount=limit,
+            NumContextLines=0,
+        )
+
+    def _store_file_index(
+        self, repo: str, generation: str, result: Dict, branch: Optional[str] = None
+    ) -> RepoFileIndex:
+        files = (result.get("Result") or {}).get("Files") or []
+        if branch:
+            files = [f for f in files if branch in (f.get("Branches") or ())]
+        entry = RepoFileIndex(repo, generation, (f["FileName"] for f in files if f.get("FileName")), branch)
+        self._file_indexes.put(entry)
+        return entry
+
+    def _render_directory_tree(self, data: Optional[Dict], path: str, depth: int) -> str:
         if not data:
             raise ValueError("invalid arguments the given path or repository does not exist")
 
@@ -257,5 +756,4 @@ class ZoektContentFetcher(AbstractContentFetcher):
         if not all_files and path != ".":
             raise ValueError("invalid arguments the given path or repository does not exist")
 
-        dirs_at_depth = self._build_directory_structure(all_files, path, depth)
-        return self._format_tree_structure(dirs_at_depth, depth)
+        return self._format_tree(all_files, path, depth)
@@ -0,0 +1,80 @@
+"""In-memory per-repository file lists used to answer Zoekt directory trees."""
+
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+
+
+class RepoFileIndex:
+    """Sorted paths of every file in one repository (or one of its branches) at one Zoekt index generation."""
+
+    __slots__ = ("repo", "branch", "generation", "paths", "checked_at")
+
+    def __init__(self, repo: str, generation: str, paths: Iterable[str], branch: Optional[str] = None):
+        self.repo = repo
+        self.branch = branch
+        self.generation = generation
+        self.paths: Tuple[str, ...] = tuple(sorted(set(paths)))
+        self.checked_at = time.monotonic()
+
+    def files_under(self, path: str) -> Tuple[str, ...]:
+        """Return all file paths below a directory using a binary-search range scan.
+
+        Args:
+            path: Directory path relative to the repository root ("." for the root)
+
+        Returns:
+            tuple: Sorted file paths below the directory
+        """
+        path = path.strip("/")
+        if path in ("", "."):
+            return self.paths
+
+        prefix = f"{path}/"
+        lo = bisect_left(self.paths, prefix)
+        # "0" sorts right after "/", so this is the first path outside the prefix range
+        hi = bisect_left(self.paths, f"{path}0", lo)
+        return self.paths[lo:hi]
+
+    def is_dir(self, path: str) -> bool:
+        return bool(self.files_under(path))
+
+
+class FileIndexCache:
+    """LRU of repository file indexes whose generations are re-checked after a TTL."""
+
+    def __init__(self, max_repos: int = 256, generation_ttl: float = 30.0):
+        """Initialize the cache.
+
+        Args:
+            max_repos: Maximum number of repositories to keep file lists for
+            generation_ttl: Seconds before the index generation of a repository is checked again
+        """
+        self.max_repos = max_repos
+        self.generation_ttl = generation_ttl
+        self._entries: "OrderedDict[Tuple[str, Optional[str]], RepoFileIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, repo: str, branch: Optional[str] = None) -> Optional[RepoFileIndex]:
+        key = (repo, branch)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def is_fresh(self, entry: RepoFileIndex) -> bool:
+        return time.monotonic() - entry.checked_at < self.generation_ttl
+
+    def mark_checked(self, entry: RepoFileIndex) -> None:
+        entry.checked_at = time.monotonic()
+
+    def put(self, entry: RepoFileIndex) -> None:
+        with self._lock:
+            key = (entry.repo, entry.branch)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_repos:
+                self._entries.popitem(last=False)
@@ -0,0 +1,383 @@
+"""Load balancing, hedging and ejection across Zoekt webserver replicas."""
+
+import asyncio
+import logging
+import math
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, TypeVar, Union
+
+import httpx
+import requests
+
+from backends.transport import HTTPTransport
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+BALANCERS = ("ewma", "least_outstanding")
+# Smoothing of the per-replica latency average; higher reacts faster
+EWMA_WEIGHT = 0.3
+# Seconds over which an unused replica's latency average fades, so a replica slow once is tried again
+LATENCY_DECAY = 10.0
+# Successful call latencies kept to derive the hedge delay from, and how many are needed first
+LATENCY_WINDOW = 512
+MIN_HEDGE_SAMPLES = 20
+# Successful calls between recomputations of the hedge delay
+HEDGE_DELAY_INTERVAL = 32
+
+
+def parse_replica_urls(urls: Union[str, Sequence[str]]) -> List[str]:
+    """Split a comma-separated list of replica base URLs."""
+    if isinstance(urls, str):
+        urls = urls.split(",")
+    parsed = [url.strip().rstrip("/") for url in urls if url.strip()]
+    if not parsed:
+        raise ValueError("At least one Zoekt replica URL is required")
+    return parsed
+
+
+def is_replica_failure(exc: BaseException) -> bool:
+    """Whether an error says the replica is unhealthy, rather than that the request was bad."""
+    if isinstance(exc, requests.exceptions.HTTPError):
+        response = getattr(exc, "response", None)
+        return response is not None and response.status_code >= 500
+    return isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout, _FailedResponse))
+
+
+class _FailedResponse(Exception):
+    """A 5xx response, raised so that another replica is tried; returned when none does better."""
+
+    def __init__(self, response: Any):
+        super().__init__(f"{response.status_code} response")
+        self.response = response
+
+
+class _Replica:
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.latency = 0.0
+        self.latency_updated_at = 0.0
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        # Set while the single trial request after an ejection is in flight
+        self.probing = False
+
+    def available(self, now: float) -> bool:
+        return self.ejected_until == 0.0 or (now >= self.ejected_until and not self.probing)
+
+    def expected_latency(self, now: float) -> float:
+        return self.latency * math.exp(-(now - self.latency_updated_at) / LATENCY_DECAY)
+
+    def observe_latency(self, elapsed: float, now: float) -> None:
+        latency = self.expected_latency(now)
+        self.latency = elapsed if latency == 0.0 else EWMA_WEIGHT * elapsed + (1 - EWMA_WEIGHT) * latency
+        self.latency_updated_at = now
+
+
+class ReplicaSet:
+    """Zoekt webservers serving the same shards, shared by the client and the fetcher.
+
+    Each call goes to one replica picked from two random healthy ones (power of two
+    choices): the one with fewer outstanding calls, weighted by its moving average
+    latency under the ``ewma`` balancer. When an async call has not completed after
+    the ``hedge_percentile`` latency of recent calls, a hedged duplicate goes to
+    another replica and the first answer wins; at most ``hedge_budget`` of the calls
+    are hedged so that hedging cannot double the load of a saturated cluster. Calls
+    failing with a connection error, timeout or 5xx response fail over to another
+    replica.
+
+    A replica failing ``eject_after`` calls in a row is ejected for ``eject_duration``
+    seconds, doubling with every repeated ejection. Once that passed, one call probes
+    it: success brings it back, failure ejects it again. When every replica is
+    ejected, calls still go to the one due back first.
+    """
+
+    def __init__(
+        self,
+        urls: Union[str, Sequence[str]],
+        transport: Optional[HTTPTransport] = None,
+        balancer: str = "ewma",
+        hedge_percentile: float = 0.95,
+        hedge_min_delay: float = 0.05,
+        hedge_budget: float = 0.1,
+        eject_after: int = 3,
+        eject_duration: float = 10.0,
+        max_eject_duration: float = 300.0,
+    ):
+        """Initialize the replica set.
+
+        Args:
+            urls: Replica base URLs, or a comma-separated string of them
+            transport: Shared HTTP transport
+            balancer: ``ewma`` or ``least_outstanding``
+            hedge_percentile: Latency percentile of recent calls after which a call is hedged
+            hedge_min_delay: Shortest delay in seconds before a call is hedged
+            hedge_budget: Largest share of calls that may be hedged
+            eject_after: Consecutive failures that eject a replica
+            eject_duration: Seconds a replica stays ejected the first time
+            max_eject_duration: Longest ejection in seconds
+        """
+        if balancer not in BALANCERS:
+            raise ValueError(f"Invalid balancer {balancer}; valid options are [{'|'.join(BALANCERS)}]")
+        self.transport = transport or HTTPTransport()
+        self.balancer = balancer
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_budget = hedge_budget
+        self.eject_after = eject_after
+        self.eject_duration = eject_duration
+        self.max_eject_duration = max_eject_duration
+        self._replicas = [_Replica(url) for url in parse_replica_urls(urls)]
+        self._latencies: deque = deque(maxlen=LATENCY_WINDOW)
+        # Latencies observed so far; unlike the window's length, it keeps growing once the window is full
+        self._samples = 0
+        self._hedge_delay: Optional[float] = None
+        self._calls = 0
+        self._hedges = 0
+        self._hedge_wins = 0
+        self._failovers = 0
+        self._lock = threading.Lock()
+
+    @property
+    def urls(self) -> List[str]:
+        return [replica.url for replica in self._replicas]
+
+    def request(self, method: str, path: str, **kwargs: Any) -> requests.Response:
+        """Send a request to a replica; a 5xx response is only returned when no other replica answered."""
+        try:
+            return self.call(lambda url: _check(self.transport.request(method, f"{url}{path}", **kwargs)))
+        except _FailedResponse as exc:
+            return exc.response
+
+    def get(self, path: str, **kwargs: Any) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs: Any) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    async def arequest(self, method: str, path: str, hedge: bool = True, **kwargs: Any) -> httpx.Response:
+        """Asynchronous counterpart of :meth:`request`, hedged unless ``hedge`` is False."""
+
+        async def operation(url: str) -> httpx.Response:
+            return _check(await self.transport.arequest(method, f"{url}{path}", **kwargs))
+
+        try:
+            return await self.acall(operation, hedge=hedge)
+        except _FailedResponse as exc:
+            return exc.response
+
+    async def aget(self, path: str, **kwargs: Any) -> httpx.Response:
+        return await self.arequest("GET", path, **kwargs)
+
+    async def apost(self, path: str, **kwargs: Any) -> httpx.Response:
+        return await self.arequest("POST", path, **kwargs)
+
+    def call(self, operation: Callable[[str], T]) -> T:
+        """Run ``operation`` with a replica base URL, failing over to other replicas when it fails."""
+        tried: List[_Replica] = []
+        last_error: Optional[Exception] = None
+        while True:
+            replica = self._pick(tried)
+            if replica is None:
+                raise last_error
+            if tried:
+                self._count_failover()
+            tried.append(replica)
+            start = self._start(replica)
+            try:
+                result = operation(replica.url)
+            except Exception as exc:
+                self._finish(replica, start, failed=is_replica_failure(exc))
+                if not is_replica_failure(exc):
+                    raise
+                last_error = exc
+                continue
+            self._finish(replica, start, failed=False)
+            return result
+
+    async def acall(self, operation: Callable[[str], Awaitable[T]], hedge: bool = True) -> T:
+        """Run ``operation`` with a replica base URL, hedged and failing over to other replicas.
+
+        ``operation`` runs in a task per attempt; the attempts that lose are cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        tried: List[_Replica] = []
+        attempts: Dict[asyncio.Task, _Replica] = {}
+        hedges: List[asyncio.Task] = []
+        last_error: Optional[BaseException] = None
+
+        def attempt(replica: _Replica) -> asyncio.Task:
+            tried.append(replica)
+            task = asyncio.ensure_future(self._attempt(replica, operation))
+            # Errors of cancelled losers are not interesting
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+            attempts[task] = replica
+            return task
+
+        attempt(self._pick(tried))
+        hedge_delay = self._next_hedge_delay() if hedge else None
+        hedge_at = None if hedge_delay is None else loop.time() + hedge_delay
+        try:
+            while attempts:
+                timeout = None if hedge_at is None else max(0.0, hedge_at - loop.time())
+                done, _ = await asyncio.wait(attempts, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedge_at = None
+                    replica = self._pick(tried)
+                    if replica is not None:
+                        self._count_hedge()
+                        hedges.append(attempt(replica))
+                    continue
+                for task in done:
+                    attempts.pop(task)
+                    exc = task.exception()
+                    if exc is None:
+                        if task in hedges:
+                            self._count_hedge_win()
+                        return task.result()
+                    if not is_replica_failure(exc):
+                        raise exc
+                    last_error = exc
+                if not attempts:
+                    replica = self._pick(tried)
+                    if replica is not None:
+                        self._count_failover()
+                        attempt(replica)
+            raise last_error
+        finally:
+            for task in attempts:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "calls": self._calls,
+                "hedges": self._hedges,
+                "hedge_wins": self._hedge_wins,
+                "failovers": self._failovers,
+                "hedge_delay_ms": None if self._hedge_delay is None else round(self._hedge_delay * 1000, 1),
+                "replicas": {
+                    replica.url: {
+                        "outstanding": replica.outstanding,
+                        "latency_ms": round(replica.expected_latency(now) * 1000, 1),
+                        "consecutive_failures": replica.failures,
+                        "ejections": replica.ejections,
+                        "ejected": replica.ejected_until > now,
+                    }
+                    for replica in self._replicas
+                },
+            }
+
+    async def _attempt(self, replica: _Replica, operation: Callable[[str], Awaitable[T]]) -> T:
+        start = self._start(replica)
+        try:
+            result = await operation(replica.url)
+        except asyncio.CancelledError:
+            # Lost to a hedge: not a failure, but the replica was at least this slow
+            self._finish(replica, start, failed=None)
+            raise
+        except Exception as exc:
+            self._finish(replica, start, failed=is_replica_failure(exc))
+            raise
+        self._finish(replica, start, failed=False)
+        return result
+
+    def _pick(self, exclude: Sequence[_Replica]) -> Optional[_Replica]:
+        now = time.monotonic()
+        with self._lock:
+            remaining = [replica for replica in self._replicas if replica not in exclude]
+            if not remaining:
+                return None
+            healthy = [replica for replica in remaining if replica.available(now)]
+            if not healthy:
+                return min(remaining, key=lambda replica: replica.ejected_until)
+            # Sampled even when there are only two, so that ties are broken at random
+            candidates = random.sample(healthy, min(2, len(healthy)))
+            replica = min(candidates, key=self._load)
+            if replica.ejected_until:
+                replica.probing = True
+            return replica
+
+    def _load(self, replica: _Replica) -> float:
+        if self.balancer == "least_outstanding":
+            return replica.outstanding
+        # Replicas without a latency yet are tried first
+        return (replica.outstanding + 1) * replica.expected_latency(time.monotonic())
+
+    def _start(self, replica: _Replica) -> float:
+        with self._lock:
+            replica.outstanding += 1
+            self._calls += 1
+        return time.monotonic()
+
+    def _finish(self, replica: _Replica, start: float, failed: Optional[bool]) -> None:
+        """Record the outcome of a call; ``failed`` is None when the call was abandoned."""
+        now = time.monotonic()
+        elapsed = now - start
+        with self._lock:
+            replica.outstanding -= 1
+            if failed is None:
+                replica.observe_latency(elapsed, now)
+                replica.probing = False
+                return
+            if not failed:
+                replica.observe_latency(elapsed, now)
+                if replica.ejected_until:
+                    logger.info(f"Zoekt replica {replica.url} is healthy again")
+                replica.failures = 0
+                replica.ejections = 0
+                replica.ejected_until = 0.0
+                replica.probing = False
+                self._latencies.append(elapsed)
+                self._samples += 1
+                if self._samples % HEDGE_DELAY_INTERVAL == 0 or self._hedge_delay is None:
+                    self._update_hedge_delay()
+                return
+            replica.failures += 1
+            if replica.probing or replica.failures >= self.eject_after:
+                duration = min(self.max_eject_duration, self.eject_duration * 2**replica.ejections)
+                replica.ejections += 1
+                replica.ejected_until = time.monotonic() + duration
+                replica.probing = False
+                logger.warning(f"Ejecting Zoekt replica {replica.url} for {duration:g}s")
+
+    def _update_hedge_delay(self) -> None:
+        if len(self._latencies) < MIN_HEDGE_SAMPLES:
+            return
+        latencies = sorted(self._latencies)
+        index = min(len(latencies) - 1, int(self.hedge_percentile * len(latencies)))
+        self._hedge_delay = max(self.hedge_min_delay, latencies[index])
+
+    def _next_hedge_delay(self) -> Optional[float]:
+        """Delay before the current call is hedged, or None when it may not be."""
+        with self._lock:
+            if len(self._replicas) < 2 or self._hedge_delay is None:
+                return None
+            if self._hedges >= self.hedge_budget * self._calls:
+                return None
+            return self._hedge_delay
+
+    def _count_hedge(self) -> None:
+        with self._lock:
+            self._hedges += 1
+
+    def _count_hedge_win(self) -> None:
+        with self._lock:
+            self._hedge_wins += 1
+
+    def _count_failover(self) -> None:
+        with self._lock:
+            self._failovers += 1
+
+
+def _check(response: Any) -> Any:
+    if response.status_code >= 500:
+        raise _FailedResponse(response)
+    return response
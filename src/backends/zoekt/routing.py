@@ -0,0 +1,173 @@
+"""Routing of repository-scoped queries and fetches to the Zoekt shard that indexes the repository."""
+
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+from backends.jsonstream import JSONArrayStream
+from backends.transport import raise_for_status
+from backends.zoekt.api import LIST_API_PATH
+from backends.zoekt.replicas import ReplicaSet
+
+logger = logging.getLogger(__name__)
+
+# Positive and negated repository filters of a query; their values are regular expressions
+REPO_FILTER_PATTERN = re.compile(r"(?:^|[\s(])(-?)(?:r|repo):(\S+)", re.IGNORECASE)
+# Alternatives may name repositories on other shards, so such queries are not routed
+OR_PATTERN = re.compile(r"\bor\b", re.IGNORECASE)
+LIST_CHUNK_SIZE = 64 * 1024
+# Routes of recent repository filters, dropped whenever the map is refreshed
+MAX_CACHED_ROUTES = 1024
+
+
+class ShardRouter:
+    """Map of repository name to the shards indexing it, built from each shard's repository listing.
+
+    Queries whose repository filters match repositories of only some shards, and
+    fetches of a known repository, go to those shards alone; anything the map cannot
+    place (no filter, alternatives, unknown repositories) goes to every shard. The
+    map is refreshed from a background thread once it is ``refresh_interval``
+    seconds old, so lookups never wait for a listing. A shard whose listing fails
+    keeps its previous repositories.
+    """
+
+    def __init__(self, shards: Sequence[ReplicaSet], refresh_interval: float = 60.0):
+        """Initialize the router.
+
+        Args:
+            shards: Replica set of each shard, in the order shard indices refer to
+            refresh_interval: Seconds between refreshes of the repository map
+        """
+        self.shards = list(shards)
+        self.refresh_interval = refresh_interval
+        self.routed = 0
+        self.fanned_out = 0
+        self._shard_repos: List[FrozenSet[str]] = [frozenset()] * len(self.shards)
+        self._owners: Dict[str, Tuple[int, ...]] = {}
+        self._routes: "OrderedDict[Tuple[str, ...], Optional[Tuple[int, ...]]]" = OrderedDict()
+        self._refreshed_at = float("-inf")
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def shards_for_repo(self, repository: str) -> Optional[Tuple[int, ...]]:
+        """Indices of the shards indexing ``repository``, or None if the map does not know it."""
+        self._refresh_in_background()
+        owners = self._owners.get(repository)
+        self._count(owners)
+        return owners
+
+    def shards_for_query(self, query: str) -> Optional[Tuple[int, ...]]:
+        """Indices of the shards that may have results for ``query``, or None if every shard may.
+
+        A shard may have results when one of its repositories matches every positive
+        repository filter of the query.
+        """
+        self._refresh_in_background()
+        filters = tuple(value for negated, value in REPO_FILTER_PATTERN.findall(query) if not negated)
+        repo_owners = self._owners
+        if not filters or OR_PATTERN.search(query) or not repo_owners:
+            self._count(None)
+            return None
+
+        with self._lock:
+            cached = filters in self._routes
+            owners = self._routes.get(filters)
+            if cached:
+                self._routes.move_to_end(filters)
+        if not cached:
+            owners = self._match(repo_owners, filters)
+            with self._lock:
+                # A refresh in the meantime cleared the routes computed from the previous map
+                if self._owners is repo_owners:
+                    self._routes[filters] = owners
+                    if len(self._routes) > MAX_CACHED_ROUTES:
+                        self._routes.popitem(last=False)
+        self._count(owners)
+        return owners
+
+    def refresh(self) -> None:
+        """Rebuild the repository map from the listing of every shard."""
+        shard_repos = list(self._shard_repos)
+        for index, replicas in enumerate(self.shards):
+            try:
+                shard_repos[index] = self._list_repos(replicas)
+            except Exception as exc:
+                logger.warning(f"Could not list the repositories of Zoekt shard {index}: {exc}")
+
+        owners: Dict[str, Tuple[int, ...]] = {}
+        for index, repos in enumerate(shard_repos):
+            for repo in repos:
+                owners[repo] = owners.get(repo, ()) + (index,)
+        with self._lock:
+            self._shard_repos = shard_repos
+            self._owners = owners
+            self._routes.clear()
+        logger.info(f"Routing {len(owners)} repositories over {len(self.shards)} Zoekt shards")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "repositories": [len(repos) for repos in self._shard_repos],
+            "routed": self.routed,
+            "fanned_out": self.fanned_out,
+            "age_seconds": round(time.monotonic() - self._refreshed_at, 1) if self._owners else None,
+        }
+
+    @staticmethod
+    def _match(repo_owners: Dict[str, Tuple[int, ...]], filters: Tuple[str, ...]) -> Optional[Tuple[int, ...]]:
+        try:
+            patterns = [re.compile(value, re.IGNORECASE) for value in filters]
+        except re.error:
+            # Zoekt will reject or interpret it differently; let every shard answer
+            return None
+        owners = {
+            index
+            for repo, indices in repo_owners.items()
+            if all(pattern.search(repo) for pattern in patterns)
+            for index in indices
+        }
+        return tuple(sorted(owners)) or None
+
+    def _count(self, owners: Optional[Tuple[int, ...]]) -> None:
+        if owners is None:
+            self.fanned_out += 1
+        else:
+            self.routed += 1
+
+    def _refresh_in_background(self) -> None:
+        with self._lock:
+            if self._refreshing or time.monotonic() - self._refreshed_at < self.refresh_interval:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._run_refresh, name="zoekt-shard-router", daemon=True).start()
+
+    def _run_refresh(self) -> None:
+        try:
+            self.refresh()
+        finally:
+            with self._lock:
+                self._refreshed_at = time.monotonic()
+                self._refreshing = False
+
+    @staticmethod
+    def _list_repos(replicas: ReplicaSet) -> FrozenSet[str]:
+        def list_repos(base_url: str) -> FrozenSet[str]:
+            # Streamed so that only the names of a large listing are kept in memory
+            stream = JSONArrayStream(
+                ("List", "Repos"), keep=lambda repo: (repo.get("Repository") or {}).get("Name", "")
+            )
+            response = replicas.transport.post(
+                f"{base_url}{LIST_API_PATH}", json={"Q": ""}, idempotent=True, stream=True
+            )
+            try:
+                raise_for_status(response)
+                for chunk in response.iter_content(chunk_size=LIST_CHUNK_SIZE):
+                    stream.feed(chunk)
+                stream.result()
+            finally:
+                response.close()
+            return frozenset(name for name in stream.items if name)
+
+        return replicas.call(list_repos)
@@ -0,0 +1,203 @@
+"""Compare eager match text building with lazy matches in both backends' ``format_results``.
+
+The responses hold ``--matches`` chunk matches of eleven lines each (a matched line
+and five lines of context on each side), spread over files of ``--matches-per-file``
+matches, with some minified lines longer than the line limit. The eager path is the
+previous one: every chunk is split into lines, each line is truncated, charged and
+joined again into a plain ``Match``. The lazy path charges the lines by their offsets
+and cuts the text of a ``LazyMatch`` from the chunk only when it is serialized.
+
+Reported per path: formatting time, formatting plus serialization to JSON (as the
+MCP server does), peak memory while formatting, memory held by the formatted
+results, and the size of the serialized output.
+
+Usage (from the ``src`` directory):
+    python -m benchmarks.format_results [--matches 10000] [--matches-per-file 5] [--max-output-length 1000000000]
+"""
+
+import argparse
+import base64
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pydantic_core
+
+from backends.budget import OutputBudget, context_window
+from backends.models import FormattedResult
+from backends.sourcegraph.client import SourcegraphClient
+from backends.zoekt.client import Client
+
+REPO = "github.com/example/project"
+CONTEXT = 5
+
+
+@dataclass
+class EagerMatch:
+    """The previous match model: a regular dataclass holding its built text."""
+
+    line_number: int
+    text: str
+
+
+class EagerZoektClient(Client):
+    """Zoekt client formatting chunks the previous way."""
+
+    def _chunk_match(self, chunk: Dict[str, Any], budget: OutputBudget) -> Optional[EagerMatch]:
+        line_number, _, lines = self._chunk_lines(chunk, budget.context_lines())
+        kept = budget.take_lines(lines)
+        return EagerMatch(line_number=line_number, text="\n".join(kept)) if kept is not None else None
+
+
+class EagerSourcegraphClient(SourcegraphClient):
+    """Sourcegraph client formatting chunks the previous way."""
+
+    def _chunk_match(self, chunk: Dict[str, Any], budget: OutputBudget) -> Optional[EagerMatch]:
+        content_start = self._safe_get(chunk, "contentStart", "line", default=0)
+        lines = chunk.get("content", "").split("\n")
+        ranges = chunk.get("ranges") or []
+        if ranges:
+            first = self._safe_get(ranges[0], "start", "line", default=content_start) - content_start
+            last = self._safe_get(ranges[-1], "end", "line", default=content_start) - content_start
+            window = context_window(len(lines), first, last, budget.context_lines())
+            lines = lines[window]
+            content_start += window.start
+        kept = budget.take_lines([self._truncate_line(line) for line in lines])
+        return EagerMatch(line_number=content_start + 1, text="\n".join(kept)) if kept is not None else None
+
+
+def chunk_text(index: int) -> str:
+    """Eleven lines of code around a match; every seventh chunk has a minified line over the line limit."""
+    lines = [
+        f"    value_{index}_{k} = compute(value_{index}_{k - 1}, options)  # step {k}" for k in range(2 * CONTEXT + 1)
+    ]
+    lines[CONTEXT] = f"    result = search_target_{index}(value_{index}_{CONTEXT - 1})"
+    if index % 7 == 0:
+        lines[1] = "var a=function(b){return b&&b.c?b.d(e,f):g.h(i)};" * 20
+    return "\n".join(lines)
+
+
+def zoekt_results(matches: int, per_file: int) -> dict:
+    """A decoded /api/search response with ``matches`` chunk matches."""
+    files = []
+    for file_index in range(0, matches, per_file):
+        chunks = []
+        for index in range(file_index, min(file_index + per_file, matches)):
+            start = 1 + index * 20
+            chunks.append(
+                {
+                    "Content": base64.b64encode(chunk_text(index).encode()).decode(),
+                    "ContentStart": {"ByteOffset": 0, "LineNumber": start, "Column": 1},
+                    "Ranges": [
+                        {
+                            "Start": {"ByteOffset": 0, "LineNumber": start + CONTEXT, "Column": 5},
+                            "End": {"ByteOffset": 0, "LineNumber": start + CONTEXT, "Column": 11},
+                        }
+                    ],
+                }
+            )
+        files.append(
+            {
+                "FileName": f"src/module_{file_index // 50}/file_{file_index}.py",
+                "Repository": REPO,
+                "Version": "0123456789abcdef",
+                "Score": 1000.0 - file_index,
+                "ChunkMatches": chunks,
+            }
+        )
+    return {
+        "Result": {"Files": files, "RepoURLs": {REPO: "https://github.com/example/project/blob/{{.Version}}/{{.Path}}"}}
+    }
+
+
+def sourcegraph_results(matches: int, per_file: int) -> dict:
+    """Search results as collected from a Sourcegraph stream, with ``matches`` chunk matches."""
+    files = []
+    for file_index in range(0, matches, per_file):
+        chunks = []
+        for index in range(file_index, min(file_index + per_file, matches)):
+            start = index * 20
+            chunks.append(
+                {
+                    "content": chunk_text(index),
+                    "contentStart": {"offset": 0, "line": start, "column": 0},
+                    "ranges": [
+                        {
+                            "start": {"offset": 0, "line": start + CONTEXT, "column": 4},
+                            "end": {"offset": 0, "line": start + CONTEXT, "column": 10},
+                        }
+                    ],
+                }
+            )
+        files.append(
+            {
+                "type": "content",
+                "repository": REPO,
+                "path": f"src/module_{file_index // 50}/file_{file_index}.py",
+                "chunkMatches": chunks,
+            }
+        )
+    return {"matches": files, "alerts": []}
+
+
+def measure(repeat: int, format_results: Callable[[], List[FormattedResult]]) -> Tuple[float, float, int, int, int]:
+    """Return best formatting time, best formatting plus serialization time, peak and retained memory, output size."""
+    best_format = best_total = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = format_results()
+        formatted = time.perf_counter()
+        pydantic_core.to_json(results, fallback=str, indent=2)
+        best_format = min(best_format, formatted - start)
+        best_total = min(best_total, time.perf_counter() - start)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    results = format_results()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    size = len(pydantic_core.to_json(results, fallback=str, indent=2))
+    return best_format, best_total, peak - before, retained - before, size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--matches", type=int, default=10_000)
+    parser.add_argument("--matches-per-file", type=int, default=5)
+    parser.add_argument("--max-output-length", type=int, default=1_000_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    zoekt = zoekt_results(args.matches, args.matches_per_file)
+    sourcegraph = sourcegraph_results(args.matches, args.matches_per_file)
+    clients = {
+        "zoekt": (Client, EagerZoektClient, {"base_url": "http://zoekt.invalid"}, zoekt),
+        "sourcegraph": (
+            SourcegraphClient,
+            EagerSourcegraphClient,
+            {"endpoint": "http://sourcegraph.invalid", "token": ""},
+            sourcegraph,
+        ),
+    }
+
+    print(f"{args.matches:,} chunk matches, {args.matches_per_file} per file, budget {args.max_output_length:,} bytes")
+    print()
+    print(
+        f"{'backend / path':<22}{'format ms':>11}{'+ json ms':>11}{'peak MiB':>10}{'held MiB':>10}{'output bytes':>15}"
+    )
+    for backend, (lazy_class, eager_class, kwargs, results) in clients.items():
+        for path, client_class in (("eager", eager_class), ("lazy", lazy_class)):
+            client = client_class(**kwargs)
+            client.max_output_length = args.max_output_length
+            seconds, total, peak, held, size = measure(
+                args.repeat, lambda: client.format_results(results, args.matches)
+            )
+            print(
+                f"{backend + ' / ' + path:<22}{seconds * 1000:>11.1f}{total * 1000:>11.1f}"
+                f"{peak / 2**20:>10.1f}{held / 2**20:>10.1f}{size:>15,}"
+            )
+
+
+if __name__ == "__main__":
+    main()
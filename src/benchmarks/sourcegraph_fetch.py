@@ -0,0 +1,270 @@
+"""Compare the two-query Sourcegraph content fetch with the single lean query.
+
+A local stand-in for the Sourcegraph GraphQL endpoint answers ``GetFileContent``,
+``GetRepositoryTree`` and ``GetPathContent`` for one synthetic repository. Every
+request waits ``--latency-ms`` to stand for the network round trip and resolver
+work, and ``richHTML`` is rendered for real (one span per token and a table row per
+line, like Sourcegraph's highlighter output) so its cost and size show up.
+
+Usage (from the ``src`` directory):
+    python -m benchmarks.sourcegraph_fetch [--latency-ms 20] [--file-kb 60] [--repeat 20]
+"""
+
+import argparse
+import html
+import json
+import re
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from backends.content_fetcher import MAX_FILE_SIZE, truncate_file_content
+from backends.sourcegraph.fetcher import SourcegraphContentFetcher
+from backends.transport import raise_for_status
+from backends.tree import PathTree
+
+REPO = "github.com/example/project"
+FILE_PATH = "src/service/handlers.py"
+DIR_PATH = "src"
+
+# The queries sent before GetPathContent replaced them
+LEGACY_FILE_CONTENT_QUERY = """
+query GetFileContent($name: String!, $path: String!) {
+    repository(name: $name) {
+        commit(rev: "HEAD") {
+            file(path: $path) {
+                path
+                name
+                content
+                totalLines
+                binary
+                contentType
+                richHTML
+                languages
+            }
+        }
+    }
+}
+"""
+
+LEGACY_REPOSITORY_TREE_QUERY = """
+query GetRepositoryTree($name: String!, $path: String = ".") {
+    repository(name: $name) {
+        name
+        commit(rev: "HEAD") {
+            message
+            tree(path: $path) {
+                entries {
+                    name
+                    isDirectory
+                    ... on GitTree {
+                        entries {
+                            name
+                            isDirectory
+                        }
+                    }
+                }
+            }
+            languages
+        }
+    }
+}
+"""
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]+|\s+")
+
+
+def make_repository(file_bytes: int) -> Tuple[str, Dict[str, List[str]]]:
+    """Build the content of FILE_PATH and a directory listing (directory -> child names, "/" for dirs)."""
+    lines, total, i = [], 0, 0
+    while total < file_bytes:
+        line = f'    def handle_{i}(self, request: Request) -> Response:  # route "/v1/items/<{i}>" & friends'
+        lines.append(line)
+        total += len(line) + 1
+        i += 1
+    dirs = {
+        "src": ["service/", "models/", "utils/", "main.py", "config.py"],
+        "src/service": [f"handler_{i}.py" for i in range(40)] + ["handlers.py"],
+        "src/models": [f"model_{i}.py" for i in range(25)],
+        "src/utils": [f"util_{i}.py" for i in range(15)],
+    }
+    return "\n".join(lines), dirs
+
+
+def highlight(content: str) -> str:
+    """Render syntax-highlighted HTML the way the richHTML field does."""
+    rows = []
+    for n, line in enumerate(content.split("\n"), start=1):
+        spans = "".join(
+            f'<span class="hl-{"id" if token[0].isalnum() else "p"}">{html.escape(token)}</span>'
+            for token in TOKEN_PATTERN.findall(line)
+        )
+        rows.append(f'<tr><td class="line" data-line="{n}"></td><td class="code"><div>{spans}</div></td></tr>')
+    return f"<table>{''.join(rows)}</table>"
+
+
+class StandInGraphQL(BaseHTTPRequestHandler):
+    """Answers the three content queries for REPO."""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without this, delayed ACKs add ~40 ms to small responses
+    disable_nagle_algorithm = True
+    latency = 0.0
+    content = ""
+    dirs: Dict[str, List[str]] = {}
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(self.latency)
+        body = json.dumps(self._resolve(request["query"], request["variables"])).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _resolve(self, query: str, variables: Dict[str, str]) -> Dict[str, Any]:
+        if variables["name"] != REPO:
+            return {"data": {"repository": None}}
+        path = variables.get("path", ".").strip("/")
+        path = "" if path == "." else path
+        is_file, is_dir = path == FILE_PATH, path in self.dirs or path == ""
+
+        if "GetFileContent" in query:
+            if not is_file:
+                return {"data": {"repository": {"commit": {"file": None}}}}
+            return {"data": {"repository": {"commit": {"file": self._blob(rich="richHTML" in query)}}}}
+        if "GetRepositoryTree" in query:
+            if not is_dir:
+                return {"errors": [{"message": "not a directory"}], "data": {"repository": {"commit": {"tree": None}}}}
+            commit = {"message": "Synthetic commit", "tree": self._tree(path), "languages": ["Python"]}
+            return {"data": {"repository": {"name": REPO, "commit": commit}}}
+        # GetPathContent; no commit oid is returned, so the lean fetcher does not cache listings between repeats
+        if is_file:
+            entry = {"__typename": "GitBlob", **self._blob(rich=False)}
+        elif is_dir:
+            entry = {"__typename": "GitTree", **self._tree(path)}
+        else:
+            entry = None
+        return {"data": {"repository": {"commit": {"path": entry}}}}
+
+    def _blob(self, rich: bool) -> Dict[str, Any]:
+        blob = {"content": self.content, "totalLines": self.content.count("\n") + 1}
+        if rich:
+            blob.update(
+                path=FILE_PATH,
+                name=FILE_PATH.rsplit("/", 1)[-1],
+                binary=False,
+                contentType="text/x-python",
+                richHTML=highlight(self.content),
+                languages=["Python"],
+            )
+        return blob
+
+    def _tree(self, path: str) -> Dict[str, Any]:
+        def entries(directory: str, levels: int) -> List[Dict[str, Any]]:
+            result = []
+            for name in self.dirs.get(directory, ["src/"] if directory == "" else []):
+                entry = {"name": name.rstrip("/"), "isDirectory": name.endswith("/")}
+                if entry["isDirectory"] and levels > 1:
+                    entry["entries"] = entries(f"{directory}/{entry['name']}".lstrip("/"), levels - 1)
+                result.append(entry)
+            return result
+
+        return {"entries": entries(path, 2)}
+
+
+class LegacySourcegraphFetcher(SourcegraphContentFetcher):
+    """The previous lookup: GetFileContent with richHTML, then GetRepositoryTree on failure."""
+
+    def get_content(self, repository: str, path: str = "", depth: int = 2, ref: str = "HEAD") -> str:
+        repository = self._clean_repository_path(repository)
+        if path:
+            try:
+                data = self._graphql(LEGACY_FILE_CONTENT_QUERY, {"name": repository, "path": path})
+                content = self._safe_get(data, ["data", "repository", "commit", "file", "content"])
+                if "errors" not in data and content:
+                    if len(content) > MAX_FILE_SIZE:
+                        return truncate_file_content(content)
+                    return content
+            except ValueError:
+                pass
+        data = self._graphql(LEGACY_REPOSITORY_TREE_QUERY, {"name": repository, "path": path or "."})
+        tree = self._safe_get(data, ["data", "repository", "commit", "tree"])
+        if "errors" in data or tree is None:
+            raise ValueError("invalid arguments the given path or repository does not exist")
+        return self._format_sourcegraph_tree(tree.get("entries") or [], depth)
+
+    def _format_sourcegraph_tree(self, entries: list, max_depth: int) -> str:
+        """Format nested Sourcegraph tree entries into a string representation."""
+        tree = PathTree()
+        self._add_tree_entries(tree.root, entries)
+        return tree.render(max_depth)
+
+
+def count_response_bytes(fetcher: SourcegraphContentFetcher) -> List[int]:
+    """Record the size of every GraphQL response body the fetcher receives."""
+    sizes: List[int] = []
+    post = fetcher.transport.post
+
+    def recording_post(*args: Any, **kwargs: Any):
+        response = post(*args, **kwargs)
+        raise_for_status(response)
+        sizes.append(len(response.content))
+        return response
+
+    fetcher.transport.post = recording_post
+    return sizes
+
+
+def latencies(repeat: int, func: Callable[[], str]) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Simulated round trip per GraphQL request")
+    parser.add_argument("--file-kb", type=int, default=60)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    StandInGraphQL.latency = args.latency_ms / 1000
+    StandInGraphQL.content, StandInGraphQL.dirs = make_repository(args.file_kb * 1024)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInGraphQL)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_port}/"
+
+    legacy, lean = LegacySourcegraphFetcher(endpoint), SourcegraphContentFetcher(endpoint)
+    print(f"stand-in latency: {args.latency_ms:.0f} ms per request, file: {len(StandInGraphQL.content):,} bytes")
+    print()
+    print(f"{'case':<10}{'fetcher':<10}{'p50 ms':>10}{'p95 ms':>10}{'requests':>10}{'KiB/call':>14}")
+    try:
+        for case, path in (("file", FILE_PATH), ("directory", DIR_PATH), ("root", "")):
+            outputs: List[Optional[str]] = []
+            for name, fetcher in (("legacy", legacy), ("lean", lean)):
+                outputs.append(fetcher.get_content(REPO, path))
+                sizes = count_response_bytes(fetcher)
+                timings = latencies(args.repeat, lambda: fetcher.get_content(REPO, path))
+                requests_per_call = len(sizes) / args.repeat
+                del fetcher.transport.post
+                p50 = statistics.median(timings) * 1000
+                p95 = statistics.quantiles(timings, n=20)[-1] * 1000
+                kib = sum(sizes) / args.repeat / 1024
+                print(f"{case:<10}{name:<10}{p50:>10.1f}{p95:>10.1f}{requests_per_call:>10.0f}{kib:>14.1f}")
+            assert outputs[0] == outputs[1], f"{case}: outputs differ"
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
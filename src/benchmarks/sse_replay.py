@@ -0,0 +1,169 @@
+"""Replay a Sourcegraph search stream through the SSE parser.
+
+Compares the previous string-buffer parser with the bytes-level ``SSEParser`` on a
+recorded (or synthetic) stream and reports throughput, peak memory, and events that
+were lost or corrupted, e.g. by multi-byte characters split across chunks.
+
+To record a real stream:
+    curl -sN -H "Authorization: token $SRC_ACCESS_TOKEN" \\
+        "$SRC_ENDPOINT/.api/search/stream?q=...&v=V3&cm=true" > stream.sse
+
+Usage (from the ``src`` directory):
+    python -m benchmarks.sse_replay [--recording stream.sse] [--size-mb 50] [--chunk-kb 8] [--matches-per-event 200] [--crlf]
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from backends.sourcegraph.client import SSEParser
+
+
+class LegacySSEParser:
+    """The previous parser: decodes every chunk on its own and re-slices a str buffer."""
+
+    def __init__(self) -> None:
+        self.buffer = ""
+
+    def feed(self, chunk: bytes) -> Iterator[Dict[str, str]]:
+        self.buffer += chunk.decode("utf-8", errors="replace")
+        while True:
+            event_end = self.buffer.find("\n\n")
+            if event_end == -1:
+                break
+            event_text = self.buffer[:event_end]
+            self.buffer = self.buffer[event_end + 2 :]
+            event = self._parse_event(event_text)
+            if event:
+                yield event
+
+    def close(self) -> Iterator[Dict[str, str]]:
+        if self.buffer.strip():
+            event = self._parse_event(self.buffer)
+            if event:
+                yield event
+
+    @staticmethod
+    def _parse_event(event_text: str) -> Dict[str, str]:
+        event_type = None
+        data_lines = []
+        for line in event_text.split("\n"):
+            if line.startswith("event: "):
+                event_type = line[7:].strip()
+            elif line.startswith("data: "):
+                data_lines.append(line[6:])
+        if event_type and data_lines:
+            return {"event": event_type, "data": "\n".join(data_lines)}
+        return {}
+
+
+def make_stream(size_bytes: int, newline: str, matches_per_event: int) -> Tuple[bytes, List[Dict[str, str]]]:
+    """Build a stream of ``matches`` and ``progress`` events with non-ASCII content."""
+    events: List[Dict[str, str]] = []
+    parts: List[bytes] = []
+    total = 0
+    i = 0
+    while total < size_bytes:
+        matches = [
+            {
+                "type": "content",
+                "repository": f"github.com/example/repo{i % 17}",
+                "path": f"src/módulo_{i}/ファイル_{j}.py",
+                "chunkMatches": [
+                    {
+                        "content": f"def función_{j}():\n    return '汉字 ✓ naïve café 🚀 {i}'\n" * 4,
+                        "contentStart": {"line": j * 10},
+                        "ranges": [{"start": {"line": j * 10 + 1}, "end": {"line": j * 10 + 1}}],
+                    }
+                ],
+            }
+            for j in range(matches_per_event)
+        ]
+        for event in (
+            {"event": "matches", "data": json.dumps(matches, ensure_ascii=False)},
+            {"event": "progress", "data": json.dumps({"matchCount": (i + 1) * 20, "durationMs": i})},
+        ):
+            events.append(event)
+            raw = f"event: {event['event']}{newline}data: {event['data']}{newline}{newline}".encode()
+            parts.append(raw)
+            total += len(raw)
+        i += 1
+
+    parts.append(f"event: done{newline}data: {{}}{newline}{newline}".encode())
+    events.append({"event": "done", "data": "{}"})
+    return b"".join(parts), events
+
+
+def chunks(stream: bytes, chunk_size: int) -> Iterable[bytes]:
+    return (stream[offset : offset + chunk_size] for offset in range(0, len(stream), chunk_size))
+
+
+def replay(
+    parser_factory: Callable[[], object], stream: bytes, chunk_size: int, expected: Optional[List[Dict[str, str]]]
+) -> Tuple[int, int]:
+    """Feed the stream to a parser, comparing events as they arrive; returns (events, wrong events)."""
+    parser = parser_factory()
+    count = wrong = 0
+
+    def check(events: Iterable[Dict[str, str]]) -> None:
+        nonlocal count, wrong
+        for event in events:
+            if expected is not None and (count >= len(expected) or event != expected[count]):
+                wrong += 1
+            count += 1
+
+    for chunk in chunks(stream, chunk_size):
+        check(parser.feed(chunk))
+    check(parser.close())
+    if expected is not None:
+        wrong += max(len(expected) - count, 0)
+    return count, wrong
+
+
+def measure(func: Callable[[], Tuple[int, int]]) -> Tuple[float, int, Tuple[int, int]]:
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    counts = func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recording", help="Replay a recorded stream instead of a synthetic one")
+    parser.add_argument("--size-mb", type=float, default=50.0)
+    parser.add_argument("--chunk-kb", type=int, default=8)
+    parser.add_argument("--matches-per-event", type=int, default=200, help="Size of synthetic matches events")
+    parser.add_argument("--crlf", action="store_true", help="Frame the synthetic stream with CRLF line endings")
+    args = parser.parse_args()
+
+    if args.recording:
+        with open(args.recording, "rb") as f:
+            stream = f.read()
+        expected = None
+    else:
+        newline = "\r\n" if args.crlf else "\n"
+        stream, expected = make_stream(int(args.size_mb * 1024 * 1024), newline, args.matches_per_event)
+    chunk_size = args.chunk_kb * 1024
+
+    print(f"stream: {len(stream):,} bytes, {chunk_size:,} byte chunks")
+    print()
+    print(f"{'parser':<12}{'MB/s':>10}{'peak MiB':>12}{'events':>10}{'wrong':>10}")
+    for name, factory in (("legacy", LegacySSEParser), ("bytes-level", SSEParser)):
+        if args.crlf and factory is LegacySSEParser:
+            # It never finds an event boundary and buffers the whole stream, quadratically
+            print(f"{name:<12}{'cannot parse CRLF-framed streams':>52}")
+            continue
+        elapsed, peak, (count, wrong) = measure(lambda: replay(factory, stream, chunk_size, expected))
+        throughput = len(stream) / elapsed / 1e6
+        # Without a reference (recorded streams) only the event counts can be compared
+        print(f"{name:<12}{throughput:>10.1f}{peak / 2**20:>12.1f}{count:>10,}{wrong if expected else '-':>10}")
+
+
+if __name__ == "__main__":
+    main()
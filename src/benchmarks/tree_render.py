@@ -0,0 +1,131 @@
+"""Compare the shared PathTree renderer against the original Zoekt tree builder.
+
+Usage (from the ``src`` directory):
+    python -m benchmarks.tree_render [--sizes 10000 100000 1000000] [--depth 2]
+"""
+
+import argparse
+import random
+import time
+from typing import Dict, List, Set
+
+from backends.tree import PathTree
+
+
+def make_paths(count: int, seed: int = 7) -> List[str]:
+    """Build a sorted monorepo-like list of file paths."""
+    rng = random.Random(seed)
+    top = [f"service-{i:03d}" for i in range(60)]
+    mid = ["api", "cmd", "internal", "pkg", "docs", "test", "scripts", "config"]
+    paths = set()
+    while len(paths) < count:
+        depth = rng.randint(1, 6)
+        parts = [rng.choice(top)] + [f"{rng.choice(mid)}{rng.randint(0, 20)}" for _ in range(depth - 1)]
+        parts.append(f"file_{rng.randint(0, 10_000)}.{rng.choice(['go', 'py', 'ts', 'md'])}")
+        paths.add("/".join(parts))
+    return sorted(paths)
+
+
+def legacy_build(all_files: List[str], path: str, max_depth: int) -> Dict[int, Set[str]]:
+    """The original ZoektContentFetcher._build_directory_structure."""
+    base_len = len(f"{path}/") if path != "." else 0
+    dirs_at_depth = {}
+    for f in all_files:
+        rel_path = f[base_len:] if base_len > 0 else f
+        parts = rel_path.split("/")
+        for depth in range(min(len(parts) - 1, max_depth)):
+            dir_path = "/".join(parts[: depth + 1])
+            if depth not in dirs_at_depth:
+                dirs_at_depth[depth] = set()
+            dirs_at_depth[depth].add(dir_path)
+        if len(parts) - 1 < max_depth:
+            file_depth = len(parts) - 1
+            if file_depth not in dirs_at_depth:
+                dirs_at_depth[file_depth] = set()
+            dirs_at_depth[file_depth].add(rel_path)
+    return dirs_at_depth
+
+
+def legacy_format(dirs_at_depth: Dict[int, Set[str]], max_depth: int) -> str:
+    """The original ZoektContentFetcher._format_tree_structure."""
+    output_lines = []
+    printed_paths = set()
+
+    def format_item(item_path: str, depth: int, is_file: bool) -> str:
+        indent = "  " * depth
+        name = item_path.split("/")[-1]
+        if not is_file and depth < max_depth:
+            name += "/"
+        return f"{indent}{name}"
+
+    all_paths = []
+    for depth in range(max_depth + 1):
+        if depth in dirs_at_depth:
+            for item in sorted(dirs_at_depth[depth]):
+                parts = item.split("/")
+                is_file = len(parts) - 1 < max_depth and "." in parts[-1]
+                all_paths.append((item, len(parts) - 1, is_file))
+
+    all_paths.sort(key=lambda x: x[0])
+    for item_path, depth, is_file in all_paths:
+        if item_path not in printed_paths:
+            printed_paths.add(item_path)
+            parts = item_path.split("/")
+            if depth > 0:
+                parent_path = "/".join(parts[:-1])
+                if parent_path not in printed_paths and parent_path:
+                    parent_parts = parent_path.split("/")
+                    for i in range(1, len(parent_parts) + 1):
+                        sub_parent = "/".join(parent_parts[:i])
+                        if sub_parent not in printed_paths:
+                            printed_paths.add(sub_parent)
+                            output_lines.append(format_item(sub_parent, i - 1, False))
+            output_lines.append(format_item(item_path, depth, is_file))
+    return "\n".join(output_lines)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--depth", type=int, default=2)
+    args = parser.parse_args()
+
+    print(f"depth={args.depth}")
+    print(
+        f"{'paths':>10}{'legacy ms':>12}{'tree ms':>12}{'sorted ms':>12}{'budgeted ms':>13}"
+        f"{'legacy lines':>14}{'budget lines':>14}"
+    )
+    for size in args.sizes:
+        paths = make_paths(size)
+
+        legacy, legacy_time = timed(lambda: legacy_format(legacy_build(paths, ".", args.depth), args.depth))
+        unbounded, tree_time = timed(
+            lambda: PathTree.from_paths(paths, max_depth=args.depth).render(
+                args.depth, max_entries=None, max_dir_entries=None
+            )
+        )
+        skipping, sorted_time = timed(
+            lambda: PathTree.from_sorted_paths(paths, max_depth=args.depth).render(
+                args.depth, max_entries=None, max_dir_entries=None
+            )
+        )
+        budgeted, budget_time = timed(
+            lambda: PathTree.from_sorted_paths(paths, max_depth=args.depth).render(args.depth)
+        )
+
+        assert unbounded == skipping, "sorted and unsorted builds disagree"
+        assert unbounded.count("\n") == legacy.count("\n"), "renderers disagree on the number of entries"
+        print(
+            f"{size:>10,}{legacy_time * 1000:>12.1f}{tree_time * 1000:>12.1f}{sorted_time * 1000:>12.1f}"
+            f"{budget_time * 1000:>13.1f}{legacy.count(chr(10)) + 1:>14,}{budgeted.count(chr(10)) + 1:>14,}"
+        )
+
+
+if __name__ == "__main__":
+    main()
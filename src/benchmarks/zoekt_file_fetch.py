@@ -0,0 +1,130 @@
+"""Compare Zoekt whole-file fetching through the JSON API against /print scraping.
+
+Usage (from the ``src`` directory):
+    python -m benchmarks.zoekt_file_fetch [--size-mb 5] [--repeat 5]
+"""
+
+import argparse
+import base64
+import gzip
+import html
+import json
+import re
+import time
+from typing import Callable, List, Optional
+
+from backends.zoekt.fetcher import ZoektContentFetcher
+
+REPO = "github.com/example/project"
+PATH = "src/generated/big_module.py"
+
+
+def make_file(size_bytes: int) -> str:
+    """Build a synthetic source file with markup-sensitive characters."""
+    lines = []
+    total = 0
+    i = 0
+    while total < size_bytes:
+        line = f'    if value_{i} < limit && name != "<{i}>": items.append(Item(id={i}, tag="a&b"))  # entry {i}'
+        lines.append(line)
+        total += len(line) + 1
+        i += 1
+    return "\n".join(lines)
+
+
+def render_print_page(content: str) -> str:
+    """Render content the way Zoekt's /print template does."""
+    out = ["<html><head><title>print</title></head><body><div class='container-fluid'>"]
+    for n, line in enumerate(content.split("\n"), start=1):
+        out.append(
+            f'<pre id="l{n}" class="inline-pre"><span class="noselect"><a href="#l{n}">{n}</a>: </span>'
+            f"{html.escape(line, quote=False)}</pre>"
+        )
+    out.append("</div></body></html>")
+    return "\n".join(out)
+
+
+def render_json_payload(content: str) -> bytes:
+    """Render the /api/search response for a whole-file query."""
+    file_match = {
+        "FileName": PATH,
+        "Repository": REPO,
+        "Language": "Python",
+        "Content": base64.b64encode(content.encode()).decode(),
+        "LineMatches": None,
+    }
+    return json.dumps({"Result": {"Files": [file_match], "RepoURLs": {}}}).encode()
+
+
+def legacy_parse(html_content: str) -> Optional[str]:
+    """The original /print scraper: three uncompiled regexes and unescape per line."""
+    lines = []
+    pre_pattern = r'<pre[^>]*class="inline-pre"[^>]*>(.*?)</pre>'
+    for match in re.finditer(pre_pattern, html_content, re.DOTALL):
+        line_content = match.group(1)
+        line_content = re.sub(r'<span[^>]*class="noselect"[^>]*>.*?</span>', "", line_content)
+        line_content = re.sub(r"<[^>]+>", "", line_content)
+        line_content = html.unescape(line_content)
+        lines.append(line_content)
+    return "\n".join(lines) if lines else None
+
+
+def best_of(repeat: int, func: Callable[[], object]) -> float:
+    timings: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=5.0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    content = make_file(int(args.size_mb * 1024 * 1024))
+    page = render_print_page(content)
+    page_bytes = page.encode()
+    payload = render_json_payload(content)
+
+    fetcher = ZoektContentFetcher("http://zoekt.invalid")
+
+    class _Response:
+        status_code = 200
+
+        def json(self):
+            return json.loads(payload)
+
+    # Sanity check: every path reconstructs the same file (the fetcher output is cut at MAX_FILE_SIZE)
+    assert legacy_parse(page) == content
+    assert fetcher._parse_print_page(page) == fetcher._decode_file_response(_Response(), REPO, PATH)[1]
+
+    # Time full decoding, without the MAX_FILE_SIZE cut, so the paths are compared like-for-like
+    def json_decode() -> str:
+        data = json.loads(payload)
+        return base64.b64decode(data["Result"]["Files"][0]["Content"]).decode()
+
+    legacy_time = best_of(args.repeat, lambda: legacy_parse(page))
+    fallback_time = best_of(args.repeat, lambda: fetcher._parse_print_page(page))
+    json_time = best_of(args.repeat, json_decode)
+
+    print(f"file size:             {len(content.encode()):>12,} bytes ({content.count(chr(10)) + 1:,} lines)")
+    print()
+    print(f"{'path':<28}{'wire bytes':>14}{'gzip bytes':>14}{'parse ms':>12}")
+    print(
+        f"{'/print + legacy regexes':<28}{len(page_bytes):>14,}{len(gzip.compress(page_bytes)):>14,}"
+        f"{legacy_time * 1000:>12.1f}"
+    )
+    print(
+        f"{'/print + precompiled parser':<28}{len(page_bytes):>14,}{len(gzip.compress(page_bytes)):>14,}"
+        f"{fallback_time * 1000:>12.1f}"
+    )
+    print(
+        f"{'/api/search Whole=true':<28}{len(payload):>14,}{len(gzip.compress(payload)):>14,}{json_time * 1000:>12.1f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
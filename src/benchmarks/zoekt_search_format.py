@@ -0,0 +1,116 @@
+"""Compare whole-body decoding of a large Zoekt search response with the budgeted streaming path.
+
+The response mimics a query that hits generated or minified files: a few hundred
+files with long chunk matches. The baseline decodes the body with ``json.loads``
+and formats every match; the streaming path feeds the body in 64 KiB chunks to the
+incremental decoder and formats within ``max_output_length``.
+
+Usage (from the ``src`` directory):
+    python -m benchmarks.zoekt_search_format [--files 400] [--chunk-kb 32] [--num 1000] [--repeat 3]
+"""
+
+import argparse
+import base64
+import json
+import time
+import tracemalloc
+from typing import Callable, Tuple
+
+from backends.zoekt.client import STREAM_CHUNK_SIZE, Client
+
+REPO = "github.com/example/project"
+
+
+def render_payload(files: int, chunk_bytes: int) -> bytes:
+    """Render an /api/search response with ``files`` files of three long chunk matches each."""
+    line = "var a=function(b){return b&&b.c?b.d(e,f):g.h(i)};" * 4
+    chunk = "\n".join([line] * max(chunk_bytes // (len(line) + 1), 1))
+    content = base64.b64encode(chunk.encode()).decode()
+    num_lines = chunk.count("\n") + 1
+    file_matches = [
+        {
+            "FileName": f"dist/bundle_{i}.min.js",
+            "Repository": REPO,
+            "Version": "0123456789abcdef",
+            "Score": 100.0 - i / files,
+            "ChunkMatches": [
+                {
+                    "Content": content,
+                    "ContentStart": {"ByteOffset": 0, "LineNumber": 1 + k * num_lines, "Column": 1},
+                    "Ranges": [
+                        {
+                            "Start": {"ByteOffset": 0, "LineNumber": 1 + k * num_lines + num_lines // 2, "Column": 1},
+                            "End": {"ByteOffset": 9, "LineNumber": 1 + k * num_lines + num_lines // 2, "Column": 9},
+                        }
+                    ],
+                }
+                for k in range(3)
+            ],
+        }
+        for i in range(files)
+    ]
+    result = {
+        "Stats": {"FileCount": files, "MatchCount": files * 3},
+        "Files": file_matches,
+        "RepoURLs": {REPO: "https://github.com/example/project/blob/{{.Version}}/{{.Path}}"},
+    }
+    return json.dumps({"Result": result}).encode()
+
+
+def unbounded_format(client: Client, payload: bytes, num: int) -> int:
+    """Baseline: decode the whole body and format every match without a budget."""
+    client.max_output_length = 1 << 62
+    results = json.loads(payload)
+    return len(json.dumps([[r.filename, [m.text for m in r.matches]] for r in client.format_results(results, num)]))
+
+
+def streaming_format(client: Client, payload: bytes, num: int, max_output_length: int) -> int:
+    client.max_output_length = max_output_length
+    stream = client._files_stream(num)
+    for offset in range(0, len(payload), STREAM_CHUNK_SIZE):
+        stream.feed(payload[offset : offset + STREAM_CHUNK_SIZE])
+    results = client._stream_result(stream)
+    return len(json.dumps([[r.filename, [m.text for m in r.matches]] for r in client.format_results(results, num)]))
+
+
+def measure(repeat: int, func: Callable[[], int]) -> Tuple[float, int, int]:
+    """Return best wall time, peak traced memory and output size."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    size = func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=400)
+    parser.add_argument("--chunk-kb", type=int, default=32)
+    parser.add_argument("--num", type=int, default=1000)
+    parser.add_argument("--max-output-length", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    payload = render_payload(args.files, args.chunk_kb * 1024)
+    client = Client("http://zoekt.invalid")
+
+    baseline = measure(args.repeat, lambda: unbounded_format(client, payload, args.num))
+    streaming = measure(args.repeat, lambda: streaming_format(client, payload, args.num, args.max_output_length))
+
+    print(f"response size: {len(payload):,} bytes ({args.files} files)")
+    print()
+    print(f"{'path':<34}{'ms':>10}{'peak MiB':>12}{'output bytes':>16}")
+    for name, (seconds, peak, size) in (
+        ("json.loads + unbounded format", baseline),
+        ("streaming decode + budget", streaming),
+    ):
+        print(f"{name:<34}{seconds * 1000:>10.1f}{peak / 2**20:>12.1f}{size:>16,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,17 @@
 from .limiters import TokenLimiter, ToolCallLimiter
+from .metrics import MetricsRegistry, ToolMetrics
+from .prefork import PreforkSupervisor, bind_socket
 from .prompt_manager import PromptManager
+from .telemetry import TelemetryManager, TelemetrySettings
 
-__all__ = ["PromptManager", "TokenLimiter", "ToolCallLimiter"]
+__all__ = [
+    "MetricsRegistry",
+    "PreforkSupervisor",
+    "PromptManager",
+    "TelemetryManager",
+    "TelemetrySettings",
+    "TokenLimiter",
+    "ToolCallLimiter",
+    "ToolMetrics",
+    "bind_socket",
+]
@@ -0,0 +1,189 @@
+"""Negotiated compression of HTTP responses, including server-sent event streams."""
+
+import zlib
+from typing import Callable, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import zstandard
+except ImportError:  # optional: without it, only gzip is offered
+    zstandard = None
+
+GZIP = "gzip"
+ZSTD = "zstd"
+# Content types worth compressing; everything else (images, archives, ...) passes through
+COMPRESSIBLE_CONTENT_TYPES = ("text/", "application/json", "application/x-ndjson")
+EVENT_STREAM_CONTENT_TYPE = "text/event-stream"
+
+# Called with (encoding, uncompressed bytes, sent bytes) for every compressed body chunk
+CompressionObserver = Callable[[str, int, int], None]
+
+
+def supported_encodings() -> Tuple[str, ...]:
+    """Content encodings this process can produce, in order of preference."""
+    return (ZSTD, GZIP) if zstandard is not None else (GZIP,)
+
+
+def negotiate_encoding(accept_encoding: str, encodings: Tuple[str, ...]) -> Optional[str]:
+    """Pick the encoding of ``encodings`` the client accepts with the highest weight, preferring earlier ones."""
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        weight = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name.strip().lower()] = weight
+    wildcard = weights.get("*", 0.0)
+    accepted = [(weights.get(encoding, wildcard), -rank, encoding) for rank, encoding in enumerate(encodings)]
+    weight, _, encoding = max(accepted)
+    return encoding if weight > 0 else None
+
+
+class _Compressor:
+    """Streaming compressor whose output can be flushed after every chunk."""
+
+    def __init__(self, encoding: str, level: int):
+        self.encoding = encoding
+        if encoding == ZSTD:
+            # Levels above zstd's fast range cost a lot of CPU for little gain on text
+            self._compressor = zstandard.ZstdCompressor(level=min(level, 9)).compressobj()
+            self._flush_block = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        else:
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self._flush_block = zlib.Z_SYNC_FLUSH
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        """Compress ``data``; when ``flush`` is set, everything given so far can be decoded from the output."""
+        output = self._compressor.compress(data)
+        return output + self._compressor.flush(self._flush_block) if flush else output
+
+    def finish(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+class CompressionMiddleware:
+    """Compresses responses with the best encoding the client accepts.
+
+    Responses are compressed once their body reaches ``minimum_size`` bytes; small
+    responses are sent as they are, since compressing them costs more than it saves.
+    Event streams, which carry the tool results of MCP sessions, are compressed as
+    one stream and flushed after every event, so events are never held back and
+    later events reuse the window of earlier ones. zstd is offered when the optional
+    ``zstandard`` package is installed, gzip otherwise.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1024,
+        level: int = 6,
+        encodings: Optional[Tuple[str, ...]] = None,
+        observer: Optional[CompressionObserver] = None,
+    ):
+        """Initialize the middleware.
+
+        Args:
+            app: Application whose responses are compressed
+            minimum_size: Body size in bytes from which responses are compressed
+            level: Compression level, from 1 (fastest) to 9 (smallest)
+            encodings: Encodings to offer, in order of preference; defaults to all supported ones
+            observer: Called for every compressed chunk, e.g. to export the compression ratio
+        """
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+        self.encodings = tuple(
+            encoding for encoding in encodings or supported_encodings() if encoding in supported_encodings()
+        )
+        self.observer = observer
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.encodings:
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("Accept-Encoding", ""), self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await _CompressedResponse(self, encoding, send).run(scope, receive)
+
+
+class _CompressedResponse:
+    """Send wrapper of one response that decides from its headers and first body chunk whether to compress it."""
+
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send: Send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.send = send
+        # Start message held back until the first body chunk tells whether to compress
+        self.start: Optional[Message] = None
+        self.compressor: Optional[_Compressor] = None
+        self.passthrough = False
+
+    async def run(self, scope: Scope, receive: Receive) -> None:
+        await self.middleware.app(scope, receive, self.send_message)
+
+    async def send_message(self, message: Message) -> None:
+        if self.passthrough:
+            await self.send(message)
+        elif message["type"] == "http.response.start":
+            await self._start(message)
+        elif message["type"] == "http.response.body":
+            await self._body(message)
+        else:
+            # Anything else (e.g. a file sent by path) is not ours to compress
+            await self._pass_through()
+            await self.send(message)
+
+    async def _start(self, message: Message) -> None:
+        headers = Headers(raw=message["headers"])
+        content_type = headers.get("Content-Type", "")
+        self.start = message
+        if "Content-Encoding" in headers or not content_type.startswith(COMPRESSIBLE_CONTENT_TYPES):
+            await self._pass_through()
+        elif content_type.startswith(EVENT_STREAM_CONTENT_TYPE):
+            # The headers of an event stream must go out before its first event
+            await self._start_compression()
+
+    async def _body(self, message: Message) -> None:
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.compressor is None:
+            if not more_body and len(body) < self.middleware.minimum_size:
+                # The whole body is known and too small to be worth it
+                await self._pass_through()
+                await self.send(message)
+                return
+            await self._start_compression()
+
+        if more_body:
+            # Flushed so that events and other partial bodies reach the client right away
+            compressed = self.compressor.compress(body, flush=True)
+        else:
+            compressed = self.compressor.finish(body)
+        if self.middleware.observer is not None:
+            self.middleware.observer(self.encoding, len(body), len(compressed))
+        await self.send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+
+    async def _pass_through(self) -> None:
+        self.passthrough = True
+        if self.start is not None:
+            start, self.start = self.start, None
+            await self.send(start)
+
+    async def _start_compression(self) -> None:
+        start, self.start = self.start, None
+        headers = MutableHeaders(raw=list(start["headers"]))
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        if "Content-Length" in headers:
+            del headers["Content-Length"]
+        self.compressor = _Compressor(self.encoding, self.middleware.level)
+        await self.send({**start, "headers": headers.raw})
@@ -0,0 +1,168 @@
+"""Pre-fork process supervisor for running a server on several cores."""
+
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Any, Callable, Dict, NamedTuple, NoReturn, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks for exited workers
+SUPERVISE_INTERVAL = 0.2
+
+
+def bind_socket(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    """Bind a listening TCP socket that forked workers inherit and accept from."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class _Worker(NamedTuple):
+    index: int
+    started_at: float
+    # Consecutive exits shortly after start, which delay the next restart
+    failures: int
+
+
+class PreforkSupervisor:
+    """Runs ``target`` in ``workers`` forked processes and keeps them running.
+
+    Sockets bound before :meth:`run` are shared by every worker, so connections are
+    spread across processes by the kernel and a worker's backlog is served by the
+    others while it restarts. Each worker gets a stable index (0 to ``workers - 1``)
+    that survives restarts. A worker that exits is forked again, after an
+    exponentially growing delay when it keeps exiting within ``min_uptime`` seconds.
+
+    On SIGTERM or SIGINT the workers are sent SIGTERM to finish their in-flight
+    requests and killed once ``graceful_timeout`` has passed; a second signal kills
+    them right away.
+    """
+
+    def __init__(
+        self,
+        target: Callable[[int], None],
+        workers: int,
+        graceful_timeout: float = 30.0,
+        min_uptime: float = 5.0,
+        max_backoff: float = 30.0,
+    ):
+        """Initialize the supervisor.
+
+        Args:
+            target: Runs one worker until it is told to stop; receives the worker index
+            workers: Number of worker processes
+            graceful_timeout: Seconds workers get to drain before they are killed
+            min_uptime: Workers exiting sooner count as crashing and are restarted with backoff
+            max_backoff: Longest delay before a crashing worker is restarted
+        """
+        if workers <= 0:
+            raise ValueError("workers must be a positive integer")
+        self.target = target
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        self.min_uptime = min_uptime
+        self.max_backoff = max_backoff
+        self._running: Dict[int, _Worker] = {}
+        # Worker index -> (restart time, failures)
+        self._restarts: Dict[int, Tuple[float, int]] = {}
+        self._stopping = False
+        self._force = False
+
+    def run(self) -> None:
+        """Fork the workers and supervise them until a termination signal; returns once all have exited."""
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+
+        for index in range(self.workers):
+            self._spawn(index, failures=0)
+        while not self._stopping:
+            self._reap()
+            now = time.monotonic()
+            for index, (due, failures) in list(self._restarts.items()):
+                if now >= due:
+                    del self._restarts[index]
+                    self._spawn(index, failures)
+            time.sleep(SUPERVISE_INTERVAL)
+        self._drain()
+
+    def _handle_signal(self, sig: int, frame: Any) -> None:
+        if self._stopping:
+            self._force = True
+            return
+        logger.info(f"Received signal {sig}, draining {len(self._running)} workers...")
+        self._stopping = True
+
+    def _spawn(self, index: int, failures: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            self._run_worker(index)
+        self._running[pid] = _Worker(index, time.monotonic(), failures)
+        logger.info(f"Started worker {index} (pid {pid})")
+
+    def _run_worker(self, index: int) -> NoReturn:
+        """Body of a forked worker; never returns."""
+        code = 0
+        try:
+            # The supervisor decides when workers stop; a terminal's CTRL+C reaches it as well
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            self.target(index)
+        except BaseException:
+            logger.exception(f"Worker {index} failed")
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    def _reap(self) -> None:
+        """Collect exited workers and schedule their restart unless the supervisor is stopping."""
+        while self._running:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            worker = self._running.pop(pid, None)
+            if worker is None or self._stopping:
+                continue
+            uptime = time.monotonic() - worker.started_at
+            failures = worker.failures + 1 if uptime < self.min_uptime else 0
+            delay = min(self.max_backoff, 2.0 ** (failures - 1)) if failures else 0.0
+            logger.warning(
+                f"Worker {worker.index} (pid {pid}) exited with code {os.waitstatus_to_exitcode(status)} "
+                f"after {uptime:.1f}s, restarting in {delay:.0f}s"
+            )
+            self._restarts[worker.index] = (time.monotonic() + delay, failures)
+
+    def _drain(self) -> None:
+        self._signal_workers(signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout
+        while self._running and not self._force and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(SUPERVISE_INTERVAL)
+        if self._running:
+            logger.warning(f"Killing {len(self._running)} workers that did not drain in time")
+            self._signal_workers(signal.SIGKILL)
+            for pid in list(self._running):
+                try:
+                    os.waitpid(pid, 0)
+                except ChildProcessError:
+                    pass
+            self._running.clear()
+        logger.info("All workers have exited")
+
+    def _signal_workers(self, sig: int) -> None:
+        for pid in self._running:
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
@@ -0,0 +1,115 @@
+"""OpenTelemetry export to Langfuse shared by the MCP servers."""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, List
+
+from opentelemetry import trace
+from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SimpleSpanProcessor, SpanProcessor
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+logger = logging.getLogger(__name__)
+
+EXPORT_MODES = ("batch", "sync")
+PAYLOAD_MODES = ("truncate", "hash")
+
+
+class TelemetrySettings:
+    """How spans are sampled, exported and how large their payloads may get."""
+
+    def __init__(self) -> None:
+        # "batch" exports from a background thread; "sync" exports every span on the request path
+        self.export_mode = os.getenv("TELEMETRY_EXPORT_MODE", "batch").lower()
+        if self.export_mode not in EXPORT_MODES:
+            raise ValueError(f"Invalid option for TELEMETRY_EXPORT_MODE. Valid options are [{'|'.join(EXPORT_MODES)}]")
+        # Spans beyond a full queue are dropped rather than slowing requests down
+        self.max_queue_size = int(os.getenv("TELEMETRY_MAX_QUEUE_SIZE", "2048"))
+        self.max_export_batch_size = int(os.getenv("TELEMETRY_MAX_EXPORT_BATCH_SIZE", "512"))
+        self.export_delay_ms = int(os.getenv("TELEMETRY_EXPORT_DELAY_MS", "5000"))
+        # Share of traces recorded, decided when the trace starts
+        self.sample_rate = float(os.getenv("TELEMETRY_SAMPLE_RATE", "1.0"))
+        # Input/output payloads longer than this are truncated or replaced by their hash
+        self.max_payload_length = int(os.getenv("TELEMETRY_MAX_PAYLOAD_LENGTH", "4096"))
+        self.payload_mode = os.getenv("TELEMETRY_PAYLOAD_MODE", "truncate").lower()
+        if self.payload_mode not in PAYLOAD_MODES:
+            raise ValueError(
+                f"Invalid option for TELEMETRY_PAYLOAD_MODE. Valid options are [{'|'.join(PAYLOAD_MODES)}]"
+            )
+
+
+class TelemetryManager:
+    """Sets up span export to Langfuse's OTLP endpoint, or a no-op tracer when disabled.
+
+    ``config`` needs ``langfuse_enabled``, the ``langfuse_*`` credentials and ``telemetry``
+    (TelemetrySettings).
+    """
+
+    def __init__(self, config: Any) -> None:
+        self.config = config
+        self.settings: TelemetrySettings = config.telemetry
+        self.enabled = config.langfuse_enabled
+        if self.enabled:
+            self._setup()
+
+    def _setup(self) -> None:
+        langfuse_auth = base64.b64encode(
+            f"{self.config.langfuse_public_key}:{self.config.langfuse_secret_key}".encode()
+        ).decode()
+
+        os.environ["OTEL_EXPORTER_OTLP_HEADERS"] = f"Authorization=Basic {langfuse_auth}"
+        os.environ["OTEL_EXPORTER_OTLP_ENDPOINT"] = f"{self.config.langfuse_host}/api/public/otel"
+
+        provider = TracerProvider(sampler=ParentBased(TraceIdRatioBased(self.settings.sample_rate)))
+        provider.add_span_processor(self._span_processor())
+        trace.set_tracer_provider(provider)
+
+    def _span_processor(self) -> SpanProcessor:
+        if self.settings.export_mode == "sync":
+            return SimpleSpanProcessor(OTLPSpanExporter())
+        return BatchSpanProcessor(
+            OTLPSpanExporter(),
+            max_queue_size=self.settings.max_queue_size,
+            max_export_batch_size=min(self.settings.max_export_batch_size, self.settings.max_queue_size),
+            schedule_delay_millis=self.settings.export_delay_ms,
+        )
+
+    def get_tracer(self, name: str) -> trace.Tracer:
+        if self.enabled:
+            return trace.get_tracer(name)
+        # Spans of a no-op tracer are never recorded, so attributes are not even computed
+        return trace.get_tracer(name, tracer_provider=trace.NoOpTracerProvider())
+
+    def set_span_attributes(
+        self,
+        span: trace.Span,
+        input_data: Dict[str, Any],
+        output_data: Dict[str, Any],
+        session_id: str,
+        tags: List[str],
+    ) -> None:
+        """Attach the Langfuse session, tags and (size-limited) input and output to a span."""
+        if not span.is_recording():
+            return
+        try:
+            span.set_attribute("langfuse.session.id", session_id)
+            span.set_attribute("langfuse.tags", tags)
+            span.set_attribute("input", self.payload(input_data))
+            span.set_attribute("output", self.payload(output_data))
+        except Exception as exc:
+            logger.error(f"Error setting span attributes: {exc}")
+
+    def payload(self, data: Any) -> str:
+        """Serialize a span payload, truncating or hashing it above the configured length."""
+        text = json.dumps(data)
+        limit = self.settings.max_payload_length
+        if len(text) <= limit:
+            return text
+        if self.settings.payload_mode == "hash":
+            digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+            return json.dumps({"sha256": digest, "length": len(text)})
+        return f"{text[:limit]}... [truncated {len(text) - limit} characters]"
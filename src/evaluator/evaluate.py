@@ -113,7 +113,7 @@ async def run_experiment(experiment_name: str) -> float:
         file_lock = asyncio.Lock()
 
         async def worker(worker_id: int):
-            async with CodeSnippetFinder() as agent:
+            async with CodeSnippetFinder(priority="batch") as agent:
                 while True:
                     try:
                         item = await asyncio.wait_for(work_queue.get(), timeout=1.0)
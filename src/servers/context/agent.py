@@ -1,7 +1,7 @@
 import os
 import pathlib
 import uuid
-from typing import List
+from typing import List, Optional
 
 from dotenv import load_dotenv
 from pydantic import BaseModel, Field
@@ -11,6 +11,7 @@ from pydantic_ai.models import Model
 from pydantic_ai.models.openai import OpenAIModel, OpenAIModelSettings
 from pydantic_ai.providers.openai import OpenAIProvider
 from pydantic_ai.settings import ModelSettings
+from pydantic_ai.usage import Usage
 
 from core import PromptManager
 from core.limiters import TokenLimiter, ToolCallLimiter
@@ -24,7 +25,9 @@ class QueryReformaterResult(BaseModel):
 
 
 class QueryReformater:
-    def __init__(self, trace_id: str = None, max_tool_calls: int = None, max_tokens: int = None) -> None:
+    def __init__(
+        self, trace_id: str = None, max_tool_calls: int = None, max_tokens: int = None, priority: str = None
+    ) -> None:
         self.config = AgentConfig()
         prompt_file_path = pathlib.Path(__file__).parent.parent.parent / "prompts" / "prompts.yaml"
 
@@ -33,6 +36,9 @@ class QueryReformater:
             section_path="agents.query_reformater",
         )
         self._mcp_context = None
+        # Token usage and tool calls of the last run
+        self.usage: Optional[Usage] = None
+        self.tool_calls = 0
 
         # Use provided values or fall back to config defaults
         max_tool_calls = max_tool_calls or self.config.default_max_tool_calls
@@ -47,6 +53,11 @@ class QueryReformater:
             trace_id = str(uuid.uuid4())
 
         headers = {"X-TRACE-ID": trace_id}
+        if priority:
+            # Admission priority class of the search server's backend calls, e.g. "batch" for evaluations
+            headers["X-REQUEST-PRIORITY"] = priority
+        if self.config.search_result_encoding:
+            headers["X-RESULT-ENCODING"] = self.config.search_result_encoding
 
         model, model_settings = self._llm_model
 
@@ -94,6 +105,8 @@ class QueryReformater:
         result = await self._token_limiter.run_with_limit(
             self._agent, self._prompt_manager.render_prompt("user_prompt", question=question)
         )
+        self.usage = result.usage()
+        self.tool_calls = self._tool_limiter.call_count
         return result.output
 
     @property
@@ -122,7 +135,9 @@ class QueryReformater:
 
 
 class CodeSnippetFinder:
-    def __init__(self, trace_id: str = None, max_tool_calls: int = None, max_tokens: int = None) -> None:
+    def __init__(
+        self, trace_id: str = None, max_tool_calls: int = None, max_tokens: int = None, priority: str = None
+    ) -> None:
         self.config = AgentConfig()
         prompt_file_path = pathlib.Path(__file__).parent.parent.parent / "prompts" / "prompts.yaml"
         self._prompt_manager = PromptManager(
@@ -130,6 +145,9 @@ class CodeSnippetFinder:
             section_path="agents.code_snippet_finder",
         )
         self._mcp_context = None
+        # Token usage and tool calls of the last run
+        self.usage: Optional[Usage] = None
+        self.tool_calls = 0
 
         # Use provided values or fall back to config defaults
         max_tool_calls = max_tool_calls or self.config.default_max_tool_calls
@@ -144,6 +162,11 @@ class CodeSnippetFinder:
             trace_id = str(uuid.uuid4())
 
         headers = {"X-TRACE-ID": trace_id}
+        if priority:
+            # Admission priority class of the search server's backend calls, e.g. "batch" for evaluations
+            headers["X-REQUEST-PRIORITY"] = priority
+        if self.config.search_result_encoding:
+            headers["X-RESULT-ENCODING"] = self.config.search_result_encoding
 
         model, model_settings = self._llm_model
 
@@ -191,6 +214,8 @@ class CodeSnippetFinder:
         result = await self._token_limiter.run_with_limit(
             self._agent, self._prompt_manager.render_prompt("user_prompt", question=question)
         )
+        self.usage = result.usage()
+        self.tool_calls = self._tool_limiter.call_count
         return result.output
 
     @property
@@ -19,6 +19,8 @@ class AgentConfig:
 
         # MCP server configuration
         self.mcp_server_url = os.getenv("MCP_SERVER_URL")
+        # Encoding of search results the agents ask for (json or compact); empty leaves it to the search server
+        self.search_result_encoding = os.getenv("SEARCH_RESULT_ENCODING", "")
 
         # Default limits
         self.default_max_tool_calls = int(os.getenv("DEFAULT_MAX_TOOL_CALLS", "50"))
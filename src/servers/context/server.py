@@ -1,23 +1,20 @@
 import asyncio
-import base64
-import json
 import logging
 import os
 import pathlib
 import signal
 import uuid
-from typing import Any, List
+from typing import Any, List, Union
 
 from dotenv import load_dotenv
 from fastmcp import FastMCP
 from fastmcp.server.dependencies import get_http_request
 from opentelemetry import trace
-from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import SimpleSpanProcessor
 from starlette.requests import Request
+from starlette.responses import PlainTextResponse
 
-from core import PromptManager
+from core import MetricsRegistry, PromptManager, TelemetryManager, TelemetrySettings, ToolMetrics
+from core.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
 from servers.context.agent import CodeSnippetFinder, QueryReformater, QueryReformaterResult
 
 logging.basicConfig(level=logging.INFO)
@@ -42,6 +39,7 @@ class ServerConfig:
             self.langfuse_public_key = ""
             self.langfuse_secret_key = ""
             self.langfuse_host = ""
+        self.telemetry = TelemetrySettings()
 
     @staticmethod
     def _get_required_env(key: str) -> str:
@@ -55,33 +53,6 @@ class ServerConfig:
 config = ServerConfig()
 
 
-class TelemetryManager:
-    def __init__(self, cfg: ServerConfig) -> None:
-        self.cfg = cfg
-        self.enabled = cfg.langfuse_enabled
-        if self.enabled:
-            self._setup()
-
-    def _setup(self) -> None:
-        langfuse_auth = base64.b64encode(
-            f"{self.cfg.langfuse_public_key}:{self.cfg.langfuse_secret_key}".encode()
-        ).decode()
-
-        os.environ["OTEL_EXPORTER_OTLP_HEADERS"] = f"Authorization=Basic {langfuse_auth}"
-        os.environ["OTEL_EXPORTER_OTLP_ENDPOINT"] = f"{self.cfg.langfuse_host}/api/public/otel"
-
-        provider = TracerProvider()
-        provider.add_span_processor(SimpleSpanProcessor(OTLPSpanExporter()))
-        trace.set_tracer_provider(provider)
-
-    def get_tracer(self, name: str) -> trace.Tracer:
-        if self.enabled:
-            return trace.get_tracer(name)
-        else:
-            # Return a no-op tracer when disabled
-            return trace.get_tracer(name, tracer_provider=TracerProvider())
-
-
 telemetry = TelemetryManager(config)
 tracer = telemetry.get_tracer("context-provider-mcp")
 
@@ -93,19 +64,30 @@ def _set_span_attributes(
     session_id: str,
 ) -> None:
     """Attach common Langfuse attributes to the current span."""
-    if not telemetry.enabled:
-        return
-    try:
-        span.set_attribute("langfuse.session.id", session_id)
-        span.set_attribute("langfuse.tags", ["context-provider-mcp"])
-        span.set_attribute("input", json.dumps(input_data))
-        span.set_attribute("output", json.dumps(output_data))
-    except Exception as exc:
-        logger.error(f"Error setting span attributes: {exc}")
+    telemetry.set_span_attributes(span, input_data, output_data, session_id, tags=["context-provider-mcp"])
 
 
 server = FastMCP(sse_path="/contextprovider/sse", message_path="/contextprovider/messages/")
 
+metrics = MetricsRegistry()
+tool_metrics = ToolMetrics(metrics, "contextprovider")
+agent_tokens = metrics.counter("contextprovider_agent_tokens_total", "LLM tokens used by agents", ["agent", "kind"])
+agent_tool_calls = metrics.counter("contextprovider_agent_tool_calls_total", "Tool calls made by agents", ["agent"])
+
+
+def _record_agent_usage(name: str, agent: Union[CodeSnippetFinder, QueryReformater]) -> None:
+    if agent.usage is not None:
+        agent_tokens.inc(agent.usage.request_tokens or 0, agent=name, kind="request")
+        agent_tokens.inc(agent.usage.response_tokens or 0, agent=name, kind="response")
+    agent_tool_calls.inc(agent.tool_calls, agent=name)
+
+
+@server.custom_route("/metrics", methods=["GET"])
+async def metrics_endpoint(request: Request) -> PlainTextResponse:
+    """Expose metrics in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+
 _shutdown_requested = False
 
 
@@ -116,6 +98,7 @@ def signal_handler(sig: int, frame: Any) -> None:
     _shutdown_requested = True
 
 
+@tool_metrics.instrument
 @tracer.start_as_current_span("ContextProviderMcp:agentic_search")
 async def agentic_search(question: str) -> str:
     if _shutdown_requested:
@@ -124,13 +107,16 @@ async def agentic_search(question: str) -> str:
     try:
         request: Request = get_http_request()
         trace_id = str(request.headers.get("X-TRACE-ID", uuid.uuid4()))
+        priority = request.headers.get("X-REQUEST-PRIORITY")
     except Exception:
         trace_id = str(uuid.uuid4())
+        priority = None
 
     span = trace.get_current_span()
 
-    async with CodeSnippetFinder(trace_id=trace_id) as agent:
+    async with CodeSnippetFinder(trace_id=trace_id, priority=priority) as agent:
         result = await agent.run(question)
+    _record_agent_usage("code_snippet_finder", agent)
 
     _set_span_attributes(
         span,
@@ -141,6 +127,7 @@ async def agentic_search(question: str) -> str:
     return result
 
 
+@tool_metrics.instrument
 @tracer.start_as_current_span("ContextProviderMcp:refactor_question")
 async def refactor_question(question: str) -> List[str]:
     if _shutdown_requested:
@@ -150,13 +137,16 @@ async def refactor_question(question: str) -> List[str]:
     try:
         request: Request = get_http_request()
         trace_id = str(request.headers.get("X-TRACE-ID", uuid.uuid4()))
+        priority = request.headers.get("X-REQUEST-PRIORITY")
     except Exception:
         trace_id = str(uuid.uuid4())
+        priority = None
 
     span = trace.get_current_span()
 
-    async with QueryReformater(trace_id=trace_id) as agent:
+    async with QueryReformater(trace_id=trace_id, priority=priority) as agent:
         result: QueryReformaterResult = await agent.run(question)
+    _record_agent_usage("query_reformater", agent)
 
     _set_span_attributes(
         span,
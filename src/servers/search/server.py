@@ -1,52 +1,185 @@
 import asyncio
-import base64
-import json
+import contextlib
 import logging
 import os
 import pathlib
 import signal
+import socket
+import time
 import uuid
-from typing import Any, Dict, List
+from typing import Any, Awaitable, Callable, Dict, Generator, List, NamedTuple, Optional, Tuple, TypeVar, Union
 
 import requests
+import uvicorn
 from dotenv import load_dotenv
 from fastmcp import FastMCP
 from fastmcp.server.dependencies import get_http_request
 from opentelemetry import trace
-from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
 from starlette.requests import Request
-
-from backends.content_fetcher import AbstractContentFetcher, ContentFetcherFactory
-from backends.models import FormattedResult
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+from starlette.types import ASGIApp
+
+from backends.admission import PRIORITIES, AdmissionController, AdmissionRejected
+from backends.breaker import OPEN, BackendUnavailable, CircuitBreaker, CircuitOpen, is_backend_failure
+from backends.breaker import STATES as BREAKER_STATES
+from backends.budget import FormattedResults
+from backends.compact import COMPACT_ENCODING, RESULT_ENCODINGS, encode_compact
+from backends.content_cache import ContentCache
+from backends.content_fetcher import AbstractContentFetcher, ContentFetcherFactory, fit_batch_output
+from backends.content_store import PersistentContentStore
+from backends.models import ContentRequest, FetchedContent, FormattedResult, Match
 from backends.search import AbstractSearchClient, SearchClientFactory
-from core import PromptManager
+from backends.search_cache import SearchResultCache, normalize_query
+from backends.transport import HTTPTransport, host_key
+from backends.zoekt.federated import parse_shard_urls
+from backends.zoekt.replicas import ReplicaSet, parse_replica_urls
+from backends.zoekt.routing import ShardRouter
+from core import (
+    MetricsRegistry,
+    PreforkSupervisor,
+    PromptManager,
+    TelemetryManager,
+    TelemetrySettings,
+    ToolMetrics,
+    bind_socket,
+)
+from core.compression import CompressionMiddleware
+from core.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from core.metrics import status_class
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+SEARCH_BACKENDS = ("zoekt", "sourcegraph")
+
+T = TypeVar("T")
+
 
 class ServerConfig:
     def __init__(self) -> None:
         self.sse_port = int(os.getenv("MCP_SSE_PORT", "8000"))
         self.streamable_http_port = int(os.getenv("MCP_STREAMABLE_HTTP_PORT", "8080"))
-        self.langfuse_public_key = self._get_required_env("LANGFUSE_PUBLIC_KEY")
-        self.langfuse_secret_key = self._get_required_env("LANGFUSE_SECRET_KEY")
-        self.langfuse_host = self._get_required_env("LANGFUSE_HOST")
+        # Worker processes sharing the listening sockets; 1 serves everything from this process
+        self.workers = int(os.getenv("MCP_WORKERS", "1"))
+        # With several workers, worker n serves its own /metrics on this port plus n
+        self.metrics_port = int(os.getenv("MCP_METRICS_PORT", "9090"))
+        # Seconds in-flight requests get to finish on SIGTERM before workers are killed
+        self.graceful_timeout = float(os.getenv("MCP_GRACEFUL_TIMEOUT", "30"))
+        # Responses of at least the minimum size, and event streams, are compressed for clients that accept it
+        self.response_compression = os.getenv("RESPONSE_COMPRESSION", "true").lower() == "true"
+        self.response_compression_min_size = int(os.getenv("RESPONSE_COMPRESSION_MIN_SIZE", "1024"))
+        self.response_compression_level = int(os.getenv("RESPONSE_COMPRESSION_LEVEL", "6"))
+
+        # Langfuse configuration
+        self.langfuse_enabled = os.getenv("LANGFUSE_ENABLED", "false").lower() == "true"
+        if self.langfuse_enabled:
+            self.langfuse_public_key = self._get_required_env("LANGFUSE_PUBLIC_KEY")
+            self.langfuse_secret_key = self._get_required_env("LANGFUSE_SECRET_KEY")
+            self.langfuse_host = self._get_required_env("LANGFUSE_HOST")
+        else:
+            self.langfuse_public_key = ""
+            self.langfuse_secret_key = ""
+            self.langfuse_host = ""
+        self.telemetry = TelemetrySettings()
+
         self.search_backend = self._get_required_env("SEARCH_BACKEND").lower()
+        if self.search_backend not in SEARCH_BACKENDS:
+            raise ValueError("Invalid option for SEARCH_BACKEND. Valid options are [zoekt|sourcegraph] ")
+        # Optional other backend that takes the traffic while the circuit breaker of the first one is open
+        self.fallback_backend = os.getenv("FALLBACK_SEARCH_BACKEND", "").lower()
+        if self.fallback_backend and (
+            self.fallback_backend not in SEARCH_BACKENDS or self.fallback_backend == self.search_backend
+        ):
+            raise ValueError(
+                "Invalid option for FALLBACK_SEARCH_BACKEND. Valid options are the other of [zoekt|sourcegraph]"
+            )
+
         self.zoekt_api_url = ""
         self.sourcegraph_endpoint = ""
         self.sourcegraph_token = ""
-        if self.search_backend == "zoekt":
+        if "zoekt" in (self.search_backend, self.fallback_backend):
+            # Shards indexing different repositories are separated by ";", replicas of one shard by ","
             self.zoekt_api_url = self._get_required_env("ZOEKT_API_URL")
-        elif self.search_backend == "sourcegraph":
+        if "sourcegraph" in (self.search_backend, self.fallback_backend):
             self.sourcegraph_endpoint = self._get_required_env("SRC_ENDPOINT")
             self.sourcegraph_token = os.getenv("SRC_ACCESS_TOKEN", "")  # it may not always be mandatory
-        else:
-            raise ValueError("Invalid option for SEARCH_BACKEND. Valid options are [zoekt|sourcegraph] ")
+
+        # Zoekt replicas: balancing, hedging after a latency percentile, and ejection of failing replicas
+        self.zoekt_replica_balancer = os.getenv("ZOEKT_REPLICA_BALANCER", "ewma").lower()
+        self.zoekt_hedge_percentile = float(os.getenv("ZOEKT_HEDGE_PERCENTILE", "0.95"))
+        self.zoekt_hedge_min_delay = float(os.getenv("ZOEKT_HEDGE_MIN_DELAY", "0.05"))
+        self.zoekt_hedge_budget = float(os.getenv("ZOEKT_HEDGE_BUDGET", "0.1"))
+        self.zoekt_eject_after = int(os.getenv("ZOEKT_EJECT_AFTER", "3"))
+        self.zoekt_eject_duration = float(os.getenv("ZOEKT_EJECT_DURATION", "10"))
+
+        # Backend HTTP transport configuration
+        self.backend_pool_maxsize = int(os.getenv("BACKEND_POOL_MAXSIZE", "32"))
+        self.backend_connect_timeout = float(os.getenv("BACKEND_CONNECT_TIMEOUT", "3"))
+        self.backend_read_timeout = float(os.getenv("BACKEND_READ_TIMEOUT", "30"))
+        self.backend_max_retries = int(os.getenv("BACKEND_MAX_RETRIES", "2"))
+
+        # Time limit of one search; Zoekt enforces it server-side, Sourcegraph streams are closed at it
+        self.search_timeout = float(os.getenv("SEARCH_TIMEOUT", "10"))
+        # Searches over several Zoekt shards return what arrived by then; leaves room for the shards' own deadline
+        self.zoekt_shard_timeout = float(os.getenv("ZOEKT_SHARD_TIMEOUT", str(self.search_timeout + 2)))
+        # Seconds between refreshes of the repository to shard map used to route scoped queries and fetches
+        self.zoekt_route_refresh_interval = float(os.getenv("ZOEKT_ROUTE_REFRESH_INTERVAL", "60"))
+
+        # Circuit breaker per backend: failed and slow call rates over a window of seconds open it,
+        # and after the open duration successful probe calls close it again
+        self.breaker_window = float(os.getenv("BREAKER_WINDOW", "30"))
+        self.breaker_min_calls = int(os.getenv("BREAKER_MIN_CALLS", "10"))
+        self.breaker_failure_rate = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+        self.breaker_slow_call_duration = float(os.getenv("BREAKER_SLOW_CALL_DURATION", str(self.search_timeout)))
+        self.breaker_slow_call_rate = float(os.getenv("BREAKER_SLOW_CALL_RATE", "0.8"))
+        self.breaker_open_duration = float(os.getenv("BREAKER_OPEN_DURATION", "30"))
+        self.breaker_half_open_calls = int(os.getenv("BREAKER_HALF_OPEN_CALLS", "3"))
+
+        # Search output budget; the token budget is optional and applies on top of the byte budget
+        self.max_output_length = int(os.getenv("SEARCH_MAX_OUTPUT_LENGTH", "100000"))
+        max_output_tokens = os.getenv("SEARCH_MAX_OUTPUT_TOKENS")
+        self.max_output_tokens = int(max_output_tokens) if max_output_tokens else None
+        # Encoding of search results for sessions without a valid X-RESULT-ENCODING header
+        self.search_result_encoding = os.getenv("SEARCH_RESULT_ENCODING", "json").lower()
+        if self.search_result_encoding not in RESULT_ENCODINGS:
+            raise ValueError(
+                f"Invalid option for SEARCH_RESULT_ENCODING. Valid options are [{'|'.join(RESULT_ENCODINGS)}]"
+            )
+
+        # Batch fetches: number of paths per call and combined output size
+        self.fetch_batch_max_items = int(os.getenv("FETCH_BATCH_MAX_ITEMS", "20"))
+        self.fetch_batch_max_output_length = int(os.getenv("FETCH_BATCH_MAX_OUTPUT_LENGTH", "300000"))
+
+        # Fetched contents are cached per commit; refs such as HEAD are re-resolved after the TTL
+        self.content_cache_max_bytes = int(os.getenv("CONTENT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+        self.ref_resolve_ttl = float(os.getenv("REF_RESOLVE_TTL", "30"))
+        # Optional on-disk copy of the content cache, read back after a restart
+        self.content_store_dir = os.getenv("CONTENT_STORE_DIR", "")
+        self.content_store_max_bytes = int(os.getenv("CONTENT_STORE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+        # Admission control of backend calls: concurrent calls, waiting calls and the longest wait per priority class
+        self.admission_max_concurrency = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "16"))
+        self.admission_max_queue = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+        self.admission_max_wait = {
+            "interactive": float(os.getenv("ADMISSION_INTERACTIVE_MAX_WAIT", "5")),
+            "batch": float(os.getenv("ADMISSION_BATCH_MAX_WAIT", "60")),
+        }
+        # Priority class of requests without a valid X-REQUEST-PRIORITY header
+        self.admission_default_priority = os.getenv("ADMISSION_DEFAULT_PRIORITY", "interactive").lower()
+        if self.admission_default_priority not in PRIORITIES:
+            raise ValueError(
+                f"Invalid option for ADMISSION_DEFAULT_PRIORITY. Valid options are [{'|'.join(PRIORITIES)}]"
+            )
+
+        # Formatted search results are shared by identical queries until the TTL or a new index generation
+        self.search_cache_max_bytes = int(os.getenv("SEARCH_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+        self.search_cache_ttl = float(os.getenv("SEARCH_CACHE_TTL", "60"))
+        self.search_cache_generation_interval = float(os.getenv("SEARCH_CACHE_GENERATION_INTERVAL", "10"))
 
     @staticmethod
     def _get_required_env(key: str) -> str:
@@ -57,54 +190,191 @@ class ServerConfig:
         return value
 
 
-class TelemetryManager:
-    def __init__(self, config: ServerConfig) -> None:
-        self.config = config
-        self._setup_telemetry()
+config = ServerConfig()
+telemetry = TelemetryManager(config)
+tracer = telemetry.get_tracer("codesearch-mcp")
 
-    def _setup_telemetry(self) -> None:
-        langfuse_auth = base64.b64encode(
-            f"{self.config.langfuse_public_key}:{self.config.langfuse_secret_key}".encode()
-        ).decode()
+server = FastMCP(sse_path="/codesearch/sse", message_path="/codesearch/messages/")
 
-        os.environ["OTEL_EXPORTER_OTLP_HEADERS"] = f"Authorization=Basic {langfuse_auth}"
-        os.environ["OTEL_EXPORTER_OTLP_ENDPOINT"] = f"{self.config.langfuse_host}/api/public/otel"
+metrics = MetricsRegistry()
+tool_metrics = ToolMetrics(metrics, "codesearch")
+backend_duration = metrics.histogram(
+    "codesearch_backend_request_duration_seconds", "Backend HTTP request latency", ["backend", "status"]
+)
+backend_bytes = metrics.counter("codesearch_backend_response_bytes_total", "Backend HTTP response bytes", ["backend"])
 
-        trace_provider = TracerProvider()
-        trace_provider.add_span_processor(SimpleSpanProcessor(OTLPSpanExporter()))
-        trace.set_tracer_provider(trace_provider)
 
-    @staticmethod
-    def get_tracer(name: str) -> trace.Tracer:
-        return trace.get_tracer(name)
+# Backend of each host the transport talks to, for the backend label of transport metrics
+backend_hosts = {
+    host_key(url): "zoekt" for shard in parse_shard_urls(config.zoekt_api_url) for url in parse_replica_urls(shard)
+}
+if config.sourcegraph_endpoint:
+    backend_hosts[host_key(config.sourcegraph_endpoint)] = "sourcegraph"
 
 
-config = ServerConfig()
-telemetry = TelemetryManager(config)
-tracer = telemetry.get_tracer("codesearch-mcp")
+def _observe_backend(host: str, status: Optional[int], seconds: float, size: int) -> None:
+    backend = backend_hosts.get(host, config.search_backend)
+    backend_duration.observe(seconds, backend=backend, status=status_class(status))
+    backend_bytes.inc(size, backend=backend)
 
-server = FastMCP(sse_path="/codesearch/sse", message_path="/codesearch/messages/")
+
+admission_wait = metrics.histogram(
+    "codesearch_admission_wait_seconds", "Time backend calls waited for admission", ["backend", "priority"]
+)
+admission_rejected = metrics.counter(
+    "codesearch_admission_rejected_total", "Backend calls shed by admission control", ["backend", "priority", "reason"]
+)
+fallback_calls = metrics.counter(
+    "codesearch_fallback_calls_total", "Backend calls answered by a fallback backend", ["backend"]
+)
+response_bytes = metrics.counter(
+    "codesearch_compressed_response_bytes_total",
+    "Body bytes of compressed responses, before and after compression",
+    ["encoding", "stage"],
+)
+
+
+def _observe_compression(encoding: str, uncompressed: int, sent: int) -> None:
+    response_bytes.inc(uncompressed, encoding=encoding, stage="uncompressed")
+    response_bytes.inc(sent, encoding=encoding, stage="sent")
+
+
+def _admission_controller(backend: str) -> AdmissionController:
+    def observe(priority: str, waited: float, rejected: Optional[str]) -> None:
+        if rejected is None:
+            admission_wait.observe(waited, backend=backend, priority=priority)
+        else:
+            admission_rejected.inc(backend=backend, priority=priority, reason=rejected)
+
+    return AdmissionController(
+        backend,
+        max_concurrency=config.admission_max_concurrency,
+        max_queue=config.admission_max_queue,
+        max_wait=config.admission_max_wait,
+        observer=observe,
+    )
+
+
+def _observe_breaker(backend: str, state: str) -> None:
+    log = logger.warning if state == OPEN else logger.info
+    log(f"Circuit breaker of the {backend} backend is {state.replace('_', '-')}")
+
+
+def _circuit_breaker(backend: str) -> CircuitBreaker:
+    return CircuitBreaker(
+        backend,
+        window=config.breaker_window,
+        min_calls=config.breaker_min_calls,
+        failure_rate=config.breaker_failure_rate,
+        slow_call_duration=config.breaker_slow_call_duration,
+        slow_call_rate=config.breaker_slow_call_rate,
+        open_duration=config.breaker_open_duration,
+        half_open_calls=config.breaker_half_open_calls,
+        observer=_observe_breaker,
+    )
+
+
+admission = _admission_controller(config.search_backend)
+
+transport = HTTPTransport(
+    pool_maxsize=config.backend_pool_maxsize,
+    connect_timeout=config.backend_connect_timeout,
+    read_timeout=config.backend_read_timeout,
+    max_retries=config.backend_max_retries,
+    observer=_observe_backend,
+)
+
+# One replica set per Zoekt shard, shared by the search client and the content fetcher
+zoekt_shards: List[ReplicaSet] = [
+    ReplicaSet(
+        shard_urls,
+        transport,
+        balancer=config.zoekt_replica_balancer,
+        hedge_percentile=config.zoekt_hedge_percentile,
+        hedge_min_delay=config.zoekt_hedge_min_delay,
+        hedge_budget=config.zoekt_hedge_budget,
+        eject_after=config.zoekt_eject_after,
+        eject_duration=config.zoekt_eject_duration,
+    )
+    for shard_urls in parse_shard_urls(config.zoekt_api_url)
+]
+# Built once so that the search client and the content fetcher share one repository map
+zoekt_router = (
+    ShardRouter(zoekt_shards, refresh_interval=config.zoekt_route_refresh_interval) if len(zoekt_shards) > 1 else None
+)
 
 search_client_kwargs = {
     "base_url": config.zoekt_api_url,
     "endpoint": config.sourcegraph_endpoint,
     "token": config.sourcegraph_token,
+    "transport": transport,
+    "shards": zoekt_shards,
+    "router": zoekt_router,
+    "shard_timeout": config.zoekt_shard_timeout,
+    "search_timeout": config.search_timeout,
+    "max_output_length": config.max_output_length,
+    "max_output_tokens": config.max_output_tokens,
 }
 search_client: AbstractSearchClient = SearchClientFactory.create_client(
     backend=config.search_backend, **search_client_kwargs
 )
 logger.info(f"Using {config.search_backend} search backend")
 
+search_cache = SearchResultCache(
+    max_bytes=config.search_cache_max_bytes,
+    ttl=config.search_cache_ttl,
+    generation=search_client.aindex_generation,
+    generation_interval=config.search_cache_generation_interval,
+)
+
+# The persistent store is attached by _open_content_store once the serving process is known
+content_cache = ContentCache(max_bytes=config.content_cache_max_bytes, ref_ttl=config.ref_resolve_ttl)
+
 content_fetcher_kwargs = {
     "zoekt_url": config.zoekt_api_url,
     "endpoint": config.sourcegraph_endpoint,
     "token": config.sourcegraph_token,
+    "transport": transport,
+    "shards": zoekt_shards,
+    "router": zoekt_router,
+    "content_cache": content_cache,
 }
 content_fetcher: AbstractContentFetcher = ContentFetcherFactory.create_fetcher(
     backend=config.search_backend, **content_fetcher_kwargs
 )
 logger.info(f"Using {config.search_backend} content fetcher backend")
 
+
+class _Backend(NamedTuple):
+    name: str
+    search_client: AbstractSearchClient
+    content_fetcher: AbstractContentFetcher
+    admission: AdmissionController
+    breaker: CircuitBreaker
+
+
+# Tried in order: the fallback backend serves calls while the breaker of the primary one is open or its call failed
+backends = [
+    _Backend(config.search_backend, search_client, content_fetcher, admission, _circuit_breaker(config.search_backend))
+]
+# Cached contents and ref resolutions are backend-specific (e.g. Zoekt resolves refs to index generations), so the
+# fallback backend has a cache of its own; it only serves during outages, so it is kept in memory only
+fallback_content_cache: Optional[ContentCache] = None
+if config.fallback_backend:
+    fallback_content_cache = ContentCache(max_bytes=config.content_cache_max_bytes, ref_ttl=config.ref_resolve_ttl)
+    backends.append(
+        _Backend(
+            config.fallback_backend,
+            SearchClientFactory.create_client(backend=config.fallback_backend, **search_client_kwargs),
+            ContentFetcherFactory.create_fetcher(
+                backend=config.fallback_backend, **{**content_fetcher_kwargs, "content_cache": fallback_content_cache}
+            ),
+            _admission_controller(config.fallback_backend),
+            _circuit_breaker(config.fallback_backend),
+        )
+    )
+    logger.info(f"Falling back to the {config.fallback_backend} backend while {config.search_backend} is unavailable")
+
 prompt_manager = PromptManager(file_path=pathlib.Path(__file__).parent.parent.parent / "prompts" / "prompts.yaml")
 
 # Load backend-specific prompts
@@ -112,6 +382,7 @@ CODESEARCH_GUIDE = prompt_manager._load_prompt(f"guides.codesearch_guide.{config
 SEARCH_TOOL_DESCRIPTION = prompt_manager._load_prompt(f"tools.search.{config.search_backend}")
 SEARCH_PROMPT_GUIDE_DESCRIPTION = prompt_manager._load_prompt(f"tools.search_prompt_guide.{config.search_backend}")
 FETCH_CONTENT_DESCRIPTION = prompt_manager._load_prompt("tools.fetch_content")
+FETCH_CONTENTS_DESCRIPTION = prompt_manager._load_prompt("tools.fetch_contents")
 
 # Load organization-specific guide (may be empty/placeholder)
 try:
@@ -135,43 +406,112 @@ def _set_span_attributes(
     output_data: Dict[str, Any],
     session_id: str,
 ) -> None:
-    try:
-        span.set_attribute("langfuse.session.id", session_id)
-        span.set_attribute("langfuse.tags", ["codesearch-mcp"])
-        span.set_attribute("input", json.dumps(input_data))
-        span.set_attribute("output", json.dumps(output_data))
-    except Exception as exc:
-        logger.error(f"Error setting span attributes: {exc}")
+    telemetry.set_span_attributes(span, input_data, output_data, session_id, tags=["codesearch-mcp"])
+
 
+def _request_priority(request: Request) -> str:
+    priority = request.headers.get("X-REQUEST-PRIORITY", "").lower()
+    return priority if priority in PRIORITIES else config.admission_default_priority
 
+
+def _result_encoding(request: Request) -> str:
+    encoding = request.headers.get("X-RESULT-ENCODING", "").lower()
+    return encoding if encoding in RESULT_ENCODINGS else config.search_result_encoding
+
+
+@tool_metrics.instrument
 @tracer.start_as_current_span("CodeSearchMcp:fetch_content")
-def fetch_content(repo: str, path: str) -> str:
+async def fetch_content(
+    repo: str, path: str, ref: str = "HEAD", start_line: Optional[int] = None, end_line: Optional[int] = None
+) -> str:
     if _shutdown_requested:
         logger.info("Shutdown in progress, declining new requests")
         return ""
+    if (start_line is not None and start_line < 1) or (end_line is not None and end_line < (start_line or 1)):
+        return "invalid arguments start_line must be at least 1 and end_line at least start_line"
 
     span = trace.get_current_span()
     request: Request = get_http_request()
     trace_id = str(request.headers.get("X-TRACE-ID", uuid.uuid4()))
 
     try:
-        result = content_fetcher.get_content(repo, path)
-
-        input_data = {"repo": repo, "path": path}
+        _, result = await _call_backend(
+            _request_priority(request),
+            lambda backend: backend.content_fetcher.aget_content(
+                repo, path, ref=ref, start_line=start_line, end_line=end_line
+            ),
+        )
+
+        input_data = {"repo": repo, "path": path, "ref": ref, "start_line": start_line, "end_line": end_line}
         output_data = {"output": result}
         _set_span_attributes(span, input_data, output_data, trace_id)
 
         return result
+    except (AdmissionRejected, CircuitOpen) as e:
+        logger.warning(f"Shed fetch of {repo}/{path}: {e}")
+        return str(e)
+    except BackendUnavailable as e:
+        logger.error(f"Error fetching content from {repo}: {e}")
+        tool_metrics.error("fetch_content")
+        return str(e)
     except ValueError as e:
         logger.warning(f"Error fetching content from {repo}: {str(e)}")
         return "invalid arguments the given path or repository does not exist"
     except Exception as e:
         logger.error(f"Unexpected error fetching content: {e}")
+        tool_metrics.error("fetch_content")
         return "error fetching content"
 
 
+@tool_metrics.instrument
+@tracer.start_as_current_span("CodeSearchMcp:fetch_contents")
+async def fetch_contents(items: List[ContentRequest], ref: str = "HEAD") -> List[FetchedContent]:
+    if _shutdown_requested:
+        logger.info("Shutdown in progress, declining new requests")
+        return []
+
+    span = trace.get_current_span()
+    request: Request = get_http_request()
+    trace_id = str(request.headers.get("X-TRACE-ID", uuid.uuid4()))
+
+    batch = items[: config.fetch_batch_max_items]
+    try:
+        paths = [(item.repo, item.path) for item in batch]
+        _, contents = await _call_backend(
+            _request_priority(request), lambda backend: backend.content_fetcher.aget_contents(paths, ref=ref)
+        )
+        contents = fit_batch_output(contents, config.fetch_batch_max_output_length)
+    except (AdmissionRejected, CircuitOpen) as e:
+        logger.warning(f"Shed fetch of a batch of {len(batch)} paths: {e}")
+        contents = [str(e)] * len(batch)
+    except BackendUnavailable as e:
+        logger.error(f"Error fetching a batch of {len(batch)} paths: {e}")
+        tool_metrics.error("fetch_contents")
+        contents = [str(e)] * len(batch)
+    except ValueError as e:
+        logger.warning(f"Error fetching a batch of {len(batch)} paths: {str(e)}")
+        contents = ["invalid arguments the given path or repository does not exist"] * len(batch)
+    except Exception as e:
+        logger.error(f"Unexpected error fetching contents: {e}")
+        tool_metrics.error("fetch_contents")
+        contents = ["error fetching content"] * len(batch)
+
+    results = [
+        FetchedContent(repo=item.repo, path=item.path, content=content) for item, content in zip(batch, contents)
+    ]
+    skipped = f"not fetched: at most {config.fetch_batch_max_items} paths are fetched per call"
+    results.extend(FetchedContent(repo=item.repo, path=item.path, content=skipped) for item in items[len(batch) :])
+
+    input_data = {"items": [{"repo": item.repo, "path": item.path} for item in items], "ref": ref}
+    output_data = {"output": [{"repo": r.repo, "path": r.path, "length": len(r.content)} for r in results]}
+    _set_span_attributes(span, input_data, output_data, trace_id)
+
+    return results
+
+
+@tool_metrics.instrument
 @tracer.start_as_current_span("CodeSearchMcp:search")
-def search(query: str) -> List[FormattedResult]:
+async def search(query: str) -> Union[List[FormattedResult], str]:
     if _shutdown_requested:
         logger.info("Shutdown in progress, declining new requests")
         return []
@@ -184,8 +524,11 @@ def search(query: str) -> List[FormattedResult]:
     span = trace.get_current_span()
 
     try:
-        results = search_client.search(query, num_results)
-        formatted_results = search_client.format_results(results, num_results)
+        priority = _request_priority(request)
+        # Only callers of the same priority share a search, since its priority alone decides its admission
+        formatted_results = await search_cache.get_or_search(
+            (normalize_query(query), num_results), lambda: _search_backend(query, num_results, priority), priority
+        )
 
         simplified_results = [
             {
@@ -194,19 +537,98 @@ def search(query: str) -> List[FormattedResult]:
                 "matches": [{"line_number": match.line_number} for match in result.matches],
             }
             for result in formatted_results
+            if result.filename
         ]
 
         input_data = {"query": query}
         output_data = {"results": simplified_results}
         _set_span_attributes(span, input_data, output_data, trace_id)
 
-        return formatted_results
+        return _encode_results(formatted_results, request)
+    except (AdmissionRejected, CircuitOpen) as exc:
+        logger.warning(f"Shed search: {exc}")
+        return _encode_results([_notice(str(exc))], request)
     except requests.exceptions.HTTPError as exc:
         logger.error(f"Search HTTP error: {exc}")
-        return []
+        tool_metrics.error("search")
+        return _encode_results([], request)
     except Exception as exc:
         logger.error(f"Unexpected error during search: {exc}")
-        return []
+        tool_metrics.error("search")
+        return _encode_results([], request)
+
+
+def _encode_results(results: List[FormattedResult], request: Request) -> Union[List[FormattedResult], str]:
+    """Encode search results as the session asked with its X-RESULT-ENCODING header."""
+    if _result_encoding(request) == COMPACT_ENCODING:
+        return encode_compact(results)
+    return results
+
+
+async def _search_backend(query: str, num_results: int, priority: str) -> List[FormattedResult]:
+    backend, results = await _call_backend(priority, lambda backend: backend.search_client.asearch(query, num_results))
+    # Results are formatted by the backend that returned them
+    formatted_results = backend.search_client.format_results(results, num_results)
+    if backend is not backends[0]:
+        # Not cached: only the primary backend's index generation invalidates cached results
+        if not isinstance(formatted_results, FormattedResults):
+            formatted_results = FormattedResults(formatted_results)
+        formatted_results.fallback = True
+    omission_notice = formatted_results.omission_notice() if isinstance(formatted_results, FormattedResults) else None
+    if omission_notice:
+        # Tell the agent that the output was cut short rather than silently dropping results
+        formatted_results.append(_notice(omission_notice))
+    return formatted_results
+
+
+async def _call_backend(priority: str, call: Callable[[_Backend], Awaitable[T]]) -> Tuple[_Backend, T]:
+    """Run ``call`` on the first backend whose circuit breaker lets it through.
+
+    The call moves on to the next backend when it is shed by admission control or
+    fails because the backend is unhealthy; other errors (e.g. a path that does not
+    exist) are raised right away.
+
+    Returns:
+        tuple: The backend that answered and its result
+
+    Raises:
+        CircuitOpen: When the breaker of the first backend is open and no other backend answered
+        AdmissionRejected: When the call was shed and no other backend answered
+    """
+    errors: List[Exception] = []
+    for backend in backends:
+        if not backend.breaker.allow():
+            errors.append(backend.breaker.rejection())
+            continue
+        elapsed: Optional[float] = None
+        try:
+            async with backend.admission.admit(priority):
+                start = time.monotonic()
+                try:
+                    result = await call(backend)
+                finally:
+                    elapsed = time.monotonic() - start
+        except BaseException as exc:
+            failed = isinstance(exc, Exception) and is_backend_failure(exc)
+            if elapsed is None or isinstance(exc, asyncio.CancelledError):
+                backend.breaker.release()
+            else:
+                backend.breaker.record(elapsed, failed=failed)
+            if not failed and not isinstance(exc, AdmissionRejected):
+                raise
+            logger.warning(f"Call to the {backend.name} backend failed: {exc}")
+            errors.append(exc)
+            continue
+        backend.breaker.record(elapsed, failed=False)
+        if backend is not backends[0]:
+            fallback_calls.inc(backend=backend.name)
+        return backend, result
+    raise errors[0]
+
+
+def _notice(text: str) -> FormattedResult:
+    """A result entry carrying a message to the agent instead of a match."""
+    return FormattedResult(filename="", repository="", matches=[Match(line_number=0, text=text)], url="")
 
 
 def search_prompt_guide(objective: str) -> str:
@@ -228,18 +650,213 @@ def search_prompt_guide(objective: str) -> str:
     return "".join(prompt_parts)
 
 
+@server.custom_route("/codesearch/transport-stats", methods=["GET"])
+async def transport_stats(request: Request) -> JSONResponse:
+    """Expose backend connection pool statistics for pool sizing."""
+    return JSONResponse(transport.pool_stats())
+
+
+@server.custom_route("/codesearch/replica-stats", methods=["GET"])
+async def replica_stats(request: Request) -> JSONResponse:
+    """Expose load, latency, hedging and ejection state of the Zoekt replicas, one entry per shard."""
+    return JSONResponse([replicas.stats() for replicas in zoekt_shards])
+
+
+@server.custom_route("/codesearch/route-stats", methods=["GET"])
+async def route_stats(request: Request) -> JSONResponse:
+    """Expose the repositories per Zoekt shard and how many lookups were routed to a subset of the shards."""
+    return JSONResponse(zoekt_router.stats() if zoekt_router is not None else {})
+
+
+@server.custom_route("/codesearch/breaker-stats", methods=["GET"])
+async def breaker_stats(request: Request) -> JSONResponse:
+    """Expose the circuit breaker state and recent call outcomes of each backend, in fallback order."""
+    return JSONResponse({backend.name: backend.breaker.stats() for backend in backends})
+
+
+@server.custom_route("/codesearch/cache-stats", methods=["GET"])
+async def cache_stats(request: Request) -> JSONResponse:
+    """Expose hit, miss and coalesced counters of the search result and content caches."""
+    return JSONResponse(_cache_stats())
+
+
+def _cache_stats() -> Dict[str, Dict[str, int]]:
+    stats = {"search": search_cache.stats(), "content": content_cache.stats()}
+    if fallback_content_cache is not None:
+        stats["fallback_content"] = fallback_content_cache.stats()
+    return stats
+
+
+metrics.callback(
+    "codesearch_cache_hits_total",
+    "Cache hits",
+    lambda: {(name,): stats["hits"] for name, stats in _cache_stats().items()},
+    ["cache"],
+    kind="counter",
+)
+metrics.callback(
+    "codesearch_cache_misses_total",
+    "Cache misses",
+    lambda: {(name,): stats["misses"] for name, stats in _cache_stats().items()},
+    ["cache"],
+    kind="counter",
+)
+metrics.callback(
+    "codesearch_cache_hit_ratio",
+    "Share of cache lookups that were hits",
+    lambda: {
+        (name,): stats["hits"] / max(stats["hits"] + stats["misses"], 1) for name, stats in _cache_stats().items()
+    },
+    ["cache"],
+)
+metrics.callback(
+    "codesearch_search_coalesced_total",
+    "Searches that waited for an identical in-flight search",
+    lambda: {(): search_cache.coalesced},
+    kind="counter",
+)
+metrics.callback(
+    "codesearch_admission_queue_depth",
+    "Backend calls waiting for admission",
+    lambda: {
+        (backend.name, priority): depth
+        for backend in backends
+        for priority, depth in backend.admission.queued().items()
+    },
+    ["backend", "priority"],
+)
+metrics.callback(
+    "codesearch_admission_in_use",
+    "Backend calls admitted and running",
+    lambda: {(backend.name,): backend.admission.in_use() for backend in backends},
+    ["backend"],
+)
+metrics.callback(
+    "codesearch_breaker_state",
+    "Circuit breaker state per backend: 0 closed, 1 open, 2 half-open",
+    lambda: {(backend.name,): BREAKER_STATES.index(backend.breaker.state) for backend in backends},
+    ["backend"],
+)
+metrics.callback(
+    "codesearch_breaker_opened_total",
+    "Times the circuit breaker of a backend opened",
+    lambda: {(backend.name,): backend.breaker.opened for backend in backends},
+    ["backend"],
+    kind="counter",
+)
+
+
+def _requests_in_flight() -> Dict[Tuple[str, ...], float]:
+    in_flight = {(backend.name,): 0.0 for backend in backends}
+    for host, count in transport.in_flight().items():
+        key = (backend_hosts.get(host, config.search_backend),)
+        in_flight[key] = in_flight.get(key, 0.0) + count
+    return in_flight
+
+
+metrics.callback(
+    "codesearch_backend_requests_in_flight",
+    "Backend HTTP requests in flight",
+    _requests_in_flight,
+    ["backend"],
+)
+
+
+def _replica_stats(key: str) -> Dict[Tuple[str, ...], float]:
+    """Per-replica value of ``key`` across the replicas of all Zoekt shards."""
+    return {
+        (url,): float(stats[key]) for replicas in zoekt_shards for url, stats in replicas.stats()["replicas"].items()
+    }
+
+
+if zoekt_shards:
+    metrics.callback(
+        "codesearch_replica_outstanding",
+        "Calls in flight per Zoekt replica",
+        lambda: _replica_stats("outstanding"),
+        ["replica"],
+    )
+    metrics.callback(
+        "codesearch_replica_ejected",
+        "Whether a Zoekt replica is ejected",
+        lambda: _replica_stats("ejected"),
+        ["replica"],
+    )
+    metrics.callback(
+        "codesearch_replica_hedges_total",
+        "Hedged duplicate calls sent to another replica of a Zoekt shard",
+        lambda: {(str(index),): replicas.stats()["hedges"] for index, replicas in enumerate(zoekt_shards)},
+        ["shard"],
+        kind="counter",
+    )
+    metrics.callback(
+        "codesearch_replica_failovers_total",
+        "Calls retried on another replica of a Zoekt shard after a failure",
+        lambda: {(str(index),): replicas.stats()["failovers"] for index, replicas in enumerate(zoekt_shards)},
+        ["shard"],
+        kind="counter",
+    )
+
+if zoekt_router is not None:
+    metrics.callback(
+        "codesearch_shard_repositories",
+        "Repositories indexed per Zoekt shard, from the routing map",
+        lambda: {(str(index),): count for index, count in enumerate(zoekt_router.stats()["repositories"])},
+        ["shard"],
+    )
+    metrics.callback(
+        "codesearch_shard_lookups_total",
+        "Queries and fetches sent to the owning Zoekt shards only (routed) or to all of them (fanned_out)",
+        lambda: {("routed",): zoekt_router.routed, ("fanned_out",): zoekt_router.fanned_out},
+        ["route"],
+        kind="counter",
+    )
+
+
+@server.custom_route("/metrics", methods=["GET"])
+async def metrics_endpoint(request: Request) -> PlainTextResponse:
+    """Expose metrics in the Prometheus text format."""
+    if config.workers > 1:
+        # Any worker may answer on the shared socket, so its counters would jump between processes
+        last_port = config.metrics_port + config.workers - 1
+        return PlainTextResponse(
+            f"Metrics are served per worker on ports {config.metrics_port}-{last_port}", status_code=404
+        )
+    return await _render_metrics(request)
+
+
+async def _render_metrics(request: Request) -> PlainTextResponse:
+    return PlainTextResponse(metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+def _middleware() -> List[Middleware]:
+    """HTTP middleware of every app served, in any mode."""
+    if not config.response_compression:
+        return []
+    return [
+        Middleware(
+            CompressionMiddleware,
+            minimum_size=config.response_compression_min_size,
+            level=config.response_compression_level,
+            observer=_observe_compression,
+        )
+    ]
+
+
 def _register_tools() -> None:
     """Register MCP tools with the server."""
     tool_descriptions = {
         "search": SEARCH_TOOL_DESCRIPTION,
         "search_prompt_guide": SEARCH_PROMPT_GUIDE_DESCRIPTION,
         "fetch_content": FETCH_CONTENT_DESCRIPTION,
+        "fetch_contents": FETCH_CONTENTS_DESCRIPTION,
     }
 
     tools = [
         (search, "search"),
         (search_prompt_guide, "search_prompt_guide"),
         (fetch_content, "fetch_content"),
+        (fetch_contents, "fetch_contents"),
     ]
 
     for tool_func, tool_name in tools:
@@ -256,18 +873,103 @@ async def _run_server() -> None:
             host="0.0.0.0",
             path="/codesearch/mcp",
             port=config.streamable_http_port,
+            middleware=_middleware(),
         ),
-        server.run_http_async(transport="sse", host="0.0.0.0", port=config.sse_port),
+        server.run_http_async(transport="sse", host="0.0.0.0", port=config.sse_port, middleware=_middleware()),
     ]
     await asyncio.gather(*tasks)
 
 
+class _WorkerServer(uvicorn.Server):
+    """Uvicorn server leaving signal handling to the worker, which stops all its servers at once."""
+
+    @contextlib.contextmanager
+    def capture_signals(self) -> Generator[None, None, None]:
+        yield
+
+
+def _open_content_store(worker: Optional[int] = None) -> None:
+    """Attach the persistent content store; each worker process gets a subdirectory and share of its own."""
+    if not config.content_store_dir:
+        return
+    directory = config.content_store_dir
+    max_bytes = config.content_store_max_bytes
+    if worker is not None:
+        directory = os.path.join(directory, f"worker-{worker}")
+        max_bytes //= config.workers
+    content_cache.store = PersistentContentStore(directory, max_bytes=max_bytes)
+
+
+async def _serve_worker(listeners: List[Tuple[ASGIApp, socket.socket]]) -> None:
+    """Serve the given (app, socket) listeners until SIGTERM, then drain in-flight requests."""
+    servers = []
+    for app, sock in listeners:
+        uvicorn_config = uvicorn.Config(
+            app,
+            lifespan="on",
+            timeout_graceful_shutdown=config.graceful_timeout,
+            log_level=server.settings.log_level.lower(),
+        )
+        servers.append((_WorkerServer(uvicorn_config), sock))
+
+    def drain() -> None:
+        logger.info(f"Worker {os.getpid()} draining...")
+        for uvicorn_server, _ in servers:
+            uvicorn_server.should_exit = True
+
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, drain)
+    await asyncio.gather(*(uvicorn_server.serve(sockets=[sock]) for uvicorn_server, sock in servers))
+
+
+def _run_workers() -> None:
+    """Serve from pre-forked worker processes that share the listening sockets.
+
+    Streamable HTTP runs stateless, so any worker can answer any request. SSE
+    sessions live in the process that opened the stream, so SSE is served by
+    worker 0 only. Each worker serves its own metrics on a port of its own, so
+    every worker is a separate scrape target.
+    """
+    server.settings.stateless_http = True
+    streamable_http_socket = bind_socket("0.0.0.0", config.streamable_http_port)
+    sse_socket = bind_socket("0.0.0.0", config.sse_port)
+    # Bound up front so a restarted worker finds its port still held
+    metrics_sockets = [bind_socket("0.0.0.0", config.metrics_port + index) for index in range(config.workers)]
+
+    def worker(index: int) -> None:
+        _open_content_store(index)
+        listeners: List[Tuple[ASGIApp, socket.socket]] = [
+            (
+                server.http_app(path="/codesearch/mcp", transport="streamable-http", middleware=_middleware()),
+                streamable_http_socket,
+            ),
+            (Starlette(routes=[Route("/metrics", _render_metrics, methods=["GET"])]), metrics_sockets[index]),
+        ]
+        if index == 0:
+            listeners.append((server.http_app(transport="sse", middleware=_middleware()), sse_socket))
+        else:
+            sse_socket.close()
+        for other, sock in enumerate(metrics_sockets):
+            if other != index:
+                sock.close()
+        asyncio.run(_serve_worker(listeners))
+
+    # Workers stop on their own after the graceful timeout; the margin covers the app shutdown
+    PreforkSupervisor(worker, config.workers, graceful_timeout=config.graceful_timeout + 5).run()
+
+
 def main() -> None:
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
     _register_tools()
 
+    if config.workers > 1:
+        logger.info(f"Starting Code Search MCP server with {config.workers} workers...")
+        _run_workers()
+        logger.info("Server has shut down.")
+        return
+
+    _open_content_store()
     try:
         logger.info("Starting Code Search MCP server...")
         asyncio.run(_run_server())